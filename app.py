@@ -3,31 +3,40 @@ import datetime
 import io
 import json
 import os
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 
 import pandas as pd
 import streamlit as st
 from redis import Redis
-from rq import Queue
 from localDB import (
+    EXTRACTION_PROVISIONAL,
     STATUS_FINALIZE_PENDING,
     STATUS_FINALIZED,
     STATUS_HITL_REVIEW,
     STATUS_PROCESSING,
     STATUS_STORED,
     finalize_pending_documents,
-    get_all_transactions,
-    get_document_items,
+    get_counters,
+    get_document_items_page,
     get_document_summaries,
+    get_extraction_history,
     get_latest_extraction_payload,
+    get_llm_gating_stats,
+    get_memory_stats_by_doc_type,
+    get_monthly_rollup,
+    get_merchant_category_stats,
+    get_slot_status,
+    get_transactions_page,
     init_db,
     init_ingest_db,
+    list_concurrency_decisions,
     list_ingest_documents,
+    list_spreadsheet_layouts,
     insert_transactions,
-    store_raw_document,
+    store_raw_documents,
     submit_hitl_review,
 )
-from tasks import process_document_job
+from tasks import enqueue_documents, get_redis_connection
 
 init_db()
 init_ingest_db()
@@ -126,11 +135,12 @@ def render_preview(arq):
         return
     if ext in ["csv", "xlsx"]:
         try:
+            # Só as primeiras linhas: exports grandes não são lidos inteiros para o preview.
             if ext == "csv":
-                df = pd.read_csv(io.BytesIO(arq.getvalue()))
+                df = pd.read_csv(io.BytesIO(arq.getvalue()), nrows=30)
             else:
-                df = pd.read_excel(io.BytesIO(arq.getvalue()))
-            st.dataframe(df.head(30), width="stretch")
+                df = pd.read_excel(io.BytesIO(arq.getvalue()), nrows=30)
+            st.dataframe(df, width="stretch")
         except Exception as exc:
             st.warning(f"Preview indisponível: {exc}")
         return
@@ -141,9 +151,8 @@ def _get_redis_url() -> str:
     return st.secrets.get("REDIS_URL", os.getenv("REDIS_URL", "redis://localhost:6379/0"))
 
 
-def _get_queue() -> Queue:
-    redis_conn = Redis.from_url(_get_redis_url())
-    return Queue("mn2512", connection=redis_conn)
+def _get_redis() -> Redis:
+    return get_redis_connection(_get_redis_url())
 
 
 def render_import_store():
@@ -165,37 +174,31 @@ def render_import_store():
     if st.button("💾 Importar e Armazenar", type="primary"):
         salvos = 0
         duplicados = 0
-        enfileirados = 0
-        falhas_fila = 0
 
         try:
-            queue = _get_queue()
+            redis_conn = _get_redis()
         except Exception as exc:
             st.error(f"Falha ao conectar no Redis/RQ: {exc}")
             return
 
-        for arq in arquivos:
-            doc = store_raw_document(arq.name, arq.type or "application/octet-stream", arq.getvalue())
+        pendentes = []
+        docs = store_raw_documents([(arq.name, arq.type or "application/octet-stream", arq) for arq in arquivos])
+        for doc in docs:
             if doc["is_duplicate"]:
                 duplicados += 1
                 if doc.get("status") not in [STATUS_FINALIZED, STATUS_PROCESSING]:
-                    try:
-                        queue.enqueue(process_document_job, doc["id"], job_timeout=900)
-                        enfileirados += 1
-                    except Exception:
-                        falhas_fila += 1
+                    pendentes.append(doc)
                 continue
 
             salvos += 1
-            try:
-                queue.enqueue(process_document_job, doc["id"], job_timeout=900)
-                enfileirados += 1
-            except Exception:
-                falhas_fila += 1
+            pendentes.append(doc)
+
+        # Menor custo estimado primeiro; PDFs escaneados longos vão para a raia lenta.
+        enfileirados, coalescidos, falhas_fila = enqueue_documents(pendentes, redis_conn)
 
         st.success(
             f"Salvo com sucesso. Novos: {salvos} | Duplicados (sha256): {duplicados} | "
-            f"Enfileirados: {enfileirados} | Falhas fila: {falhas_fila}"
+            f"Enfileirados: {enfileirados} | Já na fila: {coalescidos} | Falhas fila: {falhas_fila}"
         )
 
 
@@ -220,6 +223,59 @@ def render_pipeline():
     error_count = int(df_docs["status"].astype(str).str.startswith("ERROR").sum())
     c4.metric("ERROR_*", error_count)
 
+    slots = get_slot_status()
+    st.caption(
+        f"Vagas de processamento: {slots['active']}/{slots['limit']} ocupadas | "
+        f"leases expirados: {slots['expired']} | recuperados pelo reaper: {slots['reclaimed_total']} | "
+        f"espera média por vaga: {slots['avg_wait_s']:.1f}s em {slots['waits']} espera(s), {slots['wakeups']} despertada(s)"
+    )
+
+    coalesced = int(get_counters().get("enqueue_coalesced", 0))
+    st.caption(f"Enfileiramentos coalescidos (documento já tinha job pendente): {coalesced}")
+
+    decisions = list_concurrency_decisions(limit=50)
+    if decisions:
+        with st.expander("Controlador de concorrência (AIMD)", expanded=False):
+            st.dataframe(pd.DataFrame(decisions), width="stretch", hide_index=True)
+
+    memo = get_merchant_category_stats()
+    st.caption(
+        f"Memória de categorias: {memo['entries']} estabelecimento(s) | "
+        f"acertos {memo['hits']}/{memo['lookups']} ({memo['hit_rate']:.0%})"
+    )
+
+    gating = get_llm_gating_stats()
+    if gating:
+        with st.expander("Chamadas ao LLM por tipo de documento", expanded=False):
+            st.dataframe(pd.DataFrame(gating), width="stretch", hide_index=True)
+
+    memory = get_memory_stats_by_doc_type()
+    if memory:
+        with st.expander("Memória (RSS) por tipo de documento", expanded=False):
+            st.dataframe(pd.DataFrame(memory), width="stretch", hide_index=True)
+
+    layouts = list_spreadsheet_layouts()
+    if layouts:
+        with st.expander("Layouts de planilha conhecidos", expanded=False):
+            st.dataframe(
+                pd.DataFrame(
+                    [
+                        {
+                            "fingerprint": item["fingerprint"][:12],
+                            "colunas": ", ".join(f"{k}={v}" for k, v in item["layout"]["colunas"].items() if v),
+                            "sep": item["layout"]["sep"],
+                            "formato_data": item["layout"]["formato_data"],
+                            "decimal": item["layout"]["decimal"],
+                            "usos": item["hits"],
+                            "ultimo_uso": item["last_used_at"],
+                        }
+                        for item in layouts
+                    ]
+                ),
+                width="stretch",
+                hide_index=True,
+            )
+
     st.subheader("Documentos")
     st.dataframe(df_docs, width="stretch")
 
@@ -251,8 +307,14 @@ def render_review():
         return
 
     payload_uri, payload, checks, extractor, confidence, metrics = payload_info
+    versoes = get_extraction_history(selected)
     st.caption(f"Payload: {payload_uri}")
-    st.caption(f"Método: {extractor} | Confiança: {confidence:.2f}")
+    st.caption(f"Método: {extractor} | Confiança: {confidence:.2f} | Versão: {versoes[0]['version'] if versoes else 1}")
+    if versoes and versoes[0]["status"] == EXTRACTION_PROVISIONAL:
+        st.info("Extração provisória (regex). O refinamento via LLM está em andamento; recarregue para ver a nova versão.")
+    if len(versoes) > 1:
+        with st.expander("Versões da extração", expanded=False):
+            st.dataframe(pd.DataFrame(versoes), width="stretch", hide_index=True)
     if metrics:
         st.json({"metrics": metrics})
 
@@ -698,24 +760,70 @@ def render_history_section():
 
     st.subheader("Itens dos documentos")
     filtro_doc = None if selected_doc_id in [None, "Todos"] else selected_doc_id
-    df_itens = get_document_items(filtro_doc)
+    cursores_itens = _cursores_da_pagina("hist_itens", (filtro_doc,))
+    df_itens, proximo_itens = get_document_items_page(filtro_doc, after=cursores_itens[-1])
     if df_itens.empty:
         st.info("Nenhum item de documento encontrado.")
     else:
         df_itens["data"] = pd.to_datetime(df_itens["data"], errors="coerce")
-        st.dataframe(
-            df_itens.sort_values(["document_id", "data", "id"], ascending=[False, False, False]),
-            width="stretch",
-            hide_index=True,
-        )
+        st.dataframe(df_itens, width="stretch", hide_index=True)
+        _navegacao_da_pagina("hist_itens", cursores_itens, proximo_itens)
 
-    st.subheader("Transações (legado/completo)")
-    df_historico = get_all_transactions()
+    st.subheader("Resumo mensal")
+    df_mensal = get_monthly_rollup(group_by=["month", "tipo"])
+    if df_mensal.empty:
+        st.info("Nenhuma transação agregada.")
+    else:
+        df_pivot = df_mensal.pivot_table(index="month", columns="tipo", values="total", aggfunc="sum", fill_value=0.0)
+        st.dataframe(df_pivot.sort_index(ascending=False), width="stretch")
+        with st.expander("Por categoria", expanded=False):
+            st.dataframe(get_monthly_rollup(group_by=["month", "tipo", "categoria"]), width="stretch", hide_index=True)
+
+    st.subheader("Transações")
+    # Opções dos filtros vêm do agregado mensal, sem ler `transacoes`.
+    df_dimensoes = get_monthly_rollup(group_by=["categoria", "fonte"])
+    c1, c2, c3, c4, c5 = st.columns(5)
+    data_inicio = c1.date_input("De", value=None, key="hist_de")
+    data_fim = c2.date_input("Até", value=None, key="hist_ate")
+    tipo = c3.selectbox("Tipo", ["Todos", "entrada", "saida"], key="hist_tipo")
+    categoria = c4.selectbox("Categoria", ["Todas"] + sorted(set(df_dimensoes.get("categoria", []))), key="hist_categoria")
+    fonte = c5.selectbox("Fonte", ["Todas"] + sorted(set(df_dimensoes.get("fonte", []))), key="hist_fonte")
+
+    filtros = {
+        "start_date": data_inicio.isoformat() if data_inicio else None,
+        "end_date": data_fim.isoformat() if data_fim else None,
+        "tipo": None if tipo == "Todos" else tipo,
+        "categoria": None if categoria == "Todas" else categoria,
+        "fonte": None if fonte == "Todas" else fonte,
+        "document_id": filtro_doc,
+    }
+    cursores = _cursores_da_pagina("hist_transacoes", tuple(filtros.values()))
+    df_historico, proximo = get_transactions_page(after=cursores[-1], **filtros)
     if df_historico.empty:
         st.info("Nenhum registro encontrado.")
         return
     df_historico["data"] = pd.to_datetime(df_historico["data"], errors="coerce")
-    st.dataframe(df_historico.sort_values("data", ascending=False), width="stretch", hide_index=True)
+    st.dataframe(df_historico, width="stretch", hide_index=True)
+    _navegacao_da_pagina("hist_transacoes", cursores, proximo)
+
+
+def _cursores_da_pagina(chave: str, filtros: Tuple[Any, ...]) -> List[Any]:
+    """Pilha de cursores da paginação por chave; volta à primeira página quando os filtros mudam."""
+    estado = st.session_state.setdefault(chave, {"filtros": filtros, "cursores": [None]})
+    if estado["filtros"] != filtros:
+        estado.update(filtros=filtros, cursores=[None])
+    return estado["cursores"]
+
+
+def _navegacao_da_pagina(chave: str, cursores: List[Any], proximo: Any) -> None:
+    anterior, info, seguinte = st.columns([1, 2, 1])
+    if anterior.button("◀ Anterior", key=f"{chave}_anterior", disabled=len(cursores) == 1):
+        cursores.pop()
+        st.rerun()
+    info.caption(f"Página {len(cursores)}")
+    if seguinte.button("Próxima ▶", key=f"{chave}_proxima", disabled=proximo is None):
+        cursores.append(proximo)
+        st.rerun()
 
 
 def render_income_entry():
@@ -0,0 +1 @@
+"""Benchmarks de desempenho (fora da suíte de testes)."""
@@ -0,0 +1,106 @@
+"""Benchmark: classificador local vs LLM na categorização de transações.
+
+Uso:
+    python -m benchmarks.bench_classificador            # usa `transacoes` do DB principal
+    python -m benchmarks.bench_classificador --sintetico
+    python -m benchmarks.bench_classificador --llm 50   # também mede o LLM em 50 amostras
+"""
+import argparse
+import random
+import sqlite3
+import time
+
+import numpy as np
+
+import localDB
+from classificador import ClassificadorCategorias
+from llm_extractor import categorizar_transacoes_llm
+
+SINTETICO = {
+    "Alimentação": ["RESTAURANTE", "PADARIA", "IFOOD", "SUPERMERCADO", "LANCHONETE", "PIZZARIA", "ACOUGUE"],
+    "Transporte": ["UBER TRIP", "99 TAXI", "POSTO SHELL", "ESTACIONAMENTO", "METRO", "POSTO IPIRANGA"],
+    "Serviços": ["NETFLIX", "SPOTIFY", "CLARO", "VIVO", "ENERGIA ENEL", "SABESP", "ACADEMIA"],
+    "Outros": ["MAGAZINE LUIZA", "AMAZON", "LOJAS AMERICANAS", "PRESENTES", "PAPELARIA", "PET SHOP"],
+}
+
+
+def _dados_sinteticos(n: int, seed: int = 7):
+    rng = random.Random(seed)
+    textos, categorias = [], []
+    for _ in range(n):
+        categoria = rng.choice(list(SINTETICO))
+        base = rng.choice(SINTETICO[categoria])
+        sufixo = rng.choice(["SP", "RJ", "CENTRO", "*", "", "LTDA", "BR"])
+        textos.append(f"{base} {sufixo} {rng.randint(1, 9999)}".strip())
+        categorias.append(categoria)
+    return textos, categorias
+
+
+def _dados_db():
+    with localDB.get_conn(localDB.DB_NAME) as conn:
+        rows = conn.execute(
+            "SELECT descricao, categoria FROM transacoes WHERE categoria IS NOT NULL AND TRIM(categoria) <> ''"
+        ).fetchall()
+    return [r[0] for r in rows], [r[1] for r in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sintetico", action="store_true", help="usa dados sintéticos em vez do DB")
+    parser.add_argument("--n", type=int, default=20000, help="tamanho do dataset sintético")
+    parser.add_argument("--llm", type=int, default=0, help="amostras de holdout para comparar com o LLM")
+    args = parser.parse_args()
+
+    textos, categorias = [], []
+    if not args.sintetico:
+        try:
+            textos, categorias = _dados_db()
+        except sqlite3.Error:
+            textos = []
+    if len(textos) < 50:
+        print(f"[bench] {len(textos)} transações revisadas no DB; usando {args.n} sintéticas.")
+        textos, categorias = _dados_sinteticos(args.n)
+
+    idx = list(range(len(textos)))
+    random.Random(42).shuffle(idx)
+    corte = int(len(idx) * 0.8)
+    treino, teste = idx[:corte], idx[corte:]
+    x_train = [textos[i] for i in treino]
+    y_train = [categorias[i] for i in treino]
+    x_test = [textos[i] for i in teste]
+    y_test = np.array([categorias[i] for i in teste])
+
+    inicio = time.perf_counter()
+    model = ClassificadorCategorias().fit(x_train, y_train)
+    treino_s = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    labels, conf = model.predict(x_test)
+    predict_ms = (time.perf_counter() - inicio) * 1000
+    labels = np.array(labels)
+
+    confiantes = conf >= localDB.CATEGORY_MODEL_MIN_CONF
+    print(f"treino: {len(x_train)} linhas em {treino_s:.2f}s | classes={model.classes}")
+    print(f"local: {len(x_test)} linhas em {predict_ms:.1f} ms ({predict_ms / max(1, len(x_test)) * 1000:.1f} µs/linha)")
+    print(f"local: acurácia={float((labels == y_test).mean()):.3f}")
+    print(
+        f"local: confiança>={localDB.CATEGORY_MODEL_MIN_CONF:.2f} em {float(confiantes.mean()):.1%} das linhas, "
+        f"acurácia nelas={float((labels[confiantes] == y_test[confiantes]).mean()) if confiantes.any() else 0.0:.3f}"
+    )
+
+    if args.llm:
+        amostra = list(range(min(args.llm, len(x_test))))
+        transacoes = [{"descricao": x_test[i]} for i in amostra]
+        inicio = time.perf_counter()
+        saida, erro = categorizar_transacoes_llm(transacoes)
+        llm_ms = (time.perf_counter() - inicio) * 1000
+        if erro:
+            print(f"llm: indisponível ({erro})")
+        else:
+            llm_labels = np.array([t["categoria"] for t in saida])
+            print(f"llm: {len(amostra)} linhas em {llm_ms:.0f} ms | acurácia={float((llm_labels == y_test[amostra]).mean()):.3f}")
+            print(f"local (mesma amostra): acurácia={float((labels[amostra] == y_test[amostra]).mean()):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Benchmark: leitura de CSV por separador e encoding — legado (decode + engine python) vs C vs pyarrow.
+
+Só o parse (sem a normalização). "legado" reproduz a leitura antiga (bytes decodificados como utf-8 com
+errors="ignore" e engine python); "c" é a leitura de `iterar_planilha` (encoding detectado, engine C em
+blocos); "pyarrow" lê o arquivo inteiro com o engine pyarrow, como referência (não lê em blocos).
+"acentos" conta descrições com "ÇÃO" preservado.
+
+Uso:
+    python -m benchmarks.bench_csv_engines
+    python -m benchmarks.bench_csv_engines --linhas 500000
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+import pandas as pd
+
+from planilhas import PLANILHA_CHUNK_ROWS, _blocos_csv, _detectar_encoding, _detectar_sep
+
+SEPARADORES = {";": "ponto-e-vírgula", ",": "vírgula", "\t": "tab", "|": "pipe"}
+ENCODINGS = ["utf-8", "utf-8-sig", "cp1252"]
+
+
+class _Upload(io.BytesIO):
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+        self.name = name
+
+
+def _gerar(linhas: int, sep: str, encoding: str) -> bytes:
+    rng = np.random.default_rng(7)
+    df = pd.DataFrame(
+        {
+            "Data": pd.date_range("2020-01-01", periods=linhas, freq="min").strftime("%d/%m/%Y"),
+            "Descrição": [f"TRANSAÇÃO LOJA {i % 5000}" for i in range(linhas)],
+            "Valor": [f"{v:.2f}".replace(".", ",") if sep != "," else f"{v:.2f}" for v in rng.normal(0, 500, linhas)],
+        }
+    )
+    return df.to_csv(sep=sep, index=False).encode(encoding)
+
+
+def _legado(data: bytes) -> pd.DataFrame:
+    sep = _detectar_sep(data)
+    return pd.read_csv(io.StringIO(data.decode("utf-8", errors="ignore")), sep=sep, engine="python")
+
+
+def _engine_c(data: bytes) -> pd.DataFrame:
+    encoding = _detectar_encoding(data[:1024 * 1024])
+    blocos = _blocos_csv(_Upload(data, "bench.csv"), PLANILHA_CHUNK_ROWS, _detectar_sep(data, encoding), encoding, None)
+    return pd.concat(list(blocos), ignore_index=True)
+
+
+def _pyarrow(data: bytes) -> pd.DataFrame:
+    encoding = _detectar_encoding(data[:1024 * 1024])
+    return pd.read_csv(io.BytesIO(data), sep=_detectar_sep(data, encoding), engine="pyarrow", encoding=encoding)
+
+
+def _acentos(df: pd.DataFrame) -> int:
+    coluna = next(c for c in df.columns if str(c).lower().startswith("descri"))
+    return int(df[coluna].astype(str).str.contains("ÇÃO", regex=False).sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--linhas", type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f"[bench] {args.linhas} linhas por variante")
+    print(f"{'separador':>16} {'encoding':>10} | {'legado':>8} {'c':>8} {'pyarrow':>8} | acentos legado/c")
+    for sep, nome_sep in SEPARADORES.items():
+        for encoding in ENCODINGS:
+            data = _gerar(args.linhas, sep, encoding)
+            tempos, resultados = {}, {}
+            for nome, leitor in (("legado", _legado), ("c", _engine_c), ("pyarrow", _pyarrow)):
+                inicio = time.perf_counter()
+                try:
+                    resultados[nome] = leitor(data)
+                    tempos[nome] = f"{time.perf_counter() - inicio:7.2f}s"
+                except Exception as exc:
+                    tempos[nome] = "erro"
+                    print(f"[bench] {nome} falhou ({nome_sep}, {encoding}): {exc}")
+            acentos = "/".join(str(_acentos(resultados[n])) if n in resultados else "-" for n in ("legado", "c"))
+            print(f"{nome_sep:>16} {encoding:>10} | {tempos['legado']:>8} {tempos['c']:>8} {tempos['pyarrow']:>8} | {acentos}")
+
+
+if __name__ == "__main__":
+    main()
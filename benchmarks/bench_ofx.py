@@ -0,0 +1,104 @@
+"""Benchmark: parser OFX legado (findall + regex por campo) vs tokenizador em passada única.
+
+Os dois usam as mesmas funções de data/parcelas; a diferença medida é a tokenização e a memória.
+
+Uso:
+    python -m benchmarks.bench_ofx                 # 50k transações sintéticas
+    python -m benchmarks.bench_ofx --n 200000
+    python -m benchmarks.bench_ofx --xml           # OFX 2.x (XML) em vez de 1.x (SGML)
+"""
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+import tracemalloc
+
+from parsers.ofx_parser import StatementLine, _extract_installments, _norm_desc, _parse_ofx_date, iter_ofx_lines
+
+MEMOS = ["COMPRA MERCADO {i}", "PARC {p}/10 LOJA {i}", "PAGAMENTO APP", "PIX RECEBIDO {i}", "SÃO JOÃO PADARIA"]
+
+
+def _gerar(n: int, xml: bool, seed: int = 7) -> bytes:
+    rng = random.Random(seed)
+    if xml:
+        partes = ['<?xml version="1.0" encoding="UTF-8"?>\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>\n']
+    else:
+        partes = ["OFXHEADER:100\nDATA:OFXSGML\nVERSION:102\nCHARSET:1252\n\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>\n"]
+    fim = "</{t}>" if xml else ""
+    for i in range(n):
+        memo = rng.choice(MEMOS).format(i=i, p=rng.randint(1, 10))
+        campos = [
+            ("TRNTYPE", "DEBIT"),
+            ("DTPOSTED", f"2026{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}120000[-3:BRT]"),
+            ("TRNAMT", f"{rng.uniform(-900, 900):.2f}"),
+            ("FITID", f"{i:012d}"),
+            ("MEMO", memo),
+        ]
+        corpo = "".join(f"<{t}>{v}{fim.format(t=t)}\n" for t, v in campos)
+        partes.append(f"<STMTTRN>\n{corpo}</STMTTRN>\n")
+    partes.append("</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n")
+    return "".join(partes).encode("utf-8" if xml else "cp1252")
+
+
+def _legado(ofx_bytes: bytes):
+    """Caminho antigo: texto inteiro, `re.findall` dos blocos e um `re.search` compilado por campo."""
+    text = ofx_bytes.decode("latin-1", errors="ignore")
+    blocks = re.findall(r"<STMTTRN>(.*?)</STMTTRN>", text, flags=re.DOTALL | re.IGNORECASE)
+    lines = []
+
+    def tag(block, name):
+        match = re.search(rf"<{name}>\s*([^\r\n<]+)", block, flags=re.IGNORECASE)
+        return match.group(1).strip() if match else None
+
+    for block in blocks:
+        memo = tag(block, "MEMO") or tag(block, "NAME") or tag(block, "PAYEE")
+        descricao = _norm_desc(memo or "") or "Não identificado"
+        try:
+            valor = float((tag(block, "TRNAMT") or "0").replace(",", "."))
+        except ValueError:
+            valor = 0.0
+        p_atual, p_total = _extract_installments(descricao)
+        lines.append(StatementLine(_parse_ofx_date(tag(block, "DTPOSTED") or ""), descricao, valor, None, p_atual, p_total))
+    return lines
+
+
+def _medir(nome: str, fn):
+    inicio = time.perf_counter()
+    total = fn()
+    tempo = time.perf_counter() - inicio
+    # Segunda execução só para a memória: o tracemalloc distorce o tempo.
+    tracemalloc.start()
+    fn()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{nome:>22}: {tempo:6.2f}s  {total} linhas  pico alocado={pico / (1024 * 1024):.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=50000, help="transações no OFX sintético")
+    parser.add_argument("--xml", action="store_true", help="gera OFX 2.x (XML)")
+    args = parser.parse_args()
+
+    data = _gerar(args.n, args.xml)
+    print(f"[bench] {args.n} transações, {len(data) / (1024 * 1024):.1f} MB ({'XML' if args.xml else 'SGML'})")
+
+    with tempfile.NamedTemporaryFile(suffix=".ofx", delete=False) as handler:
+        handler.write(data)
+    try:
+        _medir("legado (bytes)", lambda: len(_legado(data)))
+        _medir("streaming (bytes)", lambda: sum(1 for _ in iter_ofx_lines(data)))
+
+        def _do_arquivo():
+            with open(handler.name, "rb") as arquivo:
+                return sum(1 for _ in iter_ofx_lines(arquivo))
+
+        _medir("streaming (arquivo)", _do_arquivo)
+    finally:
+        os.remove(handler.name)
+
+
+if __name__ == "__main__":
+    main()
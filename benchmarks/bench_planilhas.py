@@ -0,0 +1,96 @@
+"""Benchmark: planilha inteira (`processar_planilha` + `insert_transactions`) vs blocos (`import_spreadsheet`).
+
+Cada modo roda em um subprocesso novo com um DB temporário; mede tempo e pico de RSS (ru_maxrss).
+
+Uso:
+    python -m benchmarks.bench_planilhas --linhas 300000
+    python -m benchmarks.bench_planilhas --linhas 100000 --xlsx --chunk 20000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+
+class _Arquivo:
+    def __init__(self, path: str):
+        self._handler = open(path, "rb")
+        self.name = os.path.basename(path)
+
+    def __getattr__(self, attr):
+        return getattr(self._handler, attr)
+
+
+def _gerar(path: str, linhas: int) -> None:
+    rng = np.random.default_rng(7)
+    df = pd.DataFrame(
+        {
+            "Data": pd.date_range("2020-01-01", periods=linhas, freq="min").strftime("%d/%m/%Y"),
+            "Histórico": [f"COMPRA LOJA {i % 5000} SP" for i in range(linhas)],
+            "Valor": [f"{v:.2f}".replace(".", ",") for v in rng.normal(0, 500, linhas)],
+        }
+    )
+    if path.endswith(".xlsx"):
+        df.to_excel(path, index=False)
+    else:
+        df.to_csv(path, sep=";", index=False)
+
+
+def _medir(modo: str, path: str, chunk: int) -> dict:
+    import localDB
+
+    localDB.DB_NAME = os.path.join(os.path.dirname(path), f"bench_{modo}.db")
+    localDB.init_db()
+    antes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    inicio = time.perf_counter()
+    if modo == "inteiro":
+        df, err = localDB.processar_planilha(_Arquivo(path))
+        inseridas = localDB.insert_transactions(df) if df is not None else 0
+    else:
+        inseridas, err = localDB.import_spreadsheet(_Arquivo(path), chunk_rows=chunk)
+    return {
+        "modo": modo,
+        "erro": err,
+        "inseridas": inseridas,
+        "tempo_s": round(time.perf_counter() - inicio, 2),
+        "rss_delta_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - antes, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--linhas", type=int, default=300000)
+    parser.add_argument("--chunk", type=int, default=50000)
+    parser.add_argument("--xlsx", action="store_true", help="gera xlsx em vez de CSV")
+    parser.add_argument("--modo", choices=["inteiro", "blocos"], help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.modo:
+        print(json.dumps(_medir(args.modo, args.path, args.chunk)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "export.xlsx" if args.xlsx else "export.csv")
+        _gerar(path, args.linhas)
+        print(f"[bench] {args.linhas} linhas ({os.path.getsize(path) / (1024 * 1024):.1f} MB) chunk={args.chunk}")
+        for modo in ("inteiro", "blocos"):
+            saida = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_planilhas", "--modo", modo, "--path", path, "--chunk", str(args.chunk)],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            r = json.loads(saida.strip().splitlines()[-1])
+            print(f"{modo:>8}: {r['tempo_s']:.2f}s inseridas={r['inseridas']} Δpico RSS={r['rss_delta_mb']:.1f} MB {r['erro'] or ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark: pico de RSS ao abrir um raw com cópia em bytes vs mmap (RawUpload).
+
+Cada modo roda em um subprocesso novo, para que o ru_maxrss de um não contamine o outro.
+
+Uso:
+    python -m benchmarks.bench_raw_memory caminho/scan.pdf
+    python -m benchmarks.bench_raw_memory --sintetico 50   # PDF sintético de ~50 MB
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+import fitz
+
+
+def _peak_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _medir(modo: str, path: str) -> dict:
+    import localDB
+
+    antes = _peak_mb()
+    if modo == "copia":
+        with open(path, "rb") as handler:
+            upload = io.BytesIO(handler.read())
+        dados = upload.getvalue()
+    else:
+        upload = localDB.RawUpload(path, os.path.basename(path), "application/pdf")
+        dados = upload.getbuffer()
+    with fitz.open(stream=dados, filetype="pdf") as pdf:
+        paginas = pdf.page_count
+    del dados
+    upload.close()
+    return {"modo": modo, "paginas": paginas, "rss_delta_mb": round(_peak_mb() - antes, 1), "rss_peak_mb": round(_peak_mb(), 1)}
+
+
+def _pdf_sintetico(alvo_mb: int) -> str:
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    with fitz.open() as pdf:
+        for _ in range(alvo_mb):
+            page = pdf.new_page()
+            # Imagem incompressível (ruído) de ~1 MB por página, como um scan.
+            page.insert_image(page.rect, stream=_png(os.urandom(1024 * 1024)))
+        pdf.save(path)
+    return path
+
+
+def _png(ruido: bytes) -> bytes:
+    lado = 591
+    pix = fitz.Pixmap(fitz.csRGB, lado, lado, ruido[: lado * lado * 3], False)
+    return pix.tobytes("png")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", help="PDF a medir")
+    parser.add_argument("--sintetico", type=int, default=0, help="gera um PDF sintético com N MB")
+    parser.add_argument("--modo", choices=["copia", "mmap"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.modo:
+        print(json.dumps(_medir(args.modo, args.path)))
+        return
+
+    path = args.path
+    if args.sintetico:
+        path = _pdf_sintetico(args.sintetico)
+    if not path:
+        parser.error("informe um PDF ou --sintetico N")
+
+    tamanho_mb = os.path.getsize(path) / (1024 * 1024)
+    print(f"[bench] {path} ({tamanho_mb:.1f} MB)")
+    for modo in ("copia", "mmap"):
+        saida = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_raw_memory", path, "--modo", modo],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        r = json.loads(saida.strip().splitlines()[-1])
+        print(f"{modo:>6}: páginas={r['paginas']} Δpico RSS={r['rss_delta_mb']:.1f} MB pico={r['rss_peak_mb']:.1f} MB")
+
+    if args.sintetico:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Classificador local de categorias (somente NumPy) treinado com transações revisadas."""
+import argparse
+import os
+import threading
+import unicodedata
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+N_FEATURES = 2 ** 18
+NGRAM_RANGE = (2, 4)
+MODEL_PATH = os.getenv("CATEGORY_MODEL_PATH", os.path.join("data", "models", "categorias.npz"))
+
+_cache_lock = threading.Lock()
+_model_cache: Dict[str, Tuple[float, "ClassificadorCategorias"]] = {}
+
+
+def _normalizar(texto: str) -> str:
+    base = unicodedata.normalize("NFKD", str(texto or "")).encode("ascii", "ignore").decode("ascii").lower()
+    base = "".join(ch if ch.isalpha() else " " for ch in base)
+    return " ".join(base.split())
+
+
+def _ngram_indices(texto: str, n_features: int, ngram_range: Tuple[int, int]) -> np.ndarray:
+    t = f" {_normalizar(texto)} "
+    grams = {t[i:i + n] for n in range(ngram_range[0], ngram_range[1] + 1) for i in range(len(t) - n + 1)}
+    return np.fromiter((zlib.crc32(g.encode("ascii")) % n_features for g in grams), dtype=np.int64, count=len(grams))
+
+
+class ClassificadorCategorias:
+    """Regressão logística multinomial sobre n-gramas de caracteres com hashing."""
+
+    def __init__(self, n_features: int = N_FEATURES, ngram_range: Tuple[int, int] = NGRAM_RANGE):
+        self.n_features = int(n_features)
+        self.ngram_range = (int(ngram_range[0]), int(ngram_range[1]))
+        self.classes: List[str] = []
+        self.weights: Optional[np.ndarray] = None
+        self.bias: Optional[np.ndarray] = None
+
+    def _vetorizar(self, textos: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Retorna (índices, valores, comprimentos) em formato CSR compacto, com norma L2 por linha."""
+        partes = [_ngram_indices(t, self.n_features, self.ngram_range) for t in textos]
+        lengths = np.fromiter((len(p) for p in partes), dtype=np.int64, count=len(partes))
+        indices = np.concatenate(partes) if partes else np.empty(0, dtype=np.int64)
+        values = np.repeat(1.0 / np.sqrt(np.maximum(lengths, 1)), lengths).astype(np.float32)
+        return indices, values, lengths
+
+    def _scores(self, indices: np.ndarray, values: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        scores = np.zeros((len(lengths), len(self.classes)), dtype=np.float32)
+        nonempty = lengths > 0
+        if indices.size:
+            contrib = self.weights[indices] * values[:, None]
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))[nonempty]
+            scores[nonempty] = np.add.reduceat(contrib, starts, axis=0)
+        return scores + self.bias
+
+    @staticmethod
+    def _softmax(scores: np.ndarray) -> np.ndarray:
+        shifted = scores - scores.max(axis=1, keepdims=True)
+        exp = np.exp(shifted)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def fit(self, textos: Sequence[str], categorias: Sequence[str], epochs: int = 80, lr: float = 0.2, l2: float = 1e-4) -> "ClassificadorCategorias":
+        if len(textos) != len(categorias):
+            raise ValueError("textos e categorias devem ter o mesmo tamanho.")
+        if not textos:
+            raise ValueError("Sem exemplos para treino.")
+
+        self.classes = sorted({str(c) for c in categorias})
+        class_idx = {c: i for i, c in enumerate(self.classes)}
+        y = np.fromiter((class_idx[str(c)] for c in categorias), dtype=np.int64, count=len(categorias))
+        n, n_classes = len(y), len(self.classes)
+
+        indices, values, lengths = self._vetorizar(textos)
+        row_ids = np.repeat(np.arange(n), lengths)
+        y_onehot = np.zeros((n, n_classes), dtype=np.float32)
+        y_onehot[np.arange(n), y] = 1.0
+
+        self.weights = np.zeros((self.n_features, n_classes), dtype=np.float32)
+        self.bias = np.zeros(n_classes, dtype=np.float32)
+
+        # Adam em batch completo: poucos parâmetros ativos, converge rápido.
+        m_w = np.zeros_like(self.weights)
+        v_w = np.zeros_like(self.weights)
+        m_b = np.zeros_like(self.bias)
+        v_b = np.zeros_like(self.bias)
+        beta1, beta2, eps = 0.9, 0.999, 1e-8
+
+        for step in range(1, int(epochs) + 1):
+            probs = self._softmax(self._scores(indices, values, lengths))
+            grad_rows = (probs - y_onehot) / n
+            grad_w = np.empty_like(self.weights)
+            for c in range(n_classes):
+                grad_w[:, c] = np.bincount(indices, weights=grad_rows[row_ids, c] * values, minlength=self.n_features)
+            grad_w += l2 * self.weights
+            grad_b = grad_rows.sum(axis=0)
+
+            m_w = beta1 * m_w + (1 - beta1) * grad_w
+            v_w = beta2 * v_w + (1 - beta2) * grad_w * grad_w
+            m_b = beta1 * m_b + (1 - beta1) * grad_b
+            v_b = beta2 * v_b + (1 - beta2) * grad_b * grad_b
+            corr1 = 1 - beta1 ** step
+            corr2 = 1 - beta2 ** step
+            self.weights -= lr * (m_w / corr1) / (np.sqrt(v_w / corr2) + eps)
+            self.bias -= lr * (m_b / corr1) / (np.sqrt(v_b / corr2) + eps)
+
+        return self
+
+    def predict_proba(self, textos: Sequence[str]) -> np.ndarray:
+        if self.weights is None:
+            raise RuntimeError("Modelo não treinado.")
+        if not len(textos):
+            return np.zeros((0, len(self.classes)), dtype=np.float32)
+        return self._softmax(self._scores(*self._vetorizar(textos)))
+
+    def predict(self, textos: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+        """Retorna (categorias, confiança) para um lote de descrições."""
+        probs = self.predict_proba(textos)
+        if not len(probs):
+            return [], np.zeros(0, dtype=np.float32)
+        best = probs.argmax(axis=1)
+        return [self.classes[i] for i in best], probs[np.arange(len(best)), best]
+
+    def save(self, path: str = MODEL_PATH) -> str:
+        if self.weights is None:
+            raise RuntimeError("Modelo não treinado.")
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        rows = np.flatnonzero(np.any(self.weights != 0, axis=1))
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            rows=rows,
+            weights=self.weights[rows],
+            bias=self.bias,
+            classes=np.array(self.classes),
+            n_features=np.array(self.n_features),
+            ngram_range=np.array(self.ngram_range),
+        )
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str = MODEL_PATH) -> "ClassificadorCategorias":
+        with np.load(path, allow_pickle=False) as data:
+            model = cls(n_features=int(data["n_features"]), ngram_range=tuple(int(v) for v in data["ngram_range"]))
+            model.classes = [str(c) for c in data["classes"]]
+            model.weights = np.zeros((model.n_features, len(model.classes)), dtype=np.float32)
+            model.weights[data["rows"]] = data["weights"]
+            model.bias = data["bias"].astype(np.float32)
+        return model
+
+
+def carregar_modelo(path: str = MODEL_PATH) -> Optional[ClassificadorCategorias]:
+    """Carrega o modelo persistido (cache por mtime); retorna None se ainda não treinado."""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    with _cache_lock:
+        cached = _model_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        model = ClassificadorCategorias.load(path)
+        _model_cache[path] = (mtime, model)
+        return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Treina o classificador local de categorias a partir de `transacoes`.")
+    parser.add_argument("--model-path", default=MODEL_PATH)
+    args = parser.parse_args()
+
+    from localDB import train_category_classifier
+
+    print(train_category_classifier(model_path=args.model_path))
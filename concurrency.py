@@ -0,0 +1,82 @@
+"""Controlador AIMD do limite de documentos ativos: aumento aditivo com folga, redução multiplicativa sob pressão."""
+import math
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "1") == "1"
+CONTROLLER_INTERVAL_S = int(os.getenv("CONTROLLER_INTERVAL_S", "30"))
+
+
+@dataclass
+class AimdConfig:
+    min_limit: int = int(os.getenv("MIN_ACTIVE_DOCS", "1"))
+    max_limit: int = int(os.getenv("MAX_ACTIVE_DOCS_CEILING", str(max(2, os.cpu_count() or 2))))
+    increase_step: int = 1
+    decrease_factor: float = 0.5
+    # Acima de qualquer limite "high": reduz. Abaixo de todos os "low": aumenta. Entre eles: mantém.
+    cpu_high: float = float(os.getenv("AIMD_CPU_HIGH", "0.90"))
+    cpu_low: float = float(os.getenv("AIMD_CPU_LOW", "0.70"))
+    mem_high: float = float(os.getenv("AIMD_MEM_HIGH", "0.85"))
+    mem_low: float = float(os.getenv("AIMD_MEM_LOW", "0.70"))
+    llm_429_high: float = float(os.getenv("AIMD_LLM_429_HIGH", "0.10"))
+    latency_high_s: float = float(os.getenv("AIMD_LATENCY_HIGH_S", "300"))
+
+
+@dataclass
+class ConcurrencySignals:
+    cpu_util: Optional[float] = None  # loadavg de 1 min / núcleos
+    mem_used: Optional[float] = None  # fração da RAM em uso (1 - MemAvailable/MemTotal)
+    llm_429_rate: Optional[float] = None  # respostas 429 / chamadas desde a última decisão
+    stage_latency_s: Optional[float] = None  # mediana recente da etapa de texto
+
+
+def read_system_signals() -> Tuple[Optional[float], Optional[float]]:
+    """(cpu_util, mem_used) do host; None quando a plataforma não expõe os dados."""
+    cpu_util = None
+    try:
+        cpu_util = os.getloadavg()[0] / max(1, os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        pass
+
+    mem_used = None
+    try:
+        info = {}
+        with open("/proc/meminfo", "r", encoding="ascii") as handler:
+            for line in handler:
+                key, _, rest = line.partition(":")
+                info[key] = float(rest.split()[0])
+        if info.get("MemTotal"):
+            mem_used = 1.0 - info.get("MemAvailable", info["MemTotal"]) / info["MemTotal"]
+    except (OSError, ValueError, IndexError):
+        pass
+    return cpu_util, mem_used
+
+
+def decide_limit(current: int, signals: ConcurrencySignals, config: Optional[AimdConfig] = None) -> Tuple[int, str, str]:
+    """Retorna (novo_limite, ação, motivo) com ação em "decrease", "increase" ou "hold"."""
+    cfg = config or AimdConfig()
+    current = min(cfg.max_limit, max(cfg.min_limit, int(current)))
+
+    pressure = []
+    if signals.cpu_util is not None and signals.cpu_util > cfg.cpu_high:
+        pressure.append(f"cpu={signals.cpu_util:.2f}>{cfg.cpu_high:.2f}")
+    if signals.mem_used is not None and signals.mem_used > cfg.mem_high:
+        pressure.append(f"mem={signals.mem_used:.2f}>{cfg.mem_high:.2f}")
+    if signals.llm_429_rate is not None and signals.llm_429_rate > cfg.llm_429_high:
+        pressure.append(f"llm_429={signals.llm_429_rate:.2f}>{cfg.llm_429_high:.2f}")
+    if signals.stage_latency_s is not None and signals.stage_latency_s > cfg.latency_high_s:
+        pressure.append(f"latencia={signals.stage_latency_s:.0f}s>{cfg.latency_high_s:.0f}s")
+    if pressure:
+        new_limit = max(cfg.min_limit, math.floor(current * cfg.decrease_factor))
+        return new_limit, "decrease", ", ".join(pressure)
+
+    if signals.cpu_util is None and signals.mem_used is None:
+        return current, "hold", "sem sinais de CPU/memória"
+
+    headroom = (signals.cpu_util is None or signals.cpu_util < cfg.cpu_low) and (
+        signals.mem_used is None or signals.mem_used < cfg.mem_low
+    )
+    if headroom and current < cfg.max_limit:
+        return min(cfg.max_limit, current + cfg.increase_step), "increase", "folga de CPU e memória"
+    return current, "hold", "dentro da faixa alvo" if not headroom else "no teto configurado"
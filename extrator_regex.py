@@ -1,4 +1,5 @@
 import re
+import unicodedata
 from datetime import datetime
 from typing import Dict, List, Optional
 
@@ -14,6 +15,56 @@ KEYWORDS_TOTAL = [
     "vlr total", "total geral"
 ]
 
+# Marcadores por tipo de documento (texto já sem acentos e em minúsculas).
+DOCUMENT_TYPE_MARKERS = {
+    "receipt": [
+        "nfc-e", "nota fiscal de consumidor", "cupom fiscal", "documento aux", "qtd total de itens",
+        "valor a pagar", "forma pagamento", "forma de pagamento", "cnpj", "consumidor", "vl unit",
+    ],
+    "comprovante": [
+        "comprovante", "pix", "transferencia", "autenticacao", "protocolo", "favorecido",
+        "pagador", "recebedor", "id da transacao", "chave", "ted", "boleto",
+    ],
+    "statement": [
+        "extrato", "saldo anterior", "saldo do dia", "saldo final", "saldo disponivel", "agencia",
+        "conta corrente", "lancamentos", "historico", "periodo",
+    ],
+    "fatura": [
+        "fatura", "vencimento", "pagamento minimo", "limite", "total da fatura", "cartao de credito",
+        "melhor data", "encargos", "anuidade", "parcela",
+    ],
+}
+_DOCUMENT_TYPE_PATTERNS = {
+    doc_type: re.compile("|".join(rf"(?<![a-z]){re.escape(m)}(?![a-z])" for m in markers))
+    for doc_type, markers in DOCUMENT_TYPE_MARKERS.items()
+}
+_DATE_LINE_PATTERN = re.compile(r"^\s*(\d{1,2}[/-]\d{1,2}(?:[/-]\d{2,4})?|\d{4}[/-]\d{1,2}[/-]\d{1,2})\b", flags=re.MULTILINE)
+
+
+def classificar_tipo_documento(texto_bruto: str) -> str:
+    """
+    Classificador barato (marcadores + linhas iniciadas por data) para o gating do LLM.
+    Retorna "receipt", "comprovante", "statement", "fatura" ou "unknown".
+    """
+    if not texto_bruto or not texto_bruto.strip():
+        return "unknown"
+
+    texto = unicodedata.normalize("NFKD", texto_bruto[:20000]).encode("ascii", "ignore").decode("ascii").lower()
+    scores = {doc_type: len(set(pattern.findall(texto))) for doc_type, pattern in _DOCUMENT_TYPE_PATTERNS.items()}
+
+    # Muitas linhas iniciadas por data indicam lista de lançamentos (extrato/fatura).
+    date_lines = len(_DATE_LINE_PATTERN.findall(texto))
+    if date_lines >= 3:
+        scores["statement"] += 1
+        scores["fatura"] += 1
+
+    best = max(scores, key=lambda doc_type: scores[doc_type])
+    if scores[best] == 0:
+        return "unknown"
+    if sum(1 for v in scores.values() if v == scores[best]) > 1:
+        return "unknown"
+    return best
+
 
 def _parse_date(raw: str) -> Optional[str]:
     raw = raw.strip()
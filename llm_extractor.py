@@ -1,7 +1,6 @@
 import json
 import os
 import random
-import re
 import threading
 import time
 import urllib.error
@@ -9,6 +8,8 @@ import urllib.request
 from collections import deque
 from dotenv import load_dotenv
 
+from parsers.nfce_parser import parse_nfce
+
 load_dotenv()
 
 MAX_RETRIES = int(os.getenv("MAX_LLM_RETRIES", "3"))
@@ -17,125 +18,21 @@ MAX_LLM_RPM = int(os.getenv("MAX_LLM_RPM", "60"))
 RETRYABLE_HTTP = {429, 500, 502, 503, 504}
 DOCUMENT_TYPES = {"Entrada", "Saída", "Extrato", "Fatura"}
 DEFAULT_DOCUMENT_TYPE = "Extrato"
+CATEGORIAS_VALIDAS = ["Alimentação", "Transporte", "Serviços", "Outros"]
 llm_sem = threading.Semaphore(max(1, MAX_LLM_CONCURRENCY))
 _rpm_lock = threading.Lock()
 _rpm_window = deque()
-
-
-RECEIPT_MARKERS = [
-    "documento aux. da nota fiscal",
-    "nota fiscal de consumidor eletr",
-    "qtd total de itens",
-    "valor liquido",
-]
-
-
-def _parse_money_value(raw_value):
-    value = (raw_value or "").strip().lower()
-    if not value:
-        return None
-
-    value = value.replace("r$", "").replace("rs", "").strip()
-    value = re.sub(r"\s+", "", value)
-    value = re.sub(r"[^0-9,\.-]", "", value)
-    if not value:
-        return None
-
-    negative = value.startswith("-")
-    if negative:
-        value = value[1:]
-
-    if "," in value and "." in value:
-        if value.rfind(",") > value.rfind("."):
-            value = value.replace(".", "").replace(",", ".")
-        else:
-            value = value.replace(",", "")
-    elif "," in value:
-        value = value.replace(".", "").replace(",", ".")
-    elif value.count(".") > 1:
-        value = value.replace(".", "")
-
-    try:
-        parsed = float(value)
-        return -parsed if negative else parsed
-    except ValueError:
-        return None
+# Contadores HTTP do processo; localDB os drena para `pipeline_counters` (sinal do controlador de concorrência).
+_http_stats_lock = threading.Lock()
+_http_stats = {"calls": 0, "429": 0}
 
 
 def _extract_receipt_subitems(texto_bruto):
-    texto = (texto_bruto or "").strip()
-    if not texto:
-        return []
-
-    texto_lower = texto.lower()
-    if not any(marker in texto_lower for marker in RECEIPT_MARKERS):
+    """Itens de NFC-e via parser determinístico (fallback quando o LLM devolve só o total)."""
+    nota = parse_nfce(texto_bruto)
+    if not nota or len(nota.itens) < 2:
         return []
-
-    date_match = re.search(r"\b(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})\b", texto)
-    data_base = None
-    if date_match:
-        raw = date_match.group(1).replace("-", "/")
-        parts = raw.split("/")
-        if len(parts) == 3:
-            day, month, year = parts
-            year = f"20{year}" if len(year) == 2 else year
-            data_base = f"{year.zfill(4)}-{month.zfill(2)}-{day.zfill(2)}"
-
-    lines = [re.sub(r"\s+", " ", line).strip() for line in texto.splitlines() if line.strip()]
-    header_pattern = re.compile(
-        r"^(\d{6,14})\s+(.+?)(?:\s+(?:r\$\s*)?([\d\.,]{3,}))?$",
-        flags=re.IGNORECASE,
-    )
-    money_pattern = re.compile(r"(?:r\$\s*)?-?\d[\d\.,]*[\.,]\d{2}", flags=re.IGNORECASE)
-
-    blocked_tokens = ["total", "desconto", "valor pagar", "valor pago", "cartao", "nfc-e", "serie"]
-
-    items = []
-    idx = 0
-    while idx < len(lines):
-        line = lines[idx]
-        header = header_pattern.match(line)
-        if not header:
-            idx += 1
-            continue
-
-        descricao = (header.group(2) or "").strip(" -:")
-        desc_lower = descricao.lower()
-        if not descricao or any(token in desc_lower for token in blocked_tokens):
-            idx += 1
-            continue
-
-        valor = _parse_money_value(header.group(3) or "")
-
-        lookahead = idx + 1
-        while lookahead < len(lines) and lookahead <= idx + 4:
-            probe = lines[lookahead]
-            if header_pattern.match(probe):
-                break
-            if "valor liquido" in probe.lower() or " por " in probe.lower():
-                amounts = money_pattern.findall(probe)
-                if amounts:
-                    parsed_probe = _parse_money_value(amounts[-1])
-                    if parsed_probe is not None:
-                        valor = parsed_probe
-            lookahead += 1
-
-        if valor is not None and valor > 0:
-            items.append(
-                {
-                    "data": data_base,
-                    "valor": round(float(valor), 2),
-                    "descricao": descricao,
-                    "tipo": "saida",
-                    "document_type": "Saída",
-                }
-            )
-
-        idx += 1
-
-    if len(items) < 2:
-        return []
-    return items
+    return nota.to_transactions()
 
 
 def _parse_json_content(content):
@@ -197,12 +94,31 @@ def _call_llm_controlled(api_base, api_key, payload, timeout=30):
         return _post_chat_completion(api_base, api_key, payload, timeout=timeout)
 
 
+def _count_http(status=None):
+    with _http_stats_lock:
+        _http_stats["calls"] += 1
+        if status == 429:
+            _http_stats["429"] += 1
+
+
+def pop_llm_http_stats():
+    """Retorna e zera {"calls", "429"} acumulados neste processo."""
+    with _http_stats_lock:
+        stats = dict(_http_stats)
+        _http_stats["calls"] = 0
+        _http_stats["429"] = 0
+    return stats
+
+
 def _call_llm_with_retry(api_base, api_key, payload, timeout=30):
     last_error = None
     for attempt in range(1, MAX_RETRIES + 1):
         try:
-            return _call_llm_controlled(api_base, api_key, payload, timeout=timeout)
+            response = _call_llm_controlled(api_base, api_key, payload, timeout=timeout)
+            _count_http()
+            return response
         except urllib.error.HTTPError as exc:
+            _count_http(exc.code)
             last_error = exc
             if exc.code in RETRYABLE_HTTP and attempt < MAX_RETRIES:
                 time.sleep((2 ** (attempt - 1)) + random.random() * 0.2)
@@ -307,23 +223,40 @@ def extrair_dados_financeiros_llm(texto_bruto):
     return normalized, None
 
 
-def categorizar_transacoes_llm(transacoes):
+def categorizar_transacoes_llm(transacoes, categorias_conhecidas=None):
     """
     Categoriza transações usando LLM e retorna (transacoes_categorizadas, erro).
     Não altera data/valor/descricao, apenas adiciona/normaliza campo `categoria`.
+    `categorias_conhecidas` mapeia índice -> categoria já resolvida localmente
+    (ex.: memória de estabelecimentos); esses itens não são enviados ao LLM.
     """
     if not transacoes:
         return [], None
 
+    conhecidas = {
+        idx: categoria
+        for idx, categoria in (categorias_conhecidas or {}).items()
+        if isinstance(idx, int) and 0 <= idx < len(transacoes) and categoria
+    }
+    pendentes = [idx for idx in range(len(transacoes)) if idx not in conhecidas]
+    if not pendentes:
+        return _aplicar_categorias(transacoes, conhecidas, {}), None
+
+    def _sem_llm(erro):
+        if conhecidas:
+            return _aplicar_categorias(transacoes, conhecidas, {}), erro
+        return transacoes, erro
+
     api_key = os.getenv("LLM_API_KEY") or os.getenv("OPENAI_API_KEY")
     if not api_key:
-        return transacoes, "Chave de API não configurada para categorização via LLM."
+        return _sem_llm("Chave de API não configurada para categorização via LLM.")
 
     api_base = os.getenv("LLM_API_BASE", "https://api.openai.com/v1/chat/completions")
     model = os.getenv("LLM_MODEL", "gpt-4o-mini")
-    categorias_validas = ["Alimentação", "Transporte", "Serviços", "Outros"]
+    categorias_validas = CATEGORIAS_VALIDAS
 
-    transacoes_json = _shrink_text(json.dumps(transacoes, ensure_ascii=False), head=12000, tail=3000)
+    enviadas = [transacoes[idx] for idx in pendentes]
+    transacoes_json = _shrink_text(json.dumps(enviadas, ensure_ascii=False), head=12000, tail=3000)
     prompt = (
         "Classifique cada transação em UMA categoria dentre: "
         f"{', '.join(categorias_validas)}. "
@@ -351,23 +284,23 @@ def categorizar_transacoes_llm(transacoes):
     try:
         data = _call_llm_with_retry(api_base, api_key, payload, timeout=30)
     except urllib.error.HTTPError as exc:
-        return transacoes, f"Erro na API LLM (categorização): {exc.code} - {exc.reason}"
+        return _sem_llm(f"Erro na API LLM (categorização): {exc.code} - {exc.reason}")
     except urllib.error.URLError as exc:
-        return transacoes, f"Falha de conexão com LLM (categorização): {exc.reason}"
+        return _sem_llm(f"Falha de conexão com LLM (categorização): {exc.reason}")
     except Exception as exc:
-        return transacoes, f"Erro inesperado no LLM (categorização): {str(exc)}"
+        return _sem_llm(f"Erro inesperado no LLM (categorização): {str(exc)}")
 
     content = data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
     if not content:
-        return transacoes, "Resposta vazia do LLM na categorização."
+        return _sem_llm("Resposta vazia do LLM na categorização.")
 
     try:
         classificacoes = _parse_json_content(content)
     except json.JSONDecodeError:
-        return transacoes, "Resposta de categorização do LLM não está em JSON válido."
+        return _sem_llm("Resposta de categorização do LLM não está em JSON válido.")
 
     if not isinstance(classificacoes, list):
-        return transacoes, "Resposta de categorização do LLM não retornou uma lista."
+        return _sem_llm("Resposta de categorização do LLM não retornou uma lista.")
 
     classificacao_por_indice = {}
     for item in classificacoes:
@@ -375,16 +308,23 @@ def categorizar_transacoes_llm(transacoes):
             continue
         idx = item.get("index")
         categoria = item.get("categoria")
-        if isinstance(idx, int) and categoria in categorias_validas:
-            classificacao_por_indice[idx] = categoria
+        if isinstance(idx, int) and 0 <= idx < len(pendentes) and categoria in categorias_validas:
+            classificacao_por_indice[pendentes[idx]] = categoria
 
+    return _aplicar_categorias(transacoes, conhecidas, classificacao_por_indice), None
+
+
+def _aplicar_categorias(transacoes, conhecidas, classificadas):
+    """Mescla categorias resolvidas localmente com as do LLM, validando apenas as do LLM."""
     transacoes_saida = []
     for idx, transacao in enumerate(transacoes):
         t = dict(transacao)
-        categoria = classificacao_por_indice.get(idx, t.get("categoria", "Outros"))
-        if categoria not in categorias_validas:
-            categoria = "Outros"
-        t["categoria"] = categoria
+        if idx in conhecidas:
+            t["categoria"] = conhecidas[idx]
+        else:
+            categoria = classificadas.get(idx, t.get("categoria", "Outros"))
+            if categoria not in CATEGORIAS_VALIDAS:
+                categoria = "Outros"
+            t["categoria"] = categoria
         transacoes_saida.append(t)
-
-    return transacoes_saida, None
+    return transacoes_saida
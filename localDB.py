@@ -3,21 +3,38 @@ import io
 import json
 from dataclasses import asdict, dataclass
 import logging
+import mmap
 import random
+import resource
 import os
+import re
 import sqlite3
+import tempfile
+import unicodedata
 import uuid
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import Any, Dict, Iterable, List, Literal, Optional, Tuple
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Literal, Optional, Tuple, Union
 
 import pandas as pd
-from extrator_regex import extrair_dados_financeiros
-from llm_extractor import extrair_dados_financeiros_llm
+from pandas.api.types import is_datetime64_any_dtype
+from classificador import MODEL_PATH as CATEGORY_MODEL_PATH
+from classificador import ClassificadorCategorias, carregar_modelo
+from concurrency import ADAPTIVE_CONCURRENCY, AimdConfig, ConcurrencySignals, decide_limit, read_system_signals
+from extrator_regex import classificar_tipo_documento, extrair_dados_financeiros
+from llm_extractor import categorizar_transacoes_llm, extrair_dados_financeiros_llm, pop_llm_http_stats
 from ocr import extrair_texto_imagem
-from parsers.ofx_parser import StatementLine, build_hash_linha
-from pdfs import converter_pdf_para_imagens, extrair_texto_pdf
-from planilhas import processar_planilha
+from parsers.nfce_parser import parse_nfce
+from parsers.ofx_parser import (
+    StatementLine,
+    _norm_desc,
+    _shift_competencia,
+    build_hash_linhas,
+    build_purchase_key,
+)
+from pdfs import converter_pdf_para_imagens, extrair_texto_pdf, inspecionar_pdf
+from planilhas import PLANILHA_CHUNK_ROWS, LayoutPlanilha, iterar_planilha, processar_planilha
 
 DB_NAME = "dados_financeiros.db"
 INGEST_DB_NAME = "ingestao.db"
@@ -33,6 +50,16 @@ STATUS_FINALIZED = "FINALIZED"
 STATUS_ERROR_STORAGE = "ERROR_STORAGE"
 STATUS_ERROR_PROCESSING = "ERROR_PROCESSING"
 
+# Etapas da pipeline (também usadas em `failed_stage`).
+STAGE_TEXT_EXTRACTION = "TEXT_EXTRACTION"
+STAGE_STRUCTURED_EXTRACTION = "STRUCTURED_EXTRACTION"
+PIPELINE_STAGES = (STAGE_TEXT_EXTRACTION, STAGE_STRUCTURED_EXTRACTION)
+
+# Status de linhas em `extractions` (versões do payload de um documento).
+EXTRACTION_PROVISIONAL = "PROVISIONAL"
+EXTRACTION_PENDING = "PENDING"
+EXTRACTION_SUPERSEDED = "SUPERSEDED"
+
 # Compatibilidade legada
 STATUS_PROCESSING = STATUS_PROCESSING_TEXT
 STATUS_LLM_REVIEW = STATUS_STRUCTURED_EXTRACTED
@@ -42,6 +69,41 @@ MIN_CONF = 0.70
 MIN_VALUES_RATIO = 0.85
 MIN_DATES_RATIO = 0.70
 MAX_ACTIVE_DOCS = int(os.getenv("MAX_ACTIVE_DOCS", "2"))
+# Vagas de processamento são leases: sem heartbeat dentro de SLOT_LEASE_S a vaga expira e o reaper a recupera.
+SLOT_LEASE_S = float(os.getenv("SLOT_LEASE_S", "120"))
+SLOT_HEARTBEAT_S = float(os.getenv("SLOT_HEARTBEAT_S", "30"))
+CONCURRENCY_DECISIONS_KEEP = int(os.getenv("CONCURRENCY_DECISIONS_KEEP", "5000"))
+INGEST_THREADS = int(os.getenv("INGEST_THREADS", str(min(8, (os.cpu_count() or 2) * 2))))
+RAW_CHUNK_SIZE = int(os.getenv("RAW_CHUNK_SIZE", str(1024 * 1024)))
+
+# Custo estimado (segundos) para rotear entre filas rápida/lenta e ordenar SJF com aging.
+LANE_FAST = "fast"
+LANE_SLOW = "slow"
+FAST_LANE_MAX_COST_S = float(os.getenv("FAST_LANE_MAX_COST_S", "20"))
+OCR_PAGE_COST_S = float(os.getenv("OCR_PAGE_COST_S", "8"))
+NATIVE_PAGE_COST_S = float(os.getenv("NATIVE_PAGE_COST_S", "0.2"))
+# Cada segundo de espera abate SJF_AGING_FACTOR segundos do custo (evita starvation).
+SJF_AGING_FACTOR = float(os.getenv("SJF_AGING_FACTOR", "0.1"))
+
+# PDFs escaneados com pelo menos OCR_FANOUT_MIN_PAGES páginas viram um job de OCR por página (0 desliga).
+OCR_FANOUT_MIN_PAGES = int(os.getenv("OCR_FANOUT_MIN_PAGES", "4"))
+# Durante o fan-out a vaga segue com o documento; cada página renova o lease por OCR_FANOUT_LEASE_S
+# (cobre a espera na fila entre páginas) e o join a libera.
+OCR_FANOUT_LEASE_S = float(os.getenv("OCR_FANOUT_LEASE_S", "900"))
+OCR_PAGE_PENDING = "PENDING"
+OCR_PAGE_DONE = "DONE"
+OCR_PAGE_FAILED = "FAILED"
+
+DEFAULT_CATEGORY = "Outros"
+CATEGORY_MODEL_MIN_CONF = float(os.getenv("CATEGORY_MODEL_MIN_CONF", "0.80"))
+RESUMO_TOKENS = [
+    "total",
+    "valor pago",
+    "valor a pagar",
+    "forma pagamento",
+    "pagamento",
+    "desconto",
+]
 
 logger = logging.getLogger(__name__)
 
@@ -52,6 +114,10 @@ if not logging.getLogger().handlers:
 ExtractionMethod = Literal["regex", "llm"]
 
 
+class LeaseLostError(RuntimeError):
+    """O lease do documento foi recuperado pelo reaper: outro job assumiu e este não deve gravar nada."""
+
+
 @dataclass
 class ExtractionMetrics:
     total_items: int
@@ -68,6 +134,24 @@ class ExtractionResult:
     payload: List[Dict[str, Any]]
     metrics: ExtractionMetrics
     reason: Optional[str] = None
+    doc_type: Optional[str] = None
+
+
+@dataclass
+class GatingThresholds:
+    min_items: int = MIN_ITEMS
+    min_conf: float = MIN_CONF
+    min_values_ratio: float = MIN_VALUES_RATIO
+    min_dates_ratio: float = MIN_DATES_RATIO
+
+
+# Recibos e comprovantes costumam ter 1 transação: exigir MIN_ITEMS mandava todos ao LLM.
+DOC_TYPE_GATING: Dict[str, GatingThresholds] = {
+    "receipt": GatingThresholds(min_items=1),
+    "comprovante": GatingThresholds(min_items=1),
+    "fatura": GatingThresholds(min_items=3),
+    "statement": GatingThresholds(min_items=MIN_ITEMS),
+}
 
 
 
@@ -151,7 +235,30 @@ def init_db():
 
         conn.execute("CREATE INDEX IF NOT EXISTS idx_tipo_data ON transacoes(tipo, data);")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_categoria_data ON transacoes(categoria, data);")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_transacoes_document_id ON transacoes(document_id);")
+        # Índices das consultas paginadas (`get_transactions_page`): filtro + (data, id) na ordem da página.
+        conn.execute("DROP INDEX IF EXISTS idx_transacoes_document_id;")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_transacoes_document_data ON transacoes(document_id, data);")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_transacoes_fonte_data ON transacoes(fonte, data);")
+
+        # Agregado mensal de `transacoes`, mantido na mesma transação dos INSERTs (ver `_apply_monthly_rollup`).
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS monthly_rollup (
+                month TEXT NOT NULL,
+                tipo TEXT NOT NULL,
+                categoria TEXT NOT NULL,
+                fonte TEXT NOT NULL,
+                total REAL NOT NULL DEFAULT 0,
+                qtd INTEGER NOT NULL DEFAULT 0,
+                atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (month, tipo, categoria, fonte)
+            ) WITHOUT ROWID;
+            """
+        )
+        rollup_vazio = conn.execute("SELECT 1 FROM monthly_rollup LIMIT 1").fetchone() is None
+        if rollup_vazio and conn.execute("SELECT 1 FROM transacoes LIMIT 1").fetchone() is not None:
+            # Base anterior à tabela: popula uma vez a partir do histórico.
+            with_tx(conn, _rebuild_monthly_rollup)
 
         conn.execute(
             """
@@ -254,6 +361,32 @@ def init_db():
         conn.execute("CREATE INDEX IF NOT EXISTS idx_stmt_lines_stmt ON statement_lines(statement_id);")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_stmt_lines_data ON statement_lines(data);")
 
+        # Parcelas de compras parceladas: a parcela lida na fatura (statement_line_id preenchido) e as
+        # futuras projetadas (statement_line_id NULL), uma linha por (compra, parcela).
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS installment_schedule (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                purchase_key TEXT NOT NULL,
+                parcela INTEGER NOT NULL,
+                parcela_total INTEGER NOT NULL,
+                competencia TEXT NOT NULL,
+                valor REAL NOT NULL,
+                descricao TEXT,
+                statement_line_id INTEGER,
+                atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(purchase_key, parcela),
+                FOREIGN KEY(statement_line_id) REFERENCES statement_lines(id)
+            );
+            """
+        )
+        conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_installment_month
+            ON installment_schedule(competencia, valor) WHERE statement_line_id IS NULL;
+            """
+        )
+
 
 def _sha256_bytes(content: bytes) -> str:
     return hashlib.sha256(content).hexdigest()
@@ -263,6 +396,14 @@ def compute_raw_hash(file_bytes: bytes) -> str:
     return hashlib.sha256(file_bytes).hexdigest()
 
 
+def _hash_file(path: str, chunk_size: int = RAW_CHUNK_SIZE) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handler:
+        for chunk in iter(lambda: handler.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def compute_text_hash(text: str) -> str:
     normalized = (text or "").strip().lower()
     return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
@@ -327,19 +468,19 @@ def find_transaction_id(data: str, descricao: str, valor: float, fonte: str, tip
     return int(row[0]) if row else None
 
 
-def insert_transactions(df: pd.DataFrame):
-    """Insere apenas novos registros tratando valores nulos e duplicatas."""
-    if df.empty:
-        return 0
+TRANSACTION_COLUMNS = ["data", "descricao", "valor", "fonte", "categoria", "tipo"]
+
 
+def _prepare_transactions_frame(df: pd.DataFrame) -> pd.DataFrame:
     df_final = df.copy()
 
     if "data" in df_final.columns:
+        if is_datetime64_any_dtype(df_final["data"]):
+            # Mesmo formato das demais origens (ISO sem hora), para o UNIQUE deduplicar entre elas.
+            df_final["data"] = df_final["data"].dt.strftime("%Y-%m-%d")
         df_final["data"] = df_final["data"].fillna(datetime.now().strftime("%Y-%m-%d"))
 
-    colunas_obrigatorias = ["data", "descricao", "valor", "fonte", "categoria", "tipo"]
-
-    for col in colunas_obrigatorias:
+    for col in TRANSACTION_COLUMNS:
         if col not in df_final.columns:
             if col == "valor":
                 df_final[col] = 0.0
@@ -348,35 +489,165 @@ def insert_transactions(df: pd.DataFrame):
             else:
                 df_final[col] = ""
 
-    df_final = df_final[colunas_obrigatorias]
+    df_final = df_final[TRANSACTION_COLUMNS]
     df_final["valor"] = pd.to_numeric(df_final["valor"], errors="coerce").fillna(0.0).abs()
     df_final["tipo"] = df_final["tipo"].astype(str).str.lower().str.strip()
     df_final.loc[~df_final["tipo"].isin(["entrada", "saida"]), "tipo"] = "saida"
+    return df_final
 
-    try:
-        def _op():
-            with get_conn(DB_NAME) as conn:
-                apply_sqlite_pragmas(conn)
 
-                df_final.to_sql("staging_transacoes", conn, if_exists="replace", index=False)
+def insert_transactions(df: pd.DataFrame):
+    """Insere apenas novos registros tratando valores nulos e duplicatas."""
+    if df.empty:
+        return 0
+    return insert_transactions_chunks([df])
 
-                def _write(c):
-                    cursor = c.execute(
-                        """
-                        INSERT OR IGNORE INTO transacoes (data, descricao, valor, fonte, categoria, tipo)
-                        SELECT data, descricao, valor, fonte, categoria, tipo FROM staging_transacoes;
-                        """
-                    )
-                    c.execute("DROP TABLE IF EXISTS staging_transacoes;")
-                    return int(cursor.rowcount)
 
-                return with_tx(conn, _write)
+def insert_transactions_chunks(chunks: Iterable[pd.DataFrame]) -> int:
+    """
+    Como `insert_transactions`, mas recebe blocos (ex.: `iterar_planilha`): cada bloco vai para uma
+    tabela TEMP da conexão assim que chega, e um único INSERT OR IGNORE ... SELECT grava tudo.
+    """
+    try:
+        with get_conn(DB_NAME) as conn:
+            apply_sqlite_pragmas(conn)
+            # TEMP: por conexão, não disputa o lock do banco principal nem colide entre processos.
+            conn.execute("DROP TABLE IF EXISTS temp.staging_transacoes;")
+            conn.execute(
+                "CREATE TEMP TABLE staging_transacoes (data TEXT, descricao TEXT, valor REAL, fonte TEXT, categoria TEXT, tipo TEXT);"
+            )
+            staged = 0
+            for chunk in chunks:
+                if chunk is None or chunk.empty:
+                    continue
+                df_final = _prepare_transactions_frame(chunk).astype(object)
+                df_final = df_final.where(df_final.notna(), None)
+                conn.executemany(
+                    "INSERT INTO temp.staging_transacoes VALUES (?, ?, ?, ?, ?, ?);",
+                    df_final.itertuples(index=False, name=None),
+                )
+                staged += len(df_final)
+            if not staged:
+                return 0
 
-        return retry_on_lock(_op)
+            def _write(c):
+                last_id = c.execute("SELECT COALESCE(MAX(id), 0) FROM transacoes").fetchone()[0]
+                cursor = c.execute(
+                    """
+                    INSERT OR IGNORE INTO transacoes (data, descricao, valor, fonte, categoria, tipo)
+                    SELECT data, descricao, valor, fonte, categoria, tipo FROM temp.staging_transacoes;
+                    """
+                )
+                inserted = int(cursor.rowcount)
+                if inserted:
+                    _apply_monthly_rollup(c, last_id)
+                return inserted
+
+            inserted = retry_on_lock(lambda: with_tx(conn, _write))
+            conn.execute("DROP TABLE IF EXISTS temp.staging_transacoes;")
+            return inserted
     except Exception as exc:
         raise Exception(f"Erro técnico na camada de dados: {exc}")
 
 
+def import_spreadsheet(uploaded_file, chunk_rows: int = PLANILHA_CHUNK_ROWS) -> Tuple[int, Optional[str]]:
+    """Importa um export grande de CSV/xlsx direto em `transacoes`, bloco a bloco (sem HITL)."""
+    blocos, err = iterar_planilha(
+        uploaded_file,
+        chunk_rows=chunk_rows,
+        buscar_layout=get_spreadsheet_layout,
+        registrar_layout=save_spreadsheet_layout,
+    )
+    if err:
+        return 0, err
+    try:
+        return insert_transactions_chunks(blocos), None
+    except Exception as exc:
+        return 0, str(exc)
+
+
+ROLLUP_DIMENSIONS = ("month", "tipo", "categoria", "fonte")
+
+# Dimensões do agregado a partir de uma linha de `transacoes` (categoria/fonte nulas viram "" na chave).
+_ROLLUP_SELECT = """
+    SELECT substr(data, 1, 7), tipo, COALESCE(categoria, ''), COALESCE(fonte, ''), SUM(valor), COUNT(*)
+    FROM transacoes
+    WHERE id > ?
+    GROUP BY 1, 2, 3, 4
+"""
+
+
+def _apply_monthly_rollup(conn: sqlite3.Connection, after_id: int) -> None:
+    """
+    Soma em `monthly_rollup` as transações com id > `after_id`. Roda dentro da transação do INSERT
+    (BEGIN IMMEDIATE), então os ids novos são exatamente as linhas que ele gravou.
+    """
+    conn.execute(
+        f"""
+        INSERT INTO monthly_rollup (month, tipo, categoria, fonte, total, qtd)
+        {_ROLLUP_SELECT}
+        ON CONFLICT(month, tipo, categoria, fonte) DO UPDATE SET
+            total = total + excluded.total,
+            qtd = qtd + excluded.qtd,
+            atualizado_em = CURRENT_TIMESTAMP
+        """,
+        (int(after_id),),
+    )
+
+
+def _rebuild_monthly_rollup(conn: sqlite3.Connection) -> int:
+    conn.execute("DELETE FROM monthly_rollup;")
+    conn.execute(f"INSERT INTO monthly_rollup (month, tipo, categoria, fonte, total, qtd) {_ROLLUP_SELECT}", (0,))
+    return int(conn.execute("SELECT COUNT(*) FROM monthly_rollup").fetchone()[0])
+
+
+def rebuild_monthly_rollup() -> int:
+    """Recalcula `monthly_rollup` a partir de `transacoes` (reparo ou após edições manuais no banco)."""
+    with get_conn(DB_NAME) as conn:
+        apply_sqlite_pragmas(conn)
+        return retry_on_lock(lambda: with_tx(conn, _rebuild_monthly_rollup))
+
+
+def get_monthly_rollup(
+    start_month: Optional[str] = None,
+    end_month: Optional[str] = None,
+    tipo: Optional[str] = None,
+    categoria: Optional[str] = None,
+    fonte: Optional[str] = None,
+    group_by: Iterable[str] = ROLLUP_DIMENSIONS,
+) -> pd.DataFrame:
+    """
+    Totais e contagens por mês (YYYY-MM) lidos de `monthly_rollup`, sem tocar em `transacoes`.
+    `group_by` escolhe as dimensões mantidas; as demais são somadas.
+    """
+    dims = [d for d in ROLLUP_DIMENSIONS if d in set(group_by)]
+    filters, params = [], []
+    for column, op, value in (
+        ("month", ">=", start_month),
+        ("month", "<=", end_month),
+        ("tipo", "=", tipo),
+        ("categoria", "=", categoria),
+        ("fonte", "=", fonte),
+    ):
+        if value is not None:
+            filters.append(f"{column} {op} ?")
+            params.append(value)
+
+    select = ", ".join(dims + ["SUM(total) AS total", "SUM(qtd) AS qtd"])
+    query = f"SELECT {select} FROM monthly_rollup"
+    if filters:
+        query += " WHERE " + " AND ".join(filters)
+    if dims:
+        query += f" GROUP BY {', '.join(dims)} ORDER BY {', '.join(dims)}"
+    try:
+        with get_conn(DB_NAME) as conn:
+            df = pd.read_sql_query(query, conn, params=params)
+    except Exception:
+        return pd.DataFrame(columns=dims + ["total", "qtd"])
+    # Sem dimensões e sem linhas, o SUM devolve uma linha de NULLs.
+    return df.dropna(subset=["qtd"]).reset_index(drop=True)
+
+
 def get_all_transactions():
     """Busca o histórico completo."""
     try:
@@ -386,6 +657,93 @@ def get_all_transactions():
         return pd.DataFrame()
 
 
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "200"))
+
+PageCursor = Tuple[Any, ...]
+
+
+def _read_page(query: str, params: List[Any], limit: int, cursor_columns: Tuple[str, ...]) -> Tuple[pd.DataFrame, Optional[PageCursor]]:
+    # Lê uma linha a mais só para saber se existe próxima página; o cursor é a chave da última linha entregue.
+    limit = max(1, int(limit))
+    with get_conn(DB_NAME) as conn:
+        df = pd.read_sql_query(f"{query} LIMIT ?", conn, params=[*params, limit + 1])
+    if len(df) <= limit:
+        return df, None
+    df = df.iloc[:limit]
+    last = df.iloc[-1]
+    return df, tuple(last[col] for col in cursor_columns)
+
+
+def get_transactions_page(
+    after: Optional[PageCursor] = None,
+    limit: int = HISTORY_PAGE_SIZE,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    tipo: Optional[str] = None,
+    categoria: Optional[str] = None,
+    fonte: Optional[str] = None,
+    document_id: Optional[str] = None,
+) -> Tuple[pd.DataFrame, Optional[PageCursor]]:
+    """
+    Uma página de `transacoes` em ordem (data DESC, id DESC), com paginação por chave: `after` é o
+    cursor devolvido pela página anterior, então a página N custa o mesmo que a primeira. Devolve
+    (página, cursor da próxima) — cursor None na última página. Datas são ISO (YYYY-MM-DD), inclusivas.
+    """
+    filters, params = [], []
+    for column, op, value in (
+        ("data", ">=", start_date),
+        ("data", "<=", end_date),
+        ("tipo", "=", tipo),
+        ("categoria", "=", categoria),
+        ("fonte", "=", fonte),
+        ("document_id", "=", document_id),
+    ):
+        if value is not None:
+            filters.append(f"{column} {op} ?")
+            params.append(value)
+    if after is not None:
+        filters.append("(data, id) < (?, ?)")
+        params.extend([after[0], int(after[1])])
+
+    query = "SELECT id, data, descricao, valor, fonte, categoria, tipo, document_id, criado_em FROM transacoes"
+    if filters:
+        query += " WHERE " + " AND ".join(filters)
+    query += " ORDER BY data DESC, id DESC"
+    try:
+        return _read_page(query, params, limit, ("data", "id"))
+    except Exception:
+        return pd.DataFrame(), None
+
+
+def get_document_items_page(
+    document_id: Optional[str] = None,
+    after: Optional[PageCursor] = None,
+    limit: int = HISTORY_PAGE_SIZE,
+) -> Tuple[pd.DataFrame, Optional[PageCursor]]:
+    """Como `get_document_items`, paginado por chave em ordem de id decrescente (mais recentes primeiro)."""
+    filters, params = [], []
+    if document_id:
+        # Subconsulta: a busca por documento usa idx_item_resumo (resumo_id, id) sem ordenar depois.
+        filters.append("di.resumo_id = (SELECT id FROM documento_resumos WHERE document_id = ?)")
+        params.append(str(document_id))
+    if after is not None:
+        filters.append("di.id < ?")
+        params.append(int(after[0]))
+
+    query = """
+        SELECT di.id, dr.document_id, di.transacao_id, di.data, di.descricao, di.valor, di.tipo, di.categoria, di.criado_em
+        FROM documento_itens di
+        INNER JOIN documento_resumos dr ON dr.id = di.resumo_id
+    """
+    if filters:
+        query += " WHERE " + " AND ".join(filters)
+    query += " ORDER BY di.id DESC"
+    try:
+        return _read_page(query, params, limit, ("id",))
+    except Exception:
+        return pd.DataFrame(), None
+
+
 def get_document_summaries() -> pd.DataFrame:
     try:
         with get_conn(DB_NAME) as conn:
@@ -449,34 +807,206 @@ def insert_statement(document_id: int, banco: Optional[str], cartao: Optional[st
 
 
 def insert_statement_lines(statement_id: int, competencia: str, lines: Iterable[StatementLine]) -> int:
-    payload = []
-    for ln in lines:
-        payload.append(
-            (
-                int(statement_id),
-                ln.data,
-                ln.descricao,
-                float(ln.valor),
-                ln.parcela_total,
-                ln.parcela_atual,
-                ln.merchant,
-                build_hash_linha(competencia, ln),
+    return upsert_statement_lines(statement_id, competencia, lines)["inserted"]
+
+
+def upsert_statement_lines(statement_id: int, competencia: str, lines: Iterable[StatementLine]) -> Dict[str, Any]:
+    """
+    Grava as linhas de um extrato numa transação: hashes em lote, staging em tabela TEMP e um único
+    INSERT OR IGNORE. Devolve inseridas x duplicadas e os ids (e extratos) das linhas já existentes
+    com o mesmo `hash_linha` — o trecho sobreposto de um export que repete o período anterior.
+    """
+    lines = list(lines)
+    report: Dict[str, Any] = {"inserted": 0, "duplicates": 0, "matched_line_ids": [], "matched_statement_ids": []}
+    if not lines:
+        return report
+
+    hashes = build_hash_linhas(competencia, lines)
+    payload = [
+        (pos, int(statement_id), ln.data, ln.descricao, float(ln.valor), ln.parcela_total, ln.parcela_atual, ln.merchant, hash_linha)
+        for pos, (ln, hash_linha) in enumerate(zip(lines, hashes))
+    ]
+
+    with get_conn(DB_NAME) as conn:
+        apply_sqlite_pragmas(conn)
+        conn.execute("DROP TABLE IF EXISTS temp.staging_statement_lines;")
+        conn.execute(
+            """
+            CREATE TEMP TABLE staging_statement_lines (
+                pos INTEGER PRIMARY KEY, statement_id INTEGER, data TEXT, descricao TEXT, valor REAL,
+                parcela_total INTEGER, parcela_atual INTEGER, merchant TEXT, hash_linha TEXT
+            );
+            """
+        )
+        conn.executemany("INSERT INTO temp.staging_statement_lines VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);", payload)
+
+        def _write(c):
+            statement = c.execute("SELECT banco, cartao FROM statements WHERE id = ?", (int(statement_id),)).fetchone()
+            matched = c.execute(
+                """
+                SELECT DISTINCT l.id, l.statement_id
+                FROM temp.staging_statement_lines s
+                JOIN statement_lines l ON l.hash_linha = s.hash_linha
+                ORDER BY l.id
+                """
+            ).fetchall()
+            cursor = c.execute(
+                """
+                INSERT OR IGNORE INTO statement_lines
+                (statement_id, data, descricao, valor, parcela_total, parcela_atual, merchant, hash_linha)
+                SELECT statement_id, data, descricao, valor, parcela_total, parcela_atual, merchant, hash_linha
+                FROM temp.staging_statement_lines ORDER BY pos
+                """
+            )
+            inserted = int(cursor.rowcount)
+            installments = c.execute(
+                """
+                SELECT l.id, s.pos
+                FROM temp.staging_statement_lines s
+                JOIN statement_lines l ON l.hash_linha = s.hash_linha
+                WHERE s.parcela_atual IS NOT NULL AND s.parcela_total > 1
+                """
+            ).fetchall()
+            conta = _statement_account(statement)
+            _project_installments(
+                c,
+                [(int(r[0]), conta, competencia, lines[int(r[1])]) for r in installments],
             )
+            return matched, inserted
+
+        matched, inserted = retry_on_lock(lambda: with_tx(conn, _write))
+        conn.execute("DROP TABLE IF EXISTS temp.staging_statement_lines;")
+
+    report["inserted"] = inserted
+    # Inclui repetições dentro do próprio lote.
+    report["duplicates"] = len(payload) - inserted
+    report["matched_line_ids"] = [int(r[0]) for r in matched]
+    report["matched_statement_ids"] = sorted({int(r[1]) for r in matched})
+    if report["duplicates"]:
+        logger.info(
+            "[PIPELINE] Extrato %s: %d linha(s) nova(s), %d duplicada(s) (extratos sobrepostos: %s).",
+            statement_id,
+            inserted,
+            report["duplicates"],
+            report["matched_statement_ids"] or "-",
         )
+    return report
 
-    if not payload:
-        return 0
 
-    with get_conn(DB_NAME) as conn:
-        cur = conn.executemany(
+def _statement_account(statement: Optional[sqlite3.Row]) -> str:
+    if statement is None:
+        return ""
+    return f"{statement['banco'] or ''}|{statement['cartao'] or ''}"
+
+
+def _project_installments(conn: sqlite3.Connection, items: List[Tuple[int, str, str, StatementLine]]) -> int:
+    """
+    Atualiza `installment_schedule` para linhas parceladas (line_id, conta, competência, linha): grava a
+    parcela lida como realizada e projeta as seguintes, uma por mês a partir da competência da fatura.
+    Uma projeção nunca sobrescreve parcela já realizada, então faturas fora de ordem não a ressuscitam.
+    """
+    realized, projected = [], []
+    for line_id, conta, competencia, ln in items:
+        atual, total = ln.parcela_atual, ln.parcela_total
+        if not atual or not total or atual > total or _shift_competencia(competencia, 0) is None:
+            continue
+        key = build_purchase_key(conta, competencia, ln)
+        realized.append((key, atual, total, _shift_competencia(competencia, 0), float(ln.valor), ln.descricao, line_id))
+        for parcela in range(atual + 1, total + 1):
+            projected.append((key, parcela, total, _shift_competencia(competencia, parcela - atual), float(ln.valor), ln.descricao))
+
+    if realized:
+        conn.executemany(
             """
-            INSERT OR IGNORE INTO statement_lines
-            (statement_id, data, descricao, valor, parcela_total, parcela_atual, merchant, hash_linha)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO installment_schedule
+            (purchase_key, parcela, parcela_total, competencia, valor, descricao, statement_line_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(purchase_key, parcela) DO UPDATE SET
+                competencia = excluded.competencia,
+                valor = excluded.valor,
+                descricao = excluded.descricao,
+                statement_line_id = excluded.statement_line_id,
+                atualizado_em = CURRENT_TIMESTAMP
             """,
-            payload,
+            realized,
         )
-        return cur.rowcount
+    if projected:
+        conn.executemany(
+            """
+            INSERT INTO installment_schedule
+            (purchase_key, parcela, parcela_total, competencia, valor, descricao)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(purchase_key, parcela) DO UPDATE SET
+                competencia = excluded.competencia,
+                valor = excluded.valor,
+                descricao = excluded.descricao,
+                atualizado_em = CURRENT_TIMESTAMP
+            WHERE installment_schedule.statement_line_id IS NULL
+            """,
+            projected,
+        )
+    return len(realized) + len(projected)
+
+
+def rebuild_installment_schedule(batch_size: int = 5000) -> int:
+    """Refaz `installment_schedule` a partir de `statement_lines` (bases anteriores à tabela ou reparo)."""
+    with get_conn(DB_NAME) as conn:
+        apply_sqlite_pragmas(conn)
+
+        def _rebuild(c):
+            c.execute("DELETE FROM installment_schedule;")
+            cursor = c.execute(
+                """
+                SELECT l.id, l.data, l.descricao, l.valor, l.parcela_atual, l.parcela_total, l.merchant,
+                       s.banco, s.cartao, s.competencia
+                FROM statement_lines l
+                JOIN statements s ON s.id = l.statement_id
+                WHERE l.parcela_atual IS NOT NULL AND l.parcela_total > 1
+                ORDER BY s.competencia, l.id
+                """
+            )
+            total = 0
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return total
+                total += _project_installments(
+                    c,
+                    [
+                        (
+                            int(r["id"]),
+                            _statement_account(r),
+                            r["competencia"],
+                            StatementLine(r["data"], r["descricao"], r["valor"], r["merchant"], r["parcela_atual"], r["parcela_total"]),
+                        )
+                        for r in rows
+                    ],
+                )
+
+        return retry_on_lock(lambda: with_tx(conn, _rebuild))
+
+
+def get_installment_cash_flow(start_month: Optional[str] = None, months: int = 12) -> List[Dict[str, Any]]:
+    """
+    Parcelas projetadas (ainda não lidas em fatura) por competência, de `start_month` (YYYY-MM,
+    padrão: mês atual) até `months` meses à frente. Lê só o índice parcial idx_installment_month.
+    """
+    start = _shift_competencia(start_month or datetime.now().strftime("%Y-%m"), 0)
+    if start is None:
+        raise ValueError(f"Competência inválida: {start_month!r} (esperado YYYY-MM)")
+    end = _shift_competencia(start, max(int(months), 1) - 1)
+    with get_conn(DB_NAME) as conn:
+        rows = conn.execute(
+            """
+            SELECT competencia, SUM(valor) AS total, COUNT(*) AS parcelas
+            FROM installment_schedule
+            WHERE statement_line_id IS NULL AND competencia BETWEEN ? AND ?
+            GROUP BY competencia
+            ORDER BY competencia
+            """,
+            (start, end),
+        ).fetchall()
+    return [{"competencia": r["competencia"], "total": float(r["total"]), "parcelas": int(r["parcelas"])} for r in rows]
 
 
 def init_ingest_db():
@@ -517,8 +1047,37 @@ def init_ingest_db():
             conn.execute("ALTER TABLE documents ADD COLUMN failed_stage TEXT")
         if "metrics_json" not in columns:
             conn.execute("ALTER TABLE documents ADD COLUMN metrics_json TEXT")
+        if "est_cost_s" not in columns:
+            conn.execute("ALTER TABLE documents ADD COLUMN est_cost_s REAL")
+        if "lane" not in columns:
+            conn.execute("ALTER TABLE documents ADD COLUMN lane TEXT")
 
         conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_raw_hash ON documents(raw_hash);")
+
+        # Cache de verificação do raw: mesmo (tamanho, mtime) => hash já conferido, sem reler o arquivo.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS raw_verifications (
+                path TEXT PRIMARY KEY,
+                size_bytes INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                verified_at TEXT NOT NULL
+            );
+            """
+        )
+        # Registro de layouts de planilha: fingerprint do cabeçalho (+ separador) -> mapeamento e formatos.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS spreadsheet_layouts (
+                fingerprint TEXT PRIMARY KEY,
+                layout_json TEXT NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                last_used_at TEXT
+            );
+            """
+        )
         conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_text_hash ON documents(text_hash);")
         conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_payload_hash ON documents(payload_hash);")
 
@@ -562,6 +1121,7 @@ def init_ingest_db():
                 text_hash TEXT,
                 llm_model TEXT,
                 status TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 1,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY(document_id) REFERENCES documents(id)
             );
@@ -575,6 +1135,8 @@ def init_ingest_db():
             conn.execute("ALTER TABLE extractions ADD COLUMN text_hash TEXT")
         if "llm_model" not in extraction_cols:
             conn.execute("ALTER TABLE extractions ADD COLUMN llm_model TEXT")
+        if "version" not in extraction_cols:
+            conn.execute("ALTER TABLE extractions ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
 
         conn.execute(
             """
@@ -603,6 +1165,103 @@ def init_ingest_db():
         )
         conn.execute("CREATE INDEX IF NOT EXISTS idx_reviews_document_created ON reviews(document_id, created_at);")
 
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS processing_slots (
+                document_id TEXT PRIMARY KEY,
+                worker_id TEXT,
+                acquired_at REAL NOT NULL,
+                heartbeat_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                FOREIGN KEY(document_id) REFERENCES documents(id)
+            );
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_processing_slots_expires ON processing_slots(expires_at);")
+        # token: identifica quem detém o lease; heartbeat/liberação de um job que perdeu o lease não tocam no novo.
+        if "token" not in {row[1] for row in conn.execute("PRAGMA table_info(processing_slots)").fetchall()}:
+            conn.execute("ALTER TABLE processing_slots ADD COLUMN token TEXT")
+
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pipeline_counters (
+                name TEXT PRIMARY KEY,
+                value REAL NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """
+        )
+
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS concurrency_decisions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                decided_at TEXT NOT NULL,
+                previous_limit INTEGER NOT NULL,
+                new_limit INTEGER NOT NULL,
+                action TEXT NOT NULL,
+                reason TEXT,
+                cpu_util REAL,
+                mem_used REAL,
+                llm_429_rate REAL,
+                stage_latency_s REAL,
+                llm_calls_total REAL,
+                llm_429_total REAL
+            );
+            """
+        )
+
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ocr_pages (
+                document_id TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                image_uri TEXT NOT NULL,
+                text_uri TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                chars INTEGER,
+                error TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (document_id, page),
+                FOREIGN KEY(document_id) REFERENCES documents(id)
+            );
+            """
+        )
+
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS merchant_category (
+                merchant_key TEXT PRIMARY KEY,
+                categoria TEXT NOT NULL,
+                votes INTEGER NOT NULL DEFAULT 1,
+                hits INTEGER NOT NULL DEFAULT 0,
+                source TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """
+        )
+        # Votos por (estabelecimento, categoria): `merchant_category` guarda a categoria líder e os votos dela.
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS merchant_category_votes (
+                merchant_key TEXT NOT NULL,
+                categoria TEXT NOT NULL,
+                votes INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (merchant_key, categoria)
+            ) WITHOUT ROWID;
+            """
+        )
+        if conn.execute("SELECT 1 FROM merchant_category_votes LIMIT 1").fetchone() is None:
+            # Memória anterior à contagem por categoria: a categoria vigente entra com os votos que tinha.
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO merchant_category_votes (merchant_key, categoria, votes, updated_at)
+                SELECT merchant_key, categoria, votes, updated_at FROM merchant_category
+                """
+            )
+
 
 def _safe_name(filename: str) -> str:
     return os.path.basename(filename).replace(" ", "_") or "document.bin"
@@ -618,147 +1277,543 @@ def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat(timespec="seconds")
 
 
+# Versão do formato da planilha normalizada: muda quando as colunas/tipos de `processar_planilha`
+# mudam, e artefatos de versões anteriores são ignorados (a extração re-normaliza o raw).
+TABLE_ARTIFACT_VERSION = 1
+TABLE_ARTIFACT_PATHS = tuple(
+    f"table/v{TABLE_ARTIFACT_VERSION}/normalized.{ext}" for ext in ("feather", "pkl")
+)
+
+
 def _write_bytes(path: str, content: bytes) -> None:
-    folder = os.path.dirname(path)
-    if folder:
-        os.makedirs(folder, exist_ok=True)
-    with open(path, "wb") as handler:
-        handler.write(content)
+    """Grava via temporário na mesma pasta + os.replace: um leitor nunca vê o arquivo pela metade."""
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as handler:
+            handler.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 
-def store_raw_document(file_name: str, mime: str, file_bytes: bytes, storage_root: str = "data") -> Dict[str, Any]:
-    """Primeiro salva raw e depois registra no DB de ingestão com status STORED."""
-    init_ingest_db()
-    sha = _sha256_bytes(file_bytes)
-    raw_hash = compute_raw_hash(file_bytes)
-    ext = os.path.splitext(_safe_name(file_name))[1] or ".bin"
-    raw_path = os.path.join(storage_root, "raw", sha, f"original{ext}")
-    if not os.path.exists(raw_path):
-        _write_bytes(raw_path, file_bytes)
+def estimate_processing_cost(
+    file_name: str, mime: str, file_bytes: Optional[bytes] = None, path: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Estima o custo (segundos) da pipeline sem rodar OCR: planilhas/OFX são baratos,
+    PDFs nativos custam por página e imagens/PDFs escaneados custam OCR por página.
+    Aceita os bytes ou o `path` do raw já gravado (ingestão em streaming).
+    """
+    ext = os.path.splitext(str(file_name or "").lower())[1]
+    size_mb = (len(file_bytes) if file_bytes is not None else os.path.getsize(path)) / (1024 * 1024)
+    pages: Optional[int] = None
+    scanned = False
+
+    if ext in [".csv", ".xlsx", ".ofx"]:
+        cost = 0.5 + 2.0 * size_mb
+    elif ext == ".pdf" or (mime or "").endswith("/pdf"):
+        pages, scanned, err = inspecionar_pdf(file_bytes if file_bytes is not None else path)
+        if err or not pages:
+            cost = OCR_PAGE_COST_S
+        else:
+            cost = pages * (OCR_PAGE_COST_S if scanned else NATIVE_PAGE_COST_S) + 0.5
+    else:
+        pages, scanned = 1, True
+        cost = OCR_PAGE_COST_S
 
-    with get_conn(INGEST_DB_NAME) as conn:
-        existing = conn.execute(
-            """
-            SELECT id, sha256, original_name, mime, size_bytes, storage_uri_raw, status, error_message,
-                   created_at, updated_at, raw_hash, text_hash, payload_hash, text_uri, extraction_uri, failed_stage, metrics_json
-            FROM documents
-            WHERE raw_hash = ? OR sha256 = ?
-            ORDER BY updated_at DESC
-            LIMIT 1
-            """,
-            (raw_hash, sha),
-        ).fetchone()
+    cost = round(float(cost), 2)
+    return {
+        "est_cost_s": cost,
+        "lane": LANE_FAST if cost <= FAST_LANE_MAX_COST_S else LANE_SLOW,
+        "pages": pages,
+        "scanned": scanned,
+    }
 
-        if existing:
-            return {
-                "id": existing[0],
-                "sha256": existing[1],
-                "original_name": existing[2],
-                "mime": existing[3],
-                "size_bytes": existing[4],
-                "storage_uri_raw": existing[5],
-                "status": existing[6],
-                "error_message": existing[7],
-                "created_at": existing[8],
-                "updated_at": existing[9],
-                "raw_hash": existing[10],
-                "text_hash": existing[11],
-                "payload_hash": existing[12],
-                "text_uri": existing[13],
-                "extraction_uri": existing[14],
-                "failed_stage": existing[15],
-                "metrics_json": existing[16],
-                "is_duplicate": True,
-            }
 
-        ingest_id = str(uuid.uuid4())
-        now = _now_iso()
-        payload = (
-            ingest_id,
-            sha,
-            file_name,
-            mime or "application/octet-stream",
-            len(file_bytes),
-            raw_path,
-            STATUS_STORED,
-            None,
-            now,
-            now,
-            raw_hash,
-            None,
-            None,
-            None,
-            None,
-            None,
-            None,
-        )
-        conn.execute(
-            """
-            INSERT INTO documents
-            (id, sha256, original_name, mime, size_bytes, storage_uri_raw, status, error_message,
-             created_at, updated_at, raw_hash, text_hash, payload_hash, text_uri, extraction_uri, failed_stage, metrics_json)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            payload,
-        )
+def _parse_ts(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def document_priority(doc: Dict[str, Any], now: Optional[datetime] = None) -> float:
+    """Prioridade SJF com aging (menor = antes): custo estimado menos o tempo de espera ponderado."""
+    cost = doc.get("est_cost_s")
+    cost = OCR_PAGE_COST_S if cost is None else float(cost)
+    created = _parse_ts(doc.get("created_at"))
+    if not created:
+        return cost
+    waited_s = max(0.0, ((now or datetime.now(timezone.utc)) - created).total_seconds())
+    return cost - SJF_AGING_FACTOR * waited_s
+
+
+_INGEST_DOC_COLUMNS = (
+    "id",
+    "sha256",
+    "original_name",
+    "mime",
+    "size_bytes",
+    "storage_uri_raw",
+    "status",
+    "error_message",
+    "created_at",
+    "updated_at",
+    "raw_hash",
+    "text_hash",
+    "payload_hash",
+    "text_uri",
+    "extraction_uri",
+    "failed_stage",
+    "metrics_json",
+    "est_cost_s",
+    "lane",
+)
+_INGEST_DOC_SELECT = f"SELECT {', '.join(_INGEST_DOC_COLUMNS)} FROM documents"
+
+
+def _ingest_doc_from_row(row: Any) -> Dict[str, Any]:
+    return dict(zip(_INGEST_DOC_COLUMNS, row))
+
+
+RawSource = Union[bytes, BinaryIO]
+
+
+class RawUpload(io.RawIOBase):
+    """
+    Raw mapeado em memória (mmap, somente leitura) com a interface de upload dos extratores
+    (`name`, `type`, `read`/`seek`, `getbuffer`). O arquivo ocupa memória uma vez, nas páginas do
+    cache do SO; `getbuffer()` entrega um memoryview sem cópia para fitz (`stream=`).
+    """
+
+    def __init__(self, path: str, name: str, mime: str):
+        super().__init__()
+        self.name = name
+        self.type = mime
+        self._handler = open(path, "rb")
+        size = os.fstat(self._handler.fileno()).st_size
+        # mmap não aceita arquivo vazio.
+        self._mm = mmap.mmap(self._handler.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._size = size
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        if self._mm is None or self._pos >= self._size:
+            return b""
+        end = self._size if size is None or size < 0 else min(self._size, self._pos + size)
+        data = self._mm[self._pos:end]
+        self._pos = end
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+    def getbuffer(self) -> memoryview:
+        return memoryview(self._mm) if self._mm is not None else memoryview(b"")
+
+    def getvalue(self) -> bytes:
+        """Cópia integral em bytes: só para consumidores que não aceitam buffer/arquivo."""
+        return self._mm[:] if self._mm is not None else b""
+
+    def close(self) -> None:
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                # Ainda há memoryview exportado (ex.: documento fitz vivo); o GC libera o mapeamento.
+                pass
+            self._mm = None
+        self._handler.close()
+        super().close()
+
+
+def _current_rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm", "r", encoding="ascii") as handler:
+            return round(int(handler.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _reset_peak_rss() -> bool:
+    """Zera o pico de RSS do processo (VmHWM) para medir só a etapa seguinte; só existe no Linux."""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as handler:
+            handler.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb() -> Optional[float]:
+    # VmHWM: pico desde o último `_reset_peak_rss` (o ru_maxrss nunca desce e repetiria o maior valor já visto).
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as handler:
+            for line in handler:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
 
+
+def _process_peak_rss_mb() -> float:
+    # ru_maxrss em KiB no Linux: pico do processo inteiro (no RQ, o work-horse de cada job).
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _spool_raw(source: RawSource, storage_root: str, chunk_size: int = RAW_CHUNK_SIZE) -> Tuple[str, str, int]:
+    """Copia `source` em blocos para um temporário em `raw/.tmp`, calculando o SHA-256 na mesma passada."""
+    stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+    if hasattr(stream, "seekable") and stream.seekable():
+        stream.seek(0)
+    tmp_dir = os.path.join(storage_root, "raw", ".tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except Exception:
+        _discard_spool(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size
+
+
+def _discard_spool(tmp_path: str) -> None:
+    try:
+        os.unlink(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+def _commit_raw(tmp_path: str, sha: str, file_name: str, storage_root: str) -> str:
+    """
+    Move o temporário para `raw/<sha>/original.<ext>` (os.replace é atômico no mesmo volume). Um raw
+    que já esteja lá é sobrescrito: o temporário teve o hash conferido na gravação, a sobra não.
+    """
+    ext = os.path.splitext(_safe_name(file_name))[1] or ".bin"
+    raw_path = os.path.join(storage_root, "raw", sha, f"original{ext}")
+    os.makedirs(os.path.dirname(raw_path), exist_ok=True)
+    os.replace(tmp_path, raw_path)
+    _remember_raw_verification(raw_path, sha)
+    return raw_path
+
+
+def _new_ingest_doc(file_name: str, mime: str, sha: str, raw_path: str, size_bytes: int) -> Dict[str, Any]:
+    """Monta a linha de `documents` (status STORED) para um raw já gravado."""
+    cost = estimate_processing_cost(file_name, mime, path=raw_path)
+    now = _now_iso()
     return {
-        "id": ingest_id,
+        "id": str(uuid.uuid4()),
         "sha256": sha,
         "original_name": file_name,
         "mime": mime or "application/octet-stream",
-        "size_bytes": len(file_bytes),
+        "size_bytes": size_bytes,
         "storage_uri_raw": raw_path,
         "status": STATUS_STORED,
         "error_message": None,
         "created_at": now,
         "updated_at": now,
-        "raw_hash": raw_hash,
+        # raw_hash e sha256 são o mesmo SHA-256 do arquivo: calculado uma vez só.
+        "raw_hash": sha,
         "text_hash": None,
         "payload_hash": None,
         "text_uri": None,
         "extraction_uri": None,
         "failed_stage": None,
-        "metrics_json": None,
-        "is_duplicate": False,
+        "metrics_json": json.dumps({"est_pages": cost["pages"], "est_scanned": cost["scanned"]}),
+        "est_cost_s": cost["est_cost_s"],
+        "lane": cost["lane"],
     }
 
 
-def list_ingest_documents(statuses: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+_INSERT_INGEST_DOC_SQL = f"""
+    INSERT INTO documents ({', '.join(_INGEST_DOC_COLUMNS)})
+    VALUES ({', '.join(['?'] * len(_INGEST_DOC_COLUMNS))})
+"""
+
+
+def store_raw_stream(
+    file_name: str, mime: str, source: RawSource, storage_root: str = "data", chunk_size: int = RAW_CHUNK_SIZE
+) -> Dict[str, Any]:
+    """
+    Ingestão em uma passada: lê `source` (bytes ou arquivo aberto) em blocos, grava num temporário
+    enquanto calcula o hash e o renomeia para `raw/<sha>/`. Duplicados descartam o temporário.
+    """
     init_ingest_db()
-    query = "SELECT id, sha256, original_name, mime, size_bytes, storage_uri_raw, status, error_message, created_at, updated_at, raw_hash, text_hash, payload_hash, text_uri, extraction_uri, failed_stage, metrics_json FROM documents"
-    params: Tuple[Any, ...] = ()
-    if statuses:
-        placeholders = ",".join(["?"] * len(statuses))
-        query += f" WHERE status IN ({placeholders})"
-        params = tuple(statuses)
-    query += " ORDER BY created_at DESC"
+    tmp_path, sha, size = _spool_raw(source, storage_root, chunk_size)
 
     with get_conn(INGEST_DB_NAME) as conn:
-        rows = conn.execute(query, params).fetchall()
+        existing = conn.execute(
+            f"""
+            {_INGEST_DOC_SELECT}
+            WHERE raw_hash = ? OR sha256 = ?
+            ORDER BY updated_at DESC
+            LIMIT 1
+            """,
+            (sha, sha),
+        ).fetchone()
 
-    return [
-        {
-            "id": row[0],
-            "sha256": row[1],
-            "original_name": row[2],
-            "mime": row[3],
-            "size_bytes": row[4],
-            "storage_uri_raw": row[5],
-            "status": row[6],
-            "error_message": row[7],
-            "created_at": row[8],
-            "updated_at": row[9],
-            "raw_hash": row[10],
-            "text_hash": row[11],
-            "payload_hash": row[12],
-            "text_uri": row[13],
-            "extraction_uri": row[14],
-            "failed_stage": row[15],
-            "metrics_json": row[16],
-        }
-        for row in rows
+        if existing:
+            _discard_spool(tmp_path)
+            return {**_ingest_doc_from_row(existing), "is_duplicate": True}
+
+        raw_path = _commit_raw(tmp_path, sha, file_name, storage_root)
+        doc = _new_ingest_doc(file_name, mime, sha, raw_path, size)
+        conn.execute(_INSERT_INGEST_DOC_SQL, tuple(doc[col] for col in _INGEST_DOC_COLUMNS))
+
+    return {**doc, "is_duplicate": False}
+
+
+def store_raw_document(file_name: str, mime: str, file_bytes: bytes, storage_root: str = "data") -> Dict[str, Any]:
+    """Primeiro salva raw e depois registra no DB de ingestão com status STORED."""
+    return store_raw_stream(file_name, mime, file_bytes, storage_root=storage_root)
+
+
+def store_raw_documents(
+    files: List[Tuple[str, str, RawSource]], storage_root: str = "data", max_workers: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Versão em lote de `store_raw_stream` para `(nome, mime, bytes ou arquivo)`, na mesma ordem da entrada.
+    Gravação com hash e cópia para o storage rodam em threads (hashlib e I/O liberam o GIL); a
+    estimativa de custo abre o PDF com PyMuPDF, que não é thread-safe, e roda em série depois do pool.
+    A consulta prévia só poupa trabalho: quem decide o duplicado é o INSERT com ON CONFLICT(sha256),
+    e na mesma transação as linhas vencedoras são relidas, então uma importação concorrente do mesmo
+    arquivo vira duplicado em vez de derrubar o lote inteiro.
+    """
+    init_ingest_db()
+    if not files:
+        return []
+    workers = max_workers or INGEST_THREADS
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_spool_raw, item[2], storage_root) for item in files]
+    spooled: List[Tuple[str, str, int]] = []
+    failure: Optional[BaseException] = None
+    for future in futures:
+        try:
+            spooled.append(future.result())
+        except Exception as exc:
+            failure = failure or exc
+    if failure is not None:
+        for tmp_path, _, _ in spooled:
+            _discard_spool(tmp_path)
+        raise failure
+
+    try:
+        return _store_spooled(files, spooled, storage_root, workers)
+    finally:
+        # Temporários já movidos para o storage não existem mais; o que sobrou é descartado.
+        for tmp_path, _, _ in spooled:
+            _discard_spool(tmp_path)
+
+
+def _select_docs_by_hash(conn: sqlite3.Connection, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+    found: Dict[str, Dict[str, Any]] = {}
+    for offset in range(0, len(keys), 400):
+        chunk = keys[offset: offset + 400]
+        placeholders = ",".join(["?"] * len(chunk))
+        rows = conn.execute(
+            f"{_INGEST_DOC_SELECT} WHERE raw_hash IN ({placeholders}) OR sha256 IN ({placeholders}) ORDER BY updated_at ASC",
+            (*chunk, *chunk),
+        ).fetchall()
+        for row in rows:
+            doc = _ingest_doc_from_row(row)
+            found[doc["raw_hash"] or doc["sha256"]] = doc
+            found[doc["sha256"]] = doc
+    return found
+
+
+def _store_spooled(
+    files: List[Tuple[str, str, RawSource]], spooled: List[Tuple[str, str, int]], storage_root: str, workers: int
+) -> List[Dict[str, Any]]:
+    with get_conn(INGEST_DB_NAME) as conn:
+        existing = _select_docs_by_hash(conn, sorted({sha for _, sha, _ in spooled}))
+
+    # Primeira ocorrência de cada hash no lote é o documento novo; as demais são duplicadas dele.
+    first_index: Dict[str, int] = {}
+    new_indexes = []
+    for idx, (tmp_path, sha, _) in enumerate(spooled):
+        if sha in existing or sha in first_index:
+            _discard_spool(tmp_path)
+            continue
+        first_index[sha] = idx
+        new_indexes.append(idx)
+
+    def _commit(idx: int) -> str:
+        tmp_path, sha, _ = spooled[idx]
+        return _commit_raw(tmp_path, sha, files[idx][0], storage_root)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        raw_paths = list(pool.map(_commit, new_indexes))
+    prepared = [
+        _new_ingest_doc(files[idx][0], files[idx][1], spooled[idx][1], raw_path, spooled[idx][2])
+        for idx, raw_path in zip(new_indexes, raw_paths)
     ]
+    rows = [tuple(doc[col] for col in _INGEST_DOC_COLUMNS) for doc in prepared]
+
+    def _insert(c: sqlite3.Connection) -> Dict[str, Dict[str, Any]]:
+        c.executemany(_INSERT_INGEST_DOC_SQL + " ON CONFLICT(sha256) DO NOTHING", rows)
+        return _select_docs_by_hash(c, sorted(first_index))
+
+    def _op():
+        with get_conn(INGEST_DB_NAME) as conn:
+            apply_sqlite_pragmas(conn)
+            return with_tx(conn, _insert)
+
+    if prepared:
+        existing.update(retry_on_lock(_op))
+    created_ids = {doc["id"] for doc in prepared}
+
+    out = []
+    for idx, (_, sha, _) in enumerate(spooled):
+        doc = existing[sha]
+        out.append({**doc, "is_duplicate": idx != first_index.get(sha) or doc["id"] not in created_ids})
+    return out
+
+
+def _remember_raw_verification(path: str, sha: str) -> None:
+    stat = os.stat(path)
+
+    def _op():
+        with get_conn(INGEST_DB_NAME) as conn:
+            conn.execute(
+                """
+                INSERT INTO raw_verifications (path, size_bytes, mtime_ns, sha256, verified_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    size_bytes = excluded.size_bytes, mtime_ns = excluded.mtime_ns,
+                    sha256 = excluded.sha256, verified_at = excluded.verified_at
+                """,
+                (path, stat.st_size, stat.st_mtime_ns, sha, _now_iso()),
+            )
+
+    retry_on_lock(_op)
+
+
+def get_spreadsheet_layout(fingerprint: str) -> Optional[LayoutPlanilha]:
+    init_ingest_db()
+    with get_conn(INGEST_DB_NAME) as conn:
+        row = conn.execute("SELECT layout_json FROM spreadsheet_layouts WHERE fingerprint = ?", (fingerprint,)).fetchone()
+    if not row:
+        increment_counter("spreadsheet_layout_misses")
+        return None
+    try:
+        layout = LayoutPlanilha(**json.loads(row[0]))
+    except (TypeError, ValueError):
+        logger.warning("[PIPELINE] Layout de planilha inválido no registro (%s); será inferido de novo.", fingerprint[:12])
+        return None
+
+    def _op():
+        with get_conn(INGEST_DB_NAME) as conn:
+            conn.execute(
+                "UPDATE spreadsheet_layouts SET hits = hits + 1, last_used_at = ? WHERE fingerprint = ?",
+                (_now_iso(), fingerprint),
+            )
+
+    retry_on_lock(_op)
+    increment_counter("spreadsheet_layout_hits")
+    return layout
+
+
+def save_spreadsheet_layout(fingerprint: str, layout: LayoutPlanilha) -> None:
+    init_ingest_db()
+
+    def _op():
+        with get_conn(INGEST_DB_NAME) as conn:
+            conn.execute(
+                """
+                INSERT INTO spreadsheet_layouts (fingerprint, layout_json, created_at) VALUES (?, ?, ?)
+                ON CONFLICT(fingerprint) DO UPDATE SET layout_json = excluded.layout_json
+                """,
+                (fingerprint, json.dumps(asdict(layout), ensure_ascii=False), _now_iso()),
+            )
+
+    retry_on_lock(_op)
+
+
+def list_spreadsheet_layouts() -> List[Dict[str, Any]]:
+    init_ingest_db()
+    with get_conn(INGEST_DB_NAME) as conn:
+        rows = conn.execute(
+            "SELECT fingerprint, layout_json, hits, created_at, last_used_at FROM spreadsheet_layouts ORDER BY hits DESC"
+        ).fetchall()
+    return [{**dict(r), "layout": json.loads(r["layout_json"])} for r in rows]
+
+
+def verify_raw_file(path: str, expected_sha256: str) -> bool:
+    """
+    Confere o SHA-256 do raw. Se (tamanho, mtime) batem com a última verificação, reaproveita o hash
+    registrado; senão relê o arquivo em blocos e atualiza o cache.
+    """
+    init_ingest_db()
+    stat = os.stat(path)
+    with get_conn(INGEST_DB_NAME) as conn:
+        row = conn.execute("SELECT size_bytes, mtime_ns, sha256 FROM raw_verifications WHERE path = ?", (path,)).fetchone()
+    if row and int(row[0]) == stat.st_size and int(row[1]) == stat.st_mtime_ns:
+        return row[2] == expected_sha256
+
+    sha = _hash_file(path)
+    _remember_raw_verification(path, sha)
+    return sha == expected_sha256
+
+
+def list_ingest_documents(statuses: Optional[List[str]] = None, order: str = "recent") -> List[Dict[str, Any]]:
+    """
+    Lista documentos da ingestão. `order`: "recent" (mais novos primeiro, para a UI),
+    "fifo" (mais antigos primeiro) ou "sjf" (menor custo estimado com aging, para processamento).
+    """
+    init_ingest_db()
+    query = _INGEST_DOC_SELECT
+    params: Tuple[Any, ...] = ()
+    if statuses:
+        placeholders = ",".join(["?"] * len(statuses))
+        query += f" WHERE status IN ({placeholders})"
+        params = tuple(statuses)
+    query += " ORDER BY created_at ASC" if order in ["fifo", "sjf"] else " ORDER BY created_at DESC"
+
+    with get_conn(INGEST_DB_NAME) as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    docs = [_ingest_doc_from_row(row) for row in rows]
+    if order == "sjf":
+        now = datetime.now(timezone.utc)
+        docs.sort(key=lambda doc: document_priority(doc, now))
+    return docs
+
+
+def get_ingest_document(document_id: str) -> Optional[Dict[str, Any]]:
+    init_ingest_db()
+    with get_conn(INGEST_DB_NAME) as conn:
+        row = conn.execute(f"{_INGEST_DOC_SELECT} WHERE id = ?", (document_id,)).fetchone()
+    return _ingest_doc_from_row(row) if row else None
 
 
 def _update_ingest_status(document_id: str, status: str, error_message: Optional[str] = None) -> None:
@@ -783,7 +1838,11 @@ def update_document_status(document_id: str, status: str, error_message: Optiona
     _update_ingest_status(str(document_id), status, error_message)
 
 
-def _update_document_fields(document_id: str, **fields: Any) -> None:
+def _update_document_fields(document_id: str, lease_token: Optional[str] = None, **fields: Any) -> None:
+    """
+    Com `lease_token`, o UPDATE só acontece se o lease do documento ainda for desse token, conferido na
+    mesma transação; senão levanta LeaseLostError sem gravar (o reaper já entregou o documento a outro job).
+    """
     if not fields:
         return
 
@@ -798,16 +1857,29 @@ def _update_document_fields(document_id: str, **fields: Any) -> None:
                 payload["updated_at"] = _now_iso()
                 assignments = ", ".join([f"{k} = ?" for k in payload.keys()])
                 values = list(payload.values()) + [document_id]
-                c.execute(f"UPDATE documents SET {assignments} WHERE id = ?", values)
+                if lease_token is None:
+                    c.execute(f"UPDATE documents SET {assignments} WHERE id = ?", values)
+                    return
+                cur = c.execute(
+                    f"""
+                    UPDATE documents SET {assignments}
+                    WHERE id = ?
+                      AND EXISTS (SELECT 1 FROM processing_slots WHERE document_id = ? AND token = ?)
+                    """,
+                    values + [document_id, lease_token],
+                )
+                if cur.rowcount == 0:
+                    raise LeaseLostError(f"Lease perdido doc={document_id}; gravação de {sorted(fields)} descartada.")
 
             with_tx(conn, _write)
 
     retry_on_lock(_op)
 
 
-def mark_stage_error(document_id: str, failed_stage: str, error_message: str) -> None:
+def mark_stage_error(document_id: str, failed_stage: str, error_message: str, lease_token: Optional[str] = None) -> None:
     _update_document_fields(
         document_id,
+        lease_token=lease_token,
         status=STATUS_ERROR_PROCESSING,
         failed_stage=failed_stage,
         error_message=error_message,
@@ -867,18 +1939,35 @@ def count_processing_docs() -> int:
     return int(row[0] if row else 0)
 
 
-def try_acquire_processing_slot(document_id: str, max_active_docs: Optional[int] = None) -> bool:
-    limit = max_active_docs if max_active_docs is not None else MAX_ACTIVE_DOCS
+def try_acquire_processing_slot(
+    document_id: str,
+    max_active_docs: Optional[int] = None,
+    counted_statuses: Optional[List[str]] = None,
+    token: Optional[str] = None,
+) -> bool:
+    """
+    Reserva uma vaga de processamento (lease em `processing_slots` + status PROCESSING_TEXT)
+    se houver menos de `max_active_docs` leases válidos de documentos em `counted_statuses`
+    (padrão: texto + extração). Leases expirados não contam; o reaper os recupera.
+    """
+    limit = max_active_docs if max_active_docs is not None else get_active_docs_limit()
     limit = max(1, int(limit))
+    counted = list(counted_statuses or [STATUS_PROCESSING_TEXT, STATUS_PROCESSING_EXTRACTION])
 
     def _op() -> bool:
         with get_conn(INGEST_DB_NAME) as conn:
             apply_sqlite_pragmas(conn)
 
             def _write(c):
+                now = time.time()
                 active = c.execute(
-                    "SELECT COUNT(1) FROM documents WHERE status IN (?, ?)",
-                    (STATUS_PROCESSING_TEXT, STATUS_PROCESSING_EXTRACTION),
+                    f"""
+                    SELECT COUNT(1)
+                    FROM processing_slots s
+                    JOIN documents d ON d.id = s.document_id
+                    WHERE s.expires_at > ? AND s.document_id <> ? AND d.status IN ({','.join(['?'] * len(counted))})
+                    """,
+                    (now, document_id, *counted),
                 ).fetchone()[0]
                 if int(active) >= limit:
                     return False
@@ -890,6 +1979,13 @@ def try_acquire_processing_slot(document_id: str, max_active_docs: Optional[int]
                 if st in [STATUS_FINALIZED, STATUS_HITL_REVIEW, STATUS_FINALIZE_PENDING]:
                     return True
 
+                c.execute(
+                    """
+                    INSERT OR REPLACE INTO processing_slots (document_id, worker_id, acquired_at, heartbeat_at, expires_at, token)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    (document_id, os.getenv("WORKER_ID", "worker"), now, now, now + SLOT_LEASE_S, token),
+                )
                 c.execute(
                     "UPDATE documents SET status = ?, failed_stage = NULL, error_message = NULL, updated_at = ? WHERE id = ?",
                     (STATUS_PROCESSING_TEXT, _now_iso(), document_id),
@@ -901,25 +1997,370 @@ def try_acquire_processing_slot(document_id: str, max_active_docs: Optional[int]
     return bool(retry_on_lock(_op))
 
 
-def _load_document_metrics(document_id: str) -> Dict[str, Any]:
+def acquire_stage_lease(document_id: str, lease_s: Optional[float] = None, token: Optional[str] = None) -> bool:
+    """
+    Lease de uma etapa que não disputa vaga (extração): não conta o limite, só falha se outro worker
+    já tem lease válido do documento. Com ele o reaper recupera o documento se o worker morrer.
+    """
+    lease_s = SLOT_LEASE_S if lease_s is None else float(lease_s)
+
+    def _op() -> bool:
+        with get_conn(INGEST_DB_NAME) as conn:
+            now = time.time()
+            cur = conn.execute(
+                """
+                INSERT INTO processing_slots (document_id, worker_id, acquired_at, heartbeat_at, expires_at, token)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(document_id) DO UPDATE SET
+                    worker_id = excluded.worker_id,
+                    acquired_at = excluded.acquired_at,
+                    heartbeat_at = excluded.heartbeat_at,
+                    expires_at = excluded.expires_at,
+                    token = excluded.token
+                WHERE processing_slots.expires_at <= excluded.acquired_at
+                """,
+                (document_id, os.getenv("WORKER_ID", "worker"), now, now, now + lease_s, token),
+            )
+            return cur.rowcount > 0
+
+    return bool(retry_on_lock(_op))
+
+
+def heartbeat_processing_slot(document_id: str, lease_s: Optional[float] = None, token: Optional[str] = None) -> bool:
+    """
+    Renova o lease; False se a vaga já foi recuperada pelo reaper (o job deve parar). Com `token`,
+    só renova o lease desse dono: um lease readquirido por outro job depois do reaper não conta.
+    """
+    lease_s = SLOT_LEASE_S if lease_s is None else float(lease_s)
+
+    def _op() -> bool:
+        with get_conn(INGEST_DB_NAME) as conn:
+            now = time.time()
+            cur = conn.execute(
+                "UPDATE processing_slots SET heartbeat_at = ?, expires_at = ? WHERE document_id = ? AND (? IS NULL OR token = ?)",
+                (now, now + lease_s, document_id, token, token),
+            )
+            return cur.rowcount > 0
+
+    return bool(retry_on_lock(_op))
+
+
+def transfer_processing_slot(document_id: str, token: str, new_token: str, lease_s: Optional[float] = None) -> bool:
+    """
+    Passa o lease do job atual para outro dono (ex.: jobs de página do fan-out) sem liberar a vaga.
+    False se o lease já não pertence a `token`.
+    """
+    lease_s = SLOT_LEASE_S if lease_s is None else float(lease_s)
+
+    def _op() -> bool:
+        with get_conn(INGEST_DB_NAME) as conn:
+            now = time.time()
+            cur = conn.execute(
+                "UPDATE processing_slots SET token = ?, heartbeat_at = ?, expires_at = ? WHERE document_id = ? AND token = ?",
+                (new_token, now, now + lease_s, document_id, token),
+            )
+            return cur.rowcount > 0
+
+    return bool(retry_on_lock(_op))
+
+
+def release_processing_slot(document_id: str, token: Optional[str] = None) -> None:
+    def _op():
+        with get_conn(INGEST_DB_NAME) as conn:
+            conn.execute(
+                "DELETE FROM processing_slots WHERE document_id = ? AND (? IS NULL OR token = ?)",
+                (document_id, token, token),
+            )
+
+    retry_on_lock(_op)
+
+
+def reap_expired_slots() -> List[str]:
+    """
+    Recupera leases expirados (worker morto por OOM/timeout): apaga o lease e devolve o
+    documento ao último checkpoint. Documentos em PROCESSING_TEXT/PROCESSING_EXTRACTION sem lease
+    nenhum há mais de SLOT_LEASE_S (fan-outs e extrações anteriores ao lease) também são retomados.
+    Retorna os ids para reenfileirar.
+    """
+    init_ingest_db()
+
+    def _op() -> List[Tuple[str, str]]:
+        with get_conn(INGEST_DB_NAME) as conn:
+            apply_sqlite_pragmas(conn)
+
+            def _write(c):
+                now = time.time()
+                cutoff = datetime.fromtimestamp(now - SLOT_LEASE_S, timezone.utc).isoformat(timespec="seconds")
+                rows = c.execute(
+                    """
+                    SELECT s.document_id, d.status, d.text_uri
+                    FROM processing_slots s
+                    LEFT JOIN documents d ON d.id = s.document_id
+                    WHERE s.expires_at <= ?
+                    UNION ALL
+                    SELECT d.id, d.status, d.text_uri
+                    FROM documents d
+                    WHERE d.status IN (?, ?) AND d.updated_at < ?
+                      AND NOT EXISTS (SELECT 1 FROM processing_slots s WHERE s.document_id = d.id)
+                    """,
+                    (now, STATUS_PROCESSING_TEXT, STATUS_PROCESSING_EXTRACTION, cutoff),
+                ).fetchall()
+                reclaimed = []
+                for document_id, status, text_uri in rows:
+                    c.execute("DELETE FROM processing_slots WHERE document_id = ?", (document_id,))
+                    if status == STATUS_PROCESSING_TEXT:
+                        resume = STATUS_TEXT_EXTRACTED if text_uri and os.path.exists(text_uri) else STATUS_STORED
+                    elif status in [STATUS_PROCESSING_EXTRACTION, STATUS_TEXT_EXTRACTED]:
+                        # TEXT_EXTRACTED com lease: o worker da extração morreu antes de começar a etapa.
+                        resume = STATUS_TEXT_EXTRACTED
+                    else:
+                        continue
+                    c.execute(
+                        "UPDATE documents SET status = ?, updated_at = ? WHERE id = ?",
+                        (resume, _now_iso(), document_id),
+                    )
+                    reclaimed.append((document_id, resume))
+                return reclaimed
+
+            return with_tx(conn, _write)
+
+    reclaimed = retry_on_lock(_op)
+    for document_id, resume in reclaimed:
+        logger.warning("[PIPELINE] Lease expirado doc=%s; retomando de %s.", document_id, resume)
+        update_document_metrics(document_id, {"slot_reclaims": 1}, increment=True)
+    if reclaimed:
+        increment_counter("slots_reclaimed", len(reclaimed))
+    return [document_id for document_id, _ in reclaimed]
+
+
+def get_slot_status() -> Dict[str, Any]:
+    init_ingest_db()
+    now = time.time()
     with get_conn(INGEST_DB_NAME) as conn:
-        row = conn.execute("SELECT metrics_json FROM documents WHERE id = ?", (document_id,)).fetchone()
-    if not row or not row[0]:
+        rows = conn.execute(
+            "SELECT document_id, worker_id, acquired_at, heartbeat_at, expires_at FROM processing_slots ORDER BY acquired_at"
+        ).fetchall()
+    leases = [
+        {
+            "document_id": r[0],
+            "worker_id": r[1],
+            "held_s": round(now - float(r[2]), 1),
+            "since_heartbeat_s": round(now - float(r[3]), 1),
+            "expired": float(r[4]) <= now,
+        }
+        for r in rows
+    ]
+    active = sum(1 for lease in leases if not lease["expired"])
+    counters = get_counters()
+    waits = int(counters.get("slot_waits", 0))
+    return {
+        "limit": get_active_docs_limit(),
+        "active": active,
+        "expired": len(leases) - active,
+        "reclaimed_total": int(counters.get("slots_reclaimed", 0)),
+        "waits": waits,
+        "avg_wait_s": round(counters.get("slot_wait_s_total", 0.0) / waits, 2) if waits else 0.0,
+        "wakeups": int(counters.get("slot_wakeups", 0)),
+        "leases": leases,
+    }
+
+
+def mark_slot_wait(document_id: str) -> None:
+    """Registra o início da espera por vaga (mantém o primeiro instante entre tentativas)."""
+    metrics = _load_document_metrics(document_id)
+    updates: Dict[str, Any] = {"slot_wait_attempts": int(metrics.get("slot_wait_attempts", 0)) + 1}
+    if not metrics.get("slot_wait_started_at"):
+        updates["slot_wait_started_at"] = time.time()
+    update_document_metrics(document_id, updates)
+
+
+def finish_slot_wait(document_id: str) -> float:
+    """Fecha a espera ao conseguir a vaga; acumula `slot_wait_s` no documento e nos contadores globais."""
+    metrics = _load_document_metrics(document_id)
+    started = metrics.get("slot_wait_started_at")
+    if not started:
+        return 0.0
+    waited = max(0.0, time.time() - float(started))
+    update_document_metrics(
+        document_id,
+        {
+            "slot_wait_s": round(float(metrics.get("slot_wait_s", 0.0)) + waited, 3),
+            "slot_wait_started_at": None,
+            "slot_wait_attempts": 0,
+        },
+    )
+    increment_counter("slot_waits")
+    increment_counter("slot_wait_s_total", waited)
+    return waited
+
+
+def get_active_docs_limit() -> int:
+    """Limite vigente de documentos ativos: última decisão do controlador AIMD ou MAX_ACTIVE_DOCS."""
+    if not ADAPTIVE_CONCURRENCY:
+        return MAX_ACTIVE_DOCS
+    # Caminho quente (cada tentativa de vaga): o schema já vem do app/worker, sem init_ingest_db aqui.
+    with get_conn(INGEST_DB_NAME) as conn:
+        row = conn.execute("SELECT new_limit FROM concurrency_decisions ORDER BY id DESC LIMIT 1").fetchone()
+    return int(row[0]) if row else MAX_ACTIVE_DOCS
+
+
+def flush_llm_http_stats() -> None:
+    """Move os contadores HTTP do LLM deste processo para `pipeline_counters` (visíveis a todos os workers)."""
+    stats = pop_llm_http_stats()
+    if stats["calls"]:
+        increment_counter("llm_http_calls", stats["calls"])
+    if stats["429"]:
+        increment_counter("llm_http_429", stats["429"])
+
+
+def recent_text_stage_latency_s(window_s: float = 900) -> Optional[float]:
+    """Mediana (started_at -> text_extracted_at) dos documentos que concluíram a etapa de texto na janela."""
+    init_ingest_db()
+    cutoff = datetime.now(timezone.utc).timestamp() - window_s
+    with get_conn(INGEST_DB_NAME) as conn:
+        rows = conn.execute(
+            "SELECT metrics_json FROM documents WHERE metrics_json LIKE '%text_extracted_at%' ORDER BY updated_at DESC LIMIT 200"
+        ).fetchall()
+    durations = []
+    for (raw,) in rows:
+        metrics = _parse_metrics_json(raw)
+        started, done = _parse_ts(metrics.get("started_at")), _parse_ts(metrics.get("text_extracted_at"))
+        if started and done and done.timestamp() >= cutoff:
+            durations.append(max(0.0, (done - started).total_seconds()))
+    if not durations:
+        return None
+    durations.sort()
+    return durations[len(durations) // 2]
+
+
+def run_concurrency_controller(
+    signals: Optional[ConcurrencySignals] = None, config: Optional[AimdConfig] = None
+) -> Dict[str, Any]:
+    """Um passo do controlador AIMD; grava a decisão (inclusive "hold") em `concurrency_decisions`."""
+    init_ingest_db()
+    flush_llm_http_stats()
+    counters = get_counters("llm_http_")
+    calls_total = counters.get("llm_http_calls", 0.0)
+    r429_total = counters.get("llm_http_429", 0.0)
+
+    with get_conn(INGEST_DB_NAME) as conn:
+        last = conn.execute(
+            "SELECT new_limit, llm_calls_total, llm_429_total FROM concurrency_decisions ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+    current = int(last[0]) if last else MAX_ACTIVE_DOCS
+
+    if signals is None:
+        cpu_util, mem_used = read_system_signals()
+        delta_calls = calls_total - float(last[1] or 0) if last else calls_total
+        delta_429 = r429_total - float(last[2] or 0) if last else r429_total
+        signals = ConcurrencySignals(
+            cpu_util=cpu_util,
+            mem_used=mem_used,
+            llm_429_rate=(delta_429 / delta_calls) if delta_calls > 0 else None,
+            stage_latency_s=recent_text_stage_latency_s(),
+        )
+
+    new_limit, action, reason = decide_limit(current, signals, config)
+    decision = {
+        "decided_at": _now_iso(),
+        "previous_limit": current,
+        "new_limit": new_limit,
+        "action": action,
+        "reason": reason,
+        "cpu_util": signals.cpu_util,
+        "mem_used": signals.mem_used,
+        "llm_429_rate": signals.llm_429_rate,
+        "stage_latency_s": signals.stage_latency_s,
+        "llm_calls_total": calls_total,
+        "llm_429_total": r429_total,
+    }
+
+    def _op():
+        with get_conn(INGEST_DB_NAME) as conn:
+            conn.execute(
+                f"INSERT INTO concurrency_decisions ({', '.join(decision)}) VALUES ({', '.join(['?'] * len(decision))})",
+                tuple(decision.values()),
+            )
+            # Decisões "hold" a cada CONTROLLER_INTERVAL_S: mantém só as mais recentes para auditoria.
+            conn.execute(
+                "DELETE FROM concurrency_decisions WHERE id <= (SELECT MAX(id) FROM concurrency_decisions) - ?",
+                (CONCURRENCY_DECISIONS_KEEP,),
+            )
+
+    retry_on_lock(_op)
+    if action != "hold":
+        logger.info("[PIPELINE] Limite de documentos ativos %s -> %s (%s).", current, new_limit, reason)
+    return decision
+
+
+def list_concurrency_decisions(limit: int = 50) -> List[Dict[str, Any]]:
+    init_ingest_db()
+    with get_conn(INGEST_DB_NAME) as conn:
+        rows = conn.execute("SELECT * FROM concurrency_decisions ORDER BY id DESC LIMIT ?", (int(limit),)).fetchall()
+    return [dict(r) for r in rows]
+
+
+def increment_counter(name: str, delta: float = 1) -> None:
+    def _op():
+        with get_conn(INGEST_DB_NAME) as conn:
+            conn.execute(
+                """
+                INSERT INTO pipeline_counters (name, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(name) DO UPDATE SET value = value + excluded.value, updated_at = CURRENT_TIMESTAMP
+                """,
+                (name, float(delta)),
+            )
+
+    retry_on_lock(_op)
+
+
+def get_counters(prefix: Optional[str] = None) -> Dict[str, float]:
+    init_ingest_db()
+    with get_conn(INGEST_DB_NAME) as conn:
+        if prefix:
+            rows = conn.execute("SELECT name, value FROM pipeline_counters WHERE name LIKE ?", (f"{prefix}%",)).fetchall()
+        else:
+            rows = conn.execute("SELECT name, value FROM pipeline_counters").fetchall()
+    return {r[0]: float(r[1]) for r in rows}
+
+
+def _parse_metrics_json(raw: Optional[str]) -> Dict[str, Any]:
+    if not raw:
         return {}
     try:
-        return json.loads(row[0])
+        return json.loads(raw)
     except Exception:
         return {}
 
 
+def _load_document_metrics(document_id: str) -> Dict[str, Any]:
+    with get_conn(INGEST_DB_NAME) as conn:
+        row = conn.execute("SELECT metrics_json FROM documents WHERE id = ?", (document_id,)).fetchone()
+    return _parse_metrics_json(row[0] if row else None)
+
+
 def update_document_metrics(document_id: str, updates: Dict[str, Any], increment: bool = False) -> None:
-    metrics = _load_document_metrics(document_id)
-    for k, v in updates.items():
-        if increment and isinstance(v, (int, float)):
-            metrics[k] = float(metrics.get(k, 0)) + float(v)
-        else:
-            metrics[k] = v
-    _update_document_fields(document_id, metrics_json=json.dumps(metrics, ensure_ascii=False))
+    # Leitura + escrita na mesma transação: jobs paralelos (ex.: OCR por página) não perdem chaves.
+    def _op():
+        with get_conn(INGEST_DB_NAME) as conn:
+            apply_sqlite_pragmas(conn)
+
+            def _write(c):
+                row = c.execute("SELECT metrics_json FROM documents WHERE id = ?", (document_id,)).fetchone()
+                metrics = _parse_metrics_json(row[0] if row else None)
+                for k, v in updates.items():
+                    if increment and isinstance(v, (int, float)):
+                        metrics[k] = float(metrics.get(k, 0)) + float(v)
+                    else:
+                        metrics[k] = v
+                c.execute(
+                    "UPDATE documents SET metrics_json = ?, updated_at = ? WHERE id = ?",
+                    (json.dumps(metrics, ensure_ascii=False), _now_iso(), document_id),
+                )
+
+            with_tx(conn, _write)
+
+    retry_on_lock(_op)
 
 
 def find_document_by_text_hash(text_hash: str, exclude_document_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
@@ -996,6 +2437,39 @@ def _save_artifact(document_id: str, doc_sha: str, kind: str, relative_path: str
     return storage_uri
 
 
+def _save_table_artifact(document_id: str, doc_sha: str, df: pd.DataFrame) -> str:
+    """
+    Persiste a planilha já normalizada em formato colunar tipado (Feather; pickle se o pyarrow
+    não estiver disponível), para a etapa de extração não reprocessar o workbook.
+    """
+    df = df.reset_index(drop=True)
+    buffer = io.BytesIO()
+    try:
+        df.to_feather(buffer)
+        relative_path = TABLE_ARTIFACT_PATHS[0]
+    except (ImportError, ValueError, TypeError, NotImplementedError) as exc:
+        # Sem pyarrow ou colunas object com tipos mistos que o Arrow não converte.
+        logger.info("[PIPELINE] Planilha normalizada salva em pickle (%s).", exc)
+        buffer = io.BytesIO()
+        df.to_pickle(buffer, compression=None)
+        relative_path = TABLE_ARTIFACT_PATHS[1]
+    return _save_artifact(document_id, doc_sha, "table", relative_path, buffer.getvalue(), meta={"rows": len(df)})
+
+
+def _load_table_artifact(doc_sha: str) -> Optional[pd.DataFrame]:
+    """Planilha normalizada da versão atual; None (a extração re-normaliza) se ausente ou ilegível."""
+    for relative_path in TABLE_ARTIFACT_PATHS:
+        path = os.path.join("data", "artifacts", doc_sha, relative_path)
+        if not os.path.exists(path):
+            continue
+        try:
+            # Artefato gerado pela própria pipeline (endereçado pelo SHA do raw).
+            return pd.read_feather(path) if path.endswith(".feather") else pd.read_pickle(path, compression=None)
+        except Exception as exc:
+            logger.warning("[PIPELINE] Artefato de planilha ilegível (%s): %s; re-normalizando.", path, exc)
+    return None
+
+
 def _save_text_artifact(document_id: str, doc_sha: str, kind: str, relative_path: str, text: str, meta: Optional[Dict[str, Any]] = None) -> str:
     return _save_artifact(document_id, doc_sha, kind, relative_path, text.encode("utf-8"), meta=meta)
 
@@ -1053,16 +2527,17 @@ def _compute_extraction_metrics(payload: List[Dict[str, Any]]) -> ExtractionMetr
     return metrics
 
 
-def _requires_llm(metrics: ExtractionMetrics) -> Optional[str]:
+def _requires_llm(metrics: ExtractionMetrics, doc_type: Optional[str] = None) -> Optional[str]:
+    thresholds = DOC_TYPE_GATING.get(doc_type or "", GatingThresholds())
     if metrics.total_items == 0:
         return "regex_empty"
-    if metrics.valid_items < MIN_ITEMS:
+    if metrics.valid_items < thresholds.min_items:
         return "low_valid_items"
-    if metrics.confidence < MIN_CONF:
+    if metrics.confidence < thresholds.min_conf:
         return "low_confidence"
-    if metrics.has_values_ratio < MIN_VALUES_RATIO:
+    if metrics.has_values_ratio < thresholds.min_values_ratio:
         return "low_values_ratio"
-    if metrics.has_dates_ratio < MIN_DATES_RATIO:
+    if metrics.has_dates_ratio < thresholds.min_dates_ratio:
         return "low_dates_ratio"
     return None
 
@@ -1099,26 +2574,431 @@ def _get_llm_cached_payload(text_hash: str) -> Optional[Tuple[List[Dict[str, Any
     return payload, payload_uri, llm_model
 
 
-def extract_transactions(text: Optional[str] = None, df: Optional[pd.DataFrame] = None) -> ExtractionResult:
+def _is_summary_line(descricao: str) -> bool:
+    desc = (descricao or "").strip().lower()
+    if not desc:
+        return False
+    return any(token in desc for token in RESUMO_TOKENS)
+
+
+def merchant_key(descricao: Optional[str], merchant: Optional[str] = None) -> str:
+    """Chave estável de estabelecimento: sem acentos, dígitos, parcelas e pontuação."""
+    base = _norm_desc(merchant or descricao or "")
+    base = unicodedata.normalize("NFKD", base).encode("ascii", "ignore").decode("ascii").upper()
+    base = re.sub(r"\bPARC(?:ELA)?\s*\d{1,2}\s*(?:/|DE)\s*\d{1,2}\b", " ", base)
+    base = re.sub(r"[^A-Z]+", " ", base)
+    return re.sub(r"\s+", " ", base).strip()
+
+
+def _merchant_key_candidates(item: Dict[str, Any]) -> List[str]:
+    keys = []
+    for key in [merchant_key(None, item.get("merchant")), merchant_key(item.get("descricao"))]:
+        if len(key) >= 3 and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def learn_merchant_categories(items: Iterable[Dict[str, Any]], source: str = "review") -> int:
+    """
+    Registra categorias confirmadas por humanos na memória de estabelecimentos. Cada confirmação é
+    um voto em (estabelecimento, categoria); a categoria lembrada só troca quando a nova passa a
+    ter mais votos que a atual, então uma correção isolada não apaga um histórico consistente.
+    """
+    rows = []
+    for item in items:
+        descricao = str(item.get("descricao") or "").strip()
+        categoria = str(item.get("categoria") or "").strip()
+        if not descricao or not categoria or categoria == DEFAULT_CATEGORY or _is_summary_line(descricao):
+            continue
+        for key in _merchant_key_candidates(item):
+            rows.append((key, categoria, source, _now_iso()))
+
+    if not rows:
+        return 0
+
+    init_ingest_db()
+
+    def _op():
+        with get_conn(INGEST_DB_NAME) as conn:
+            apply_sqlite_pragmas(conn)
+
+            def _write(c):
+                c.executemany(
+                    """
+                    INSERT INTO merchant_category_votes (merchant_key, categoria, votes, updated_at)
+                    VALUES (?, ?, 1, ?)
+                    ON CONFLICT(merchant_key, categoria) DO UPDATE SET
+                        votes = votes + 1,
+                        updated_at = excluded.updated_at
+                    """,
+                    [(key, categoria, now) for key, categoria, _, now in rows],
+                )
+                c.executemany(
+                    """
+                    INSERT INTO merchant_category (merchant_key, categoria, votes, hits, source, updated_at)
+                    SELECT merchant_key, categoria, votes, 0, ?, ?
+                    FROM merchant_category_votes
+                    WHERE merchant_key = ? AND categoria = ?
+                    ON CONFLICT(merchant_key) DO UPDATE SET
+                        categoria = excluded.categoria,
+                        votes = excluded.votes,
+                        source = excluded.source,
+                        updated_at = excluded.updated_at
+                    WHERE excluded.categoria = merchant_category.categoria OR excluded.votes > merchant_category.votes
+                    """,
+                    [(source, now, key, categoria) for key, categoria, source, now in rows],
+                )
+                return len(rows)
+
+            return with_tx(conn, _write)
+
+    return int(retry_on_lock(_op))
+
+
+def rebuild_merchant_categories_from_transactions() -> int:
+    """Semeia a memória a partir de `transacoes` finalizadas (categoria majoritária por chave)."""
+    with get_conn(DB_NAME) as conn:
+        rows = conn.execute(
+            """
+            SELECT descricao, categoria, COUNT(1)
+            FROM transacoes
+            WHERE categoria IS NOT NULL AND categoria <> '' AND categoria <> ?
+            GROUP BY descricao, categoria
+            """,
+            (DEFAULT_CATEGORY,),
+        ).fetchall()
+
+    votes: Dict[str, Dict[str, int]] = {}
+    for descricao, categoria, total in rows:
+        key = merchant_key(descricao)
+        if len(key) < 3:
+            continue
+        per_key = votes.setdefault(key, {})
+        per_key[categoria] = per_key.get(categoria, 0) + int(total)
+
+    payload = []
+    per_category = []
+    for key, per_key in votes.items():
+        categoria, total = max(per_key.items(), key=lambda kv: kv[1])
+        payload.append((key, categoria, total, "transacoes", _now_iso()))
+        per_category.extend((key, cat, count, _now_iso()) for cat, count in per_key.items())
+
+    if not payload:
+        return 0
+
+    init_ingest_db()
+
+    def _op():
+        with get_conn(INGEST_DB_NAME) as conn:
+            apply_sqlite_pragmas(conn)
+
+            def _write(c):
+                c.executemany(
+                    """
+                    INSERT INTO merchant_category_votes (merchant_key, categoria, votes, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT(merchant_key, categoria) DO UPDATE SET
+                        votes = excluded.votes,
+                        updated_at = excluded.updated_at
+                    """,
+                    per_category,
+                )
+                c.executemany(
+                    """
+                    INSERT INTO merchant_category (merchant_key, categoria, votes, hits, source, updated_at)
+                    VALUES (?, ?, ?, 0, ?, ?)
+                    ON CONFLICT(merchant_key) DO UPDATE SET
+                        categoria = excluded.categoria,
+                        votes = excluded.votes,
+                        source = excluded.source,
+                        updated_at = excluded.updated_at
+                    """,
+                    payload,
+                )
+                return len(payload)
+
+            return with_tx(conn, _write)
+
+    return int(retry_on_lock(_op))
+
+
+def lookup_merchant_categories(transacoes: List[Dict[str, Any]], document_id: Optional[str] = None) -> Dict[int, str]:
+    """Consulta a memória de estabelecimentos e retorna índice -> categoria para os acertos."""
+    if not transacoes:
+        return {}
+
+    init_ingest_db()
+    candidates = {idx: _merchant_key_candidates(item) for idx, item in enumerate(transacoes)}
+    all_keys = sorted({key for keys in candidates.values() for key in keys})
+
+    known: Dict[str, str] = {}
+    with get_conn(INGEST_DB_NAME) as conn:
+        for start in range(0, len(all_keys), 500):
+            chunk = all_keys[start:start + 500]
+            placeholders = ",".join(["?"] * len(chunk))
+            for key, categoria in conn.execute(
+                f"SELECT merchant_key, categoria FROM merchant_category WHERE merchant_key IN ({placeholders})",
+                tuple(chunk),
+            ).fetchall():
+                known[key] = categoria
+
+    resolved: Dict[int, str] = {}
+    used_keys: Dict[str, int] = {}
+    for idx, keys in candidates.items():
+        for key in keys:
+            if key in known:
+                resolved[idx] = known[key]
+                used_keys[key] = used_keys.get(key, 0) + 1
+                break
+
+    if used_keys:
+
+        def _op():
+            with get_conn(INGEST_DB_NAME) as conn:
+                apply_sqlite_pragmas(conn)
+                with_tx(
+                    conn,
+                    lambda c: c.executemany(
+                        "UPDATE merchant_category SET hits = hits + ? WHERE merchant_key = ?",
+                        [(total, key) for key, total in used_keys.items()],
+                    ),
+                )
+
+        retry_on_lock(_op)
+
+    if document_id:
+        update_document_metrics(
+            document_id,
+            {"category_memo_lookups": len(transacoes), "category_memo_hits": len(resolved)},
+            increment=True,
+        )
+    logger.info("[CATEGORIA] Memória de estabelecimentos: %s/%s acerto(s).", len(resolved), len(transacoes))
+    return resolved
+
+
+def predict_local_categories(transacoes: List[Dict[str, Any]], document_id: Optional[str] = None) -> Dict[int, str]:
+    """Aplica o classificador local e retorna índice -> categoria só para predições confiantes."""
+    model = carregar_modelo(CATEGORY_MODEL_PATH)
+    if model is None or not transacoes:
+        return {}
+
+    inicio = time.perf_counter()
+    labels, confidences = model.predict([str(t.get("descricao") or "") for t in transacoes])
+    resolved = {idx: label for idx, (label, conf) in enumerate(zip(labels, confidences)) if float(conf) >= CATEGORY_MODEL_MIN_CONF}
+    elapsed_ms = (time.perf_counter() - inicio) * 1000
+
+    if document_id:
+        update_document_metrics(
+            document_id,
+            {"category_model_lookups": len(transacoes), "category_model_hits": len(resolved)},
+            increment=True,
+        )
+    logger.info(
+        "[CATEGORIA] Classificador local: %s/%s confiante(s) em %.1f ms.",
+        len(resolved),
+        len(transacoes),
+        elapsed_ms,
+    )
+    return resolved
+
+
+def _resolve_local_categories(transacoes: List[Dict[str, Any]], document_id: Optional[str] = None) -> Dict[int, str]:
+    resolved = lookup_merchant_categories(transacoes, document_id=document_id)
+    pending = [idx for idx in range(len(transacoes)) if idx not in resolved]
+    if pending:
+        predicted = predict_local_categories([transacoes[idx] for idx in pending], document_id=document_id)
+        for pos, categoria in predicted.items():
+            resolved[pending[pos]] = categoria
+    return resolved
+
+
+def apply_local_categories(payload: List[Dict[str, Any]], document_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Preenche `categoria` (memória, depois classificador local) apenas onde ela está vazia ou no default."""
+    pending = [
+        idx
+        for idx, item in enumerate(payload)
+        if str(item.get("categoria") or DEFAULT_CATEGORY) == DEFAULT_CATEGORY
+        and not _is_summary_line(str(item.get("descricao") or ""))
+    ]
+    if not pending:
+        return payload
+
+    resolved = _resolve_local_categories([payload[idx] for idx in pending], document_id=document_id)
+    if not resolved:
+        return payload
+
+    out = [dict(item) for item in payload]
+    for pos, categoria in resolved.items():
+        out[pending[pos]]["categoria"] = categoria
+    return out
+
+
+def categorize_transactions(transacoes: List[Dict[str, Any]], document_id: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Categoriza via memória de estabelecimentos e classificador local; só o restante vai ao LLM."""
+    conhecidas = _resolve_local_categories(transacoes, document_id=document_id)
+    try:
+        return categorizar_transacoes_llm(transacoes, categorias_conhecidas=conhecidas)
+    finally:
+        flush_llm_http_stats()
+
+
+def train_category_classifier(model_path: Optional[str] = None, min_examples: int = 20) -> Dict[str, Any]:
+    """
+    Treina e persiste o classificador local com as transações finalizadas em `transacoes`.
+    Linhas em DEFAULT_CATEGORY ficam de fora: "Outros" é o que sobra sem categoria, não um rótulo,
+    e ensinaria o modelo a devolver o fallback com confiança.
+    """
+    with get_conn(DB_NAME) as conn:
+        rows = conn.execute(
+            "SELECT descricao, categoria FROM transacoes WHERE categoria IS NOT NULL AND TRIM(categoria) NOT IN ('', ?)",
+            (DEFAULT_CATEGORY,),
+        ).fetchall()
+
+    if len(rows) < int(min_examples):
+        return {"trained": False, "examples": len(rows), "reason": "poucos exemplos"}
+
+    inicio = time.perf_counter()
+    model = ClassificadorCategorias().fit([r[0] for r in rows], [r[1] for r in rows])
+    path = model.save(model_path or CATEGORY_MODEL_PATH)
+    return {
+        "trained": True,
+        "examples": len(rows),
+        "classes": model.classes,
+        "model_path": path,
+        "train_seconds": round(time.perf_counter() - inicio, 3),
+    }
+
+
+def get_llm_gating_stats() -> List[Dict[str, Any]]:
+    """Taxa de documentos enviados ao LLM por tipo de documento (a partir de metrics_json)."""
+    init_ingest_db()
+    with get_conn(INGEST_DB_NAME) as conn:
+        rows = conn.execute(
+            """
+            SELECT
+                json_extract(metrics_json, '$.doc_type') AS doc_type,
+                COUNT(1) AS docs,
+                SUM(CASE WHEN json_extract(metrics_json, '$.llm_requested') THEN 1 ELSE 0 END) AS llm_requested,
+                SUM(CASE WHEN json_extract(metrics_json, '$.extraction_method') = 'llm' THEN 1 ELSE 0 END) AS llm_used
+            FROM documents
+            WHERE metrics_json IS NOT NULL AND json_valid(metrics_json)
+              AND json_extract(metrics_json, '$.doc_type') IS NOT NULL
+            GROUP BY doc_type
+            ORDER BY docs DESC
+            """
+        ).fetchall()
+
+    return [
+        {
+            "doc_type": row[0],
+            "docs": int(row[1]),
+            "llm_requested": int(row[2] or 0),
+            "llm_used": int(row[3] or 0),
+            "llm_call_rate": (int(row[2] or 0) / int(row[1])) if row[1] else 0.0,
+        }
+        for row in rows
+    ]
+
+
+def get_memory_stats_by_doc_type() -> List[Dict[str, Any]]:
+    """RSS inicial médio e pico (médio/máximo) por extensão do arquivo e etapa, a partir de metrics_json."""
+    init_ingest_db()
+    with get_conn(INGEST_DB_NAME) as conn:
+        rows = conn.execute(
+            """
+            SELECT original_name, size_bytes, metrics_json FROM documents
+            WHERE metrics_json LIKE '%rss_peak_mb%'
+            """
+        ).fetchall()
+
+    groups: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for row in rows:
+        metrics = _parse_metrics_json(row["metrics_json"])
+        ext = os.path.splitext(str(row["original_name"]).lower())[1] or "?"
+        for stage in ("text", "extraction"):
+            peak = metrics.get(f"{stage}_rss_peak_mb")
+            if peak is None:
+                continue
+            group = groups.setdefault((ext, stage), {"docs": 0, "size_mb": 0.0, "start": [], "peak": []})
+            group["docs"] += 1
+            group["size_mb"] += float(row["size_bytes"] or 0) / (1024 * 1024)
+            group["peak"].append(float(peak))
+            if metrics.get(f"{stage}_rss_start_mb") is not None:
+                group["start"].append(float(metrics[f"{stage}_rss_start_mb"]))
+
+    return [
+        {
+            "doc_type": ext,
+            "stage": stage,
+            "docs": g["docs"],
+            "avg_size_mb": round(g["size_mb"] / g["docs"], 2),
+            "avg_rss_start_mb": round(sum(g["start"]) / len(g["start"]), 1) if g["start"] else None,
+            "avg_rss_peak_mb": round(sum(g["peak"]) / len(g["peak"]), 1),
+            "max_rss_peak_mb": max(g["peak"]),
+        }
+        for (ext, stage), g in sorted(groups.items())
+    ]
+
+
+def get_merchant_category_stats() -> Dict[str, Any]:
+    init_ingest_db()
+    with get_conn(INGEST_DB_NAME) as conn:
+        memo = conn.execute("SELECT COUNT(1), COALESCE(SUM(hits), 0) FROM merchant_category").fetchone()
+        docs = conn.execute(
+            """
+            SELECT
+                COALESCE(SUM(json_extract(metrics_json, '$.category_memo_lookups')), 0),
+                COALESCE(SUM(json_extract(metrics_json, '$.category_memo_hits')), 0)
+            FROM documents
+            WHERE metrics_json IS NOT NULL AND json_valid(metrics_json)
+            """
+        ).fetchone()
+
+    lookups = float(docs[0] or 0)
+    hits = float(docs[1] or 0)
+    return {
+        "entries": int(memo[0] or 0),
+        "total_hits": int(memo[1] or 0),
+        "lookups": int(lookups),
+        "hits": int(hits),
+        "hit_rate": (hits / lookups) if lookups else 0.0,
+    }
+
+
+def extract_transactions(text: Optional[str] = None, df: Optional[pd.DataFrame] = None, allow_llm: bool = True) -> ExtractionResult:
+    """
+    Extrai transações por regex/parsers locais e, se o gating pedir, pelo LLM.
+    Com `allow_llm=False` devolve o resultado local mantendo `reason` preenchido,
+    para que o LLM rode depois como refinamento assíncrono.
+    """
     if df is not None:
         candidate = df[["data", "valor", "descricao", "categoria", "tipo"]].copy()
         candidate["data"] = pd.to_datetime(candidate["data"], errors="coerce").dt.strftime("%Y-%m-%d")
         payload = candidate.fillna("").to_dict(orient="records")
         metrics = _compute_extraction_metrics(payload)
-        return ExtractionResult(method="regex", payload=payload, metrics=metrics, reason="spreadsheet")
+        return ExtractionResult(method="regex", payload=payload, metrics=metrics, reason="spreadsheet", doc_type="spreadsheet")
 
     text = text or ""
+    nota = parse_nfce(text)
+    if nota and nota.reconciled:
+        # NFC-e com soma dos itens igual ao total declarado: dispensa gating e LLM.
+        payload = nota.to_transactions()
+        metrics = _compute_extraction_metrics(payload)
+        return ExtractionResult(method="regex", payload=payload, metrics=metrics, reason=None, doc_type="nfce")
+
+    doc_type = classificar_tipo_documento(text)
     payload = extrair_dados_financeiros(text)
     metrics = _compute_extraction_metrics(payload)
-    reason = _requires_llm(metrics)
-    if reason:
+    reason = _requires_llm(metrics, doc_type)
+    if reason and allow_llm:
         llm_payload, llm_err = extrair_dados_financeiros_llm(text)
+        flush_llm_http_stats()
         if llm_payload:
             llm_metrics = _compute_extraction_metrics(llm_payload)
-            return ExtractionResult(method="llm", payload=llm_payload, metrics=llm_metrics, reason=reason)
+            return ExtractionResult(method="llm", payload=llm_payload, metrics=llm_metrics, reason=reason, doc_type=doc_type)
         if llm_err:
-            logger.warning("[PIPELINE] LLM indisponível após gating (%s): %s", reason, llm_err)
-    return ExtractionResult(method="regex", payload=payload, metrics=metrics, reason=reason)
+            logger.warning("[PIPELINE] LLM indisponível após gating (%s/%s): %s", doc_type, reason, llm_err)
+    return ExtractionResult(method="regex", payload=payload, metrics=metrics, reason=reason, doc_type=doc_type)
 def _run_llm_checks(payload: List[Dict[str, Any]]) -> Dict[str, Any]:
     logger.info("[LLM_REVIEW] Iniciando validações automáticas para %s transação(ões).", len(payload))
     issues = []
@@ -1210,27 +3090,58 @@ def _record_extraction(
     metrics: Optional[ExtractionMetrics] = None,
     text_hash: Optional[str] = None,
     llm_model: Optional[str] = None,
-) -> None:
+    status: str = EXTRACTION_PENDING,
+) -> int:
+    """Grava uma nova versão da extração; versões provisórias anteriores ficam SUPERSEDED."""
     metrics_json = json.dumps(asdict(metrics), ensure_ascii=False) if metrics else None
     def _op():
         with get_conn(INGEST_DB_NAME) as conn:
             apply_sqlite_pragmas(conn)
 
             def _write(c):
+                version = c.execute(
+                    "SELECT COALESCE(MAX(version), 0) + 1 FROM extractions WHERE document_id = ?",
+                    (document_id,),
+                ).fetchone()[0]
+                c.execute(
+                    "UPDATE extractions SET status = ? WHERE document_id = ? AND status = ?",
+                    (EXTRACTION_SUPERSEDED, document_id, EXTRACTION_PROVISIONAL),
+                )
                 c.execute(
                     """
-                    INSERT INTO extractions (document_id, extractor, payload_uri, confidence, llm_checks_uri, metrics_json, text_hash, llm_model, status)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    INSERT INTO extractions (document_id, extractor, payload_uri, confidence, llm_checks_uri, metrics_json, text_hash, llm_model, status, version)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                     """,
-                    (document_id, extractor, payload_uri, float(confidence), llm_checks_uri, metrics_json, text_hash, llm_model, "PENDING"),
+                    (document_id, extractor, payload_uri, float(confidence), llm_checks_uri, metrics_json, text_hash, llm_model, status, version),
                 )
+                return int(version)
 
-            with_tx(conn, _write)
+            return with_tx(conn, _write)
 
-    retry_on_lock(_op)
+    return retry_on_lock(_op)
 
 
-def run_pipeline_for_document(document_id: str) -> Tuple[bool, str]:
+def run_pipeline_for_document(
+    document_id: str,
+    defer_llm: bool = False,
+    stages: Optional[Iterable[str]] = None,
+    should_abort: Optional[Callable[[], bool]] = None,
+    lease_token: Optional[str] = None,
+) -> Tuple[bool, str]:
+    """
+    Executa a pipeline checkpointada até HITL_REVIEW.
+    Com `defer_llm=True` o resultado local é publicado como extração provisória e o
+    LLM fica para `refine_extraction_with_llm` (ver `needs_llm_refinement`).
+    `stages` restringe a execução a algumas etapas de PIPELINE_STAGES (jobs por etapa).
+    `should_abort` (lease perdido) é consultado antes de cada gravação: se True, a execução
+    para sem gravar nada, porque o documento já foi retomado por outro job. Como o heartbeat só
+    o atualiza de tempos em tempos, as gravações de status também conferem `lease_token` na
+    própria transação: a de um job com lease vencido não muda nada e interrompe a execução.
+    """
+    stages = set(stages or PIPELINE_STAGES)
+    unknown = stages - set(PIPELINE_STAGES)
+    if unknown:
+        raise ValueError(f"Etapas desconhecidas: {sorted(unknown)}")
     init_ingest_db()
 
     def _load_doc() -> Optional[sqlite3.Row]:
@@ -1245,6 +3156,10 @@ def run_pipeline_for_document(document_id: str) -> Tuple[bool, str]:
                 (document_id,),
             ).fetchone()
 
+    def _guard() -> None:
+        if should_abort is not None and should_abort():
+            raise LeaseLostError(f"Lease perdido doc={document_id}; execução interrompida antes de gravar.")
+
     doc = _load_doc()
     if not doc:
         return False, "Documento não encontrado na ingestão."
@@ -1255,49 +3170,78 @@ def run_pipeline_for_document(document_id: str) -> Tuple[bool, str]:
         return True, f"Documento já está em {doc['status']}."
 
     raw_uri = doc["storage_uri_raw"]
-    if not os.path.exists(raw_uri):
-        _update_document_fields(document_id, status=STATUS_ERROR_STORAGE, error_message="Arquivo raw não encontrado", failed_stage="RAW_VALIDATE")
-        return False, "Arquivo raw não encontrado."
+    try:
+        _guard()
+        if not os.path.exists(raw_uri):
+            _update_document_fields(
+                document_id,
+                lease_token=lease_token,
+                status=STATUS_ERROR_STORAGE,
+                error_message="Arquivo raw não encontrado",
+                failed_stage="RAW_VALIDATE",
+            )
+            return False, "Arquivo raw não encontrado."
 
-    with open(raw_uri, "rb") as handler:
-        raw_bytes = handler.read()
+        if not verify_raw_file(raw_uri, doc["sha256"]):
+            _update_document_fields(
+                document_id,
+                lease_token=lease_token,
+                status=STATUS_ERROR_STORAGE,
+                error_message="SHA256 divergente do raw",
+                failed_stage="RAW_VALIDATE",
+            )
+            return False, "SHA divergente do raw."
+    except LeaseLostError as exc:
+        logger.warning("[PIPELINE] %s", exc)
+        return False, str(exc)
 
-    if _sha256_bytes(raw_bytes) != doc["sha256"]:
-        _update_document_fields(document_id, status=STATUS_ERROR_STORAGE, error_message="SHA256 divergente do raw", failed_stage="RAW_VALIDATE")
-        return False, "SHA divergente do raw."
+    if doc["raw_hash"] != doc["sha256"]:
+        _update_document_fields(document_id, raw_hash=doc["sha256"])
 
-    current_raw_hash = compute_raw_hash(raw_bytes)
-    if doc["raw_hash"] != current_raw_hash:
-        _update_document_fields(document_id, raw_hash=current_raw_hash)
+    uploads: List[RawUpload] = []
 
-    class _UploadWrap(io.BytesIO):
-        def __init__(self, data: bytes, name: str, mime_type: str):
-            super().__init__(data)
-            self.name = name
-            self.type = mime_type
+    def _raw_upload() -> RawUpload:
+        # Mapeado só pelas etapas que precisam do arquivo (re-execuções a partir do texto não o abrem).
+        upload = RawUpload(raw_uri, doc["original_name"], doc["mime"])
+        uploads.append(upload)
+        return upload
 
     ext = os.path.splitext(str(doc["original_name"]).lower())[1]
+    rss_start_mb = _current_rss_mb()
+    peak_is_per_stage = _reset_peak_rss()
+    aborted = False
 
     try:
-        update_document_metrics(document_id, {"started_at": _now_iso(), "worker_id": os.getenv("WORKER_ID", "worker")})
+        _guard()
+        worker_id = os.getenv("WORKER_ID", "worker")
+        if STAGE_TEXT_EXTRACTION in stages:
+            update_document_metrics(document_id, {"started_at": _now_iso(), "worker_id": worker_id})
+        else:
+            update_document_metrics(document_id, {"extraction_started_at": _now_iso(), "extraction_worker_id": worker_id})
         doc = _load_doc()
 
         # STEP 1: TEXT_EXTRACTION
-        if doc["status"] in [STATUS_STORED, STATUS_PROCESSING_TEXT, STATUS_ERROR_PROCESSING]:
-            _update_document_fields(document_id, status=STATUS_PROCESSING_TEXT, failed_stage=None, error_message=None)
+        pre_text = [STATUS_STORED, STATUS_PROCESSING_TEXT, STATUS_ERROR_PROCESSING]
+        if doc["status"] in pre_text and STAGE_TEXT_EXTRACTION not in stages:
+            return False, f"Etapa {STAGE_TEXT_EXTRACTION} pendente (status {doc['status']})."
+        if doc["status"] in pre_text:
+            _guard()
+            _update_document_fields(document_id, lease_token=lease_token, status=STATUS_PROCESSING_TEXT, failed_stage=None, error_message=None)
 
             text_uri = doc["text_uri"]
             if not text_uri or not os.path.exists(text_uri):
                 if ext in [".csv", ".xlsx"]:
-                    upload = _UploadWrap(raw_bytes, doc["original_name"], doc["mime"])
-                    df_plan, err = processar_planilha(upload)
+                    upload = _raw_upload()
+                    df_plan, err = processar_planilha(upload, get_spreadsheet_layout, save_spreadsheet_layout)
                     if err:
                         raise RuntimeError(err)
+                    _guard()
+                    _save_table_artifact(document_id, doc["sha256"], df_plan)
                     text_content = df_plan.to_csv(index=False)
                     text_uri = os.path.join("data", "artifacts", doc["sha256"], "ocr", "text.txt")
                     _write_bytes(text_uri, text_content.encode("utf-8"))
                 elif ext == ".pdf":
-                    upload = _UploadWrap(raw_bytes, doc["original_name"], doc["mime"])
+                    upload = _raw_upload()
                     text_pdf, is_scanned, err_pdf = extrair_texto_pdf(upload)
                     if err_pdf:
                         raise RuntimeError(err_pdf)
@@ -1308,8 +3252,10 @@ def run_pipeline_for_document(document_id: str) -> Tuple[bool, str]:
                         if err_img:
                             raise RuntimeError(err_img)
                         chunks = []
+                        _guard()
                         update_document_metrics(document_id, {"ocr_pages_total": len(imgs)})
                         for idx, img_buffer in enumerate(imgs, start=1):
+                            _guard()
                             img_bytes = img_buffer.getvalue()
                             _save_artifact(document_id, doc["sha256"], "pdf_page_image", f"pdf_pages/page-{idx:03d}.png", img_bytes, meta={"page": idx})
                             img_buffer.seek(0)
@@ -1323,12 +3269,13 @@ def run_pipeline_for_document(document_id: str) -> Tuple[bool, str]:
                     text_uri = os.path.join("data", "artifacts", doc["sha256"], "ocr", "text.txt")
                     _write_bytes(text_uri, text_content.encode("utf-8"))
                 else:
-                    upload = _UploadWrap(raw_bytes, doc["original_name"], doc["mime"])
+                    upload = _raw_upload()
                     update_document_metrics(document_id, {"ocr_pages_total": 1})
                     txt, _, ocr_err = extrair_texto_imagem(upload)
                     if ocr_err:
                         raise RuntimeError(ocr_err)
                     text_content = txt
+                    _guard()
                     if txt:
                         update_document_metrics(document_id, {"ocr_pages_processed": 1}, increment=True)
                     else:
@@ -1337,24 +3284,35 @@ def run_pipeline_for_document(document_id: str) -> Tuple[bool, str]:
                     _write_bytes(text_uri, text_content.encode("utf-8"))
 
                 text_hash = compute_text_hash(text_content)
+                _guard()
                 _update_document_fields(document_id, text_uri=text_uri, text_hash=text_hash)
                 save_content_cache(text_hash, "text", text_uri)
 
-            _update_document_fields(document_id, status=STATUS_TEXT_EXTRACTED)
+            _guard()
+            _update_document_fields(document_id, lease_token=lease_token, status=STATUS_TEXT_EXTRACTED)
+            update_document_metrics(document_id, {"text_extracted_at": _now_iso()})
             doc = _load_doc()
 
+        if STAGE_STRUCTURED_EXTRACTION not in stages:
+            return True, f"Etapa {STAGE_TEXT_EXTRACTION} concluída ({doc['status']})."
+
         # STEP 2: STRUCTURED_EXTRACTION
         if doc["status"] in [STATUS_TEXT_EXTRACTED, STATUS_PROCESSING_EXTRACTION]:
-            _update_document_fields(document_id, status=STATUS_PROCESSING_EXTRACTION, failed_stage=None, error_message=None)
+            _guard()
+            _update_document_fields(document_id, lease_token=lease_token, status=STATUS_PROCESSING_EXTRACTION, failed_stage=None, error_message=None)
 
             extraction_uri = doc["extraction_uri"]
             if not extraction_uri or not os.path.exists(extraction_uri):
                 llm_model = None
+                provisional = False
                 if ext in [".csv", ".xlsx"]:
-                    upload = _UploadWrap(raw_bytes, doc["original_name"], doc["mime"])
-                    df_plan, err = processar_planilha(upload)
-                    if err:
-                        raise RuntimeError(err)
+                    df_plan = _load_table_artifact(doc["sha256"])
+                    if df_plan is None:
+                        # Texto extraído antes do artefato colunar existir: normaliza uma vez e guarda.
+                        df_plan, err = processar_planilha(_raw_upload(), get_spreadsheet_layout, save_spreadsheet_layout)
+                        if err:
+                            raise RuntimeError(err)
+                        _save_table_artifact(document_id, doc["sha256"], df_plan)
                     result = extract_transactions(df=df_plan)
                 else:
                     text_uri = doc["text_uri"]
@@ -1363,11 +3321,15 @@ def run_pipeline_for_document(document_id: str) -> Tuple[bool, str]:
                     with open(text_uri, "r", encoding="utf-8") as handler:
                         text_content = handler.read()
 
-                    regex_result = extract_transactions(text=text_content)
+                    if defer_llm:
+                        regex_result = extract_transactions(text=text_content, allow_llm=False)
+                    else:
+                        regex_result = extract_transactions(text=text_content)
+                    _guard()
                     if regex_result.method == "llm":
                         update_document_metrics(document_id, {"llm_calls": 1}, increment=True)
                         update_document_metrics(document_id, {"llm_tokens_est": int(len(text_content) / 4) if text_content else 0}, increment=True)
-                    if regex_result.method == "llm" and regex_result.reason and doc["text_hash"]:
+                    if (regex_result.method == "llm" or defer_llm) and regex_result.reason and doc["text_hash"]:
                         cached = _get_llm_cached_payload(doc["text_hash"])
                         if cached:
                             cached_payload, _, cached_model = cached
@@ -1385,7 +3347,28 @@ def run_pipeline_for_document(document_id: str) -> Tuple[bool, str]:
                     else:
                         result = regex_result
 
-                payload = result.payload
+                    provisional = defer_llm and result.method != "llm" and bool(regex_result.reason)
+                    doc_type = getattr(regex_result, "doc_type", None) or "unknown"
+                    update_document_metrics(
+                        document_id,
+                        {
+                            "doc_type": doc_type,
+                            "gating_reason": regex_result.reason,
+                            "llm_requested": bool(regex_result.reason),
+                            "extraction_method": result.method,
+                            "llm_refinement": "PENDING" if provisional else None,
+                        },
+                    )
+                    logger.info(
+                        "[PIPELINE] Gating doc=%s tipo=%s motivo=%s método=%s",
+                        document_id,
+                        doc_type,
+                        regex_result.reason or "-",
+                        result.method,
+                    )
+
+                _guard()
+                payload = apply_local_categories(result.payload, document_id=document_id)
                 payload_hash = compute_payload_hash(payload)
                 extraction_uri = os.path.join("data", "artifacts", doc["sha256"], "extraction", "candidate.json")
                 checks_uri = os.path.join("data", "artifacts", doc["sha256"], "extraction", "llm_checks.json")
@@ -1407,15 +3390,18 @@ def run_pipeline_for_document(document_id: str) -> Tuple[bool, str]:
                     metrics=result.metrics,
                     text_hash=doc["text_hash"],
                     llm_model=llm_model,
+                    status=EXTRACTION_PROVISIONAL if provisional else EXTRACTION_PENDING,
                 )
 
-            _update_document_fields(document_id, status=STATUS_STRUCTURED_EXTRACTED)
+            _guard()
+            _update_document_fields(document_id, lease_token=lease_token, status=STATUS_STRUCTURED_EXTRACTED)
             doc = _load_doc()
 
         # STEP 3: REVIEW READY
         if doc["status"] == STATUS_STRUCTURED_EXTRACTED:
-            _update_document_fields(document_id, status=STATUS_HITL_REVIEW)
-            update_document_metrics(document_id, {"finished_at": _now_iso()})
+            _guard()
+            _update_document_fields(document_id, lease_token=lease_token, status=STATUS_HITL_REVIEW)
+            update_document_metrics(document_id, {"finished_at": _now_iso(), "first_reviewable_at": _now_iso()})
             return True, "Pipeline concluída e enviado para HITL_REVIEW."
 
         if doc["status"] == STATUS_HITL_REVIEW:
@@ -1424,22 +3410,223 @@ def run_pipeline_for_document(document_id: str) -> Tuple[bool, str]:
 
         return False, f"Status não suportado para processamento: {doc['status']}"
 
+    except LeaseLostError as exc:
+        aborted = True
+        logger.warning("[PIPELINE] %s", exc)
+        return False, str(exc)
     except Exception as exc:
         current = _load_doc()
         failed_stage = "UNKNOWN"
         if current:
             if current["status"] in [STATUS_STORED, STATUS_PROCESSING_TEXT, STATUS_TEXT_EXTRACTED]:
-                failed_stage = "TEXT_EXTRACTION"
+                failed_stage = STAGE_TEXT_EXTRACTION
             elif current["status"] in [STATUS_PROCESSING_EXTRACTION, STATUS_STRUCTURED_EXTRACTED]:
-                failed_stage = "STRUCTURED_EXTRACTION"
-        mark_stage_error(document_id, failed_stage, str(exc))
+                failed_stage = STAGE_STRUCTURED_EXTRACTION
+        try:
+            mark_stage_error(document_id, failed_stage, str(exc), lease_token=lease_token)
+        except LeaseLostError as lost_exc:
+            aborted = True
+            logger.warning("[PIPELINE] %s", lost_exc)
+            return False, str(lost_exc)
         update_document_metrics(document_id, {"finished_at": _now_iso()})
         logger.exception("[PIPELINE] Falha no processamento checkpointado do documento %s.", document_id)
         return False, str(exc)
+    finally:
+        for upload in uploads:
+            upload.close()
+        if not aborted:
+            prefix = "text" if STAGE_TEXT_EXTRACTION in stages else "extraction"
+            # Sem como zerar o pico, o valor é do processo inteiro e fica em outra chave, fora das médias por documento.
+            peak_key = f"{prefix}_rss_peak_mb" if peak_is_per_stage else f"{prefix}_process_rss_peak_mb"
+            peak_mb = _peak_rss_mb() if peak_is_per_stage else _process_peak_rss_mb()
+            update_document_metrics(document_id, {f"{prefix}_rss_start_mb": rss_start_mb, peak_key: peak_mb})
+
+
+def _store_extracted_text(document_id: str, doc_sha: str, text_content: str) -> str:
+    text_uri = os.path.join("data", "artifacts", doc_sha, "ocr", "text.txt")
+    _write_bytes(text_uri, text_content.encode("utf-8"))
+    text_hash = compute_text_hash(text_content)
+    _update_document_fields(document_id, text_uri=text_uri, text_hash=text_hash)
+    save_content_cache(text_hash, "text", text_uri)
+    return text_uri
+
+
+def prepare_ocr_fanout(document_id: str, min_pages: Optional[int] = None) -> List[int]:
+    """
+    Prepara o OCR por página de um PDF escaneado: renderiza as páginas como artefatos e
+    registra cada uma em `ocr_pages`. Retorna as páginas ainda não processadas; lista vazia
+    quando o documento não se qualifica (segue pelo OCR sequencial da pipeline).
+    """
+    min_pages = OCR_FANOUT_MIN_PAGES if min_pages is None else int(min_pages)
+    if min_pages <= 0:
+        return []
+
+    doc = get_ingest_document(document_id)
+    if not doc or doc["status"] not in [STATUS_STORED, STATUS_PROCESSING_TEXT, STATUS_ERROR_PROCESSING]:
+        return []
+    if doc["text_uri"] and os.path.exists(doc["text_uri"]):
+        return []
+    if os.path.splitext(str(doc["original_name"]).lower())[1] != ".pdf":
+        return []
+
+    with get_conn(INGEST_DB_NAME) as conn:
+        existing = conn.execute(
+            "SELECT page, status FROM ocr_pages WHERE document_id = ? ORDER BY page",
+            (document_id,),
+        ).fetchall()
+    if existing:
+        pending = [int(row[0]) for row in existing if row[1] != OCR_PAGE_DONE]
+        if pending:
+            _update_document_fields(document_id, status=STATUS_PROCESSING_TEXT, failed_stage=None, error_message=None)
+        return pending
+
+    metrics = _parse_metrics_json(doc["metrics_json"])
+    # Raw mapeado (sem cópia): fitz recebe o buffer e o pdfplumber lê o próprio upload.
+    upload = RawUpload(doc["storage_uri_raw"], doc["original_name"], doc["mime"])
+    try:
+        pages, scanned = metrics.get("est_pages"), metrics.get("est_scanned")
+        if pages is None or scanned is None:
+            pages, scanned, _ = inspecionar_pdf(upload.getbuffer())
+        if not scanned or not pages or int(pages) < min_pages:
+            return []
+
+        # Mesmo critério da etapa sequencial: só PDFs que a pipeline trataria como escaneados.
+        _, is_scanned, err_pdf = extrair_texto_pdf(upload)
+        if err_pdf or not is_scanned:
+            return []
+
+        imgs, err_img = converter_pdf_para_imagens(upload)
+        if err_img:
+            raise RuntimeError(err_img)
+    finally:
+        upload.close()
+
+    rows = []
+    for idx, img_buffer in enumerate(imgs, start=1):
+        image_uri = _save_artifact(
+            document_id, doc["sha256"], "pdf_page_image", f"pdf_pages/page-{idx:03d}.png", img_buffer.getvalue(), meta={"page": idx}
+        )
+        rows.append((document_id, idx, image_uri, OCR_PAGE_PENDING, _now_iso()))
+
+    with get_conn(INGEST_DB_NAME) as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO ocr_pages (document_id, page, image_uri, status, updated_at) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+    _update_document_fields(document_id, status=STATUS_PROCESSING_TEXT, failed_stage=None, error_message=None)
+    update_document_metrics(document_id, {"ocr_fanout": True, "ocr_pages_total": len(rows), "ocr_pages_done": 0})
+    logger.info("[PIPELINE] OCR em paralelo doc=%s páginas=%s", document_id, len(rows))
+    return [row[1] for row in rows]
+
+
+def get_ocr_pages_progress(document_id: str) -> Dict[str, int]:
+    with get_conn(INGEST_DB_NAME) as conn:
+        rows = conn.execute(
+            "SELECT status, COUNT(1) FROM ocr_pages WHERE document_id = ? GROUP BY status",
+            (document_id,),
+        ).fetchall()
+    counts = {row[0]: int(row[1]) for row in rows}
+    return {
+        "total": sum(counts.values()),
+        "done": counts.get(OCR_PAGE_DONE, 0),
+        "failed": counts.get(OCR_PAGE_FAILED, 0),
+        "pending": counts.get(OCR_PAGE_PENDING, 0),
+    }
+
+
+def _set_ocr_page_status(document_id: str, page: int, status: str, **fields: Any) -> None:
+    def _op():
+        with get_conn(INGEST_DB_NAME) as conn:
+            apply_sqlite_pragmas(conn)
+
+            def _write(c):
+                payload = {"status": status, "updated_at": _now_iso(), **fields}
+                assignments = ", ".join([f"{k} = ?" for k in payload.keys()])
+                c.execute(
+                    f"UPDATE ocr_pages SET {assignments}, attempts = attempts + 1 WHERE document_id = ? AND page = ?",
+                    (*payload.values(), document_id, int(page)),
+                )
+
+            with_tx(conn, _write)
+
+    retry_on_lock(_op)
+
+
+def ocr_pdf_page(document_id: str, page: int) -> Tuple[bool, str]:
+    """OCR de uma página do fan-out. Exceções sobem para o job ser reexecutado (retry do RQ)."""
+    with get_conn(INGEST_DB_NAME) as conn:
+        row = conn.execute(
+            "SELECT p.image_uri, p.status, d.sha256 FROM ocr_pages p JOIN documents d ON d.id = p.document_id WHERE p.document_id = ? AND p.page = ?",
+            (document_id, int(page)),
+        ).fetchone()
+    if not row:
+        return False, f"Página {page} não registrada para OCR."
+    image_uri, status, doc_sha = row
+    if status == OCR_PAGE_DONE:
+        return True, f"Página {page} já processada."
+
+    try:
+        with open(image_uri, "rb") as handler:
+            txt, _, ocr_err = extrair_texto_imagem(io.BytesIO(handler.read()))
+        if ocr_err:
+            raise RuntimeError(ocr_err)
+    except Exception as exc:
+        _set_ocr_page_status(document_id, page, OCR_PAGE_FAILED, error=str(exc))
+        update_document_metrics(document_id, {"ocr_pages_failed": get_ocr_pages_progress(document_id)["failed"]})
+        raise
+
+    text_uri = os.path.join("data", "artifacts", doc_sha, "ocr", "pages", f"page-{int(page):03d}.txt")
+    _write_bytes(text_uri, (txt or "").encode("utf-8"))
+    _set_ocr_page_status(document_id, page, OCR_PAGE_DONE, text_uri=text_uri, chars=len(txt or ""), error=None)
+
+    progress = get_ocr_pages_progress(document_id)
+    update_document_metrics(document_id, {"ocr_pages_done": progress["done"], "ocr_pages_failed": progress["failed"]})
+    update_document_metrics(document_id, {"ocr_pages_processed" if txt else "ocr_pages_skipped": 1}, increment=True)
+    return True, f"Página {page}: {progress['done']}/{progress['total']} concluídas."
+
+
+def join_ocr_pages(document_id: str, lease_token: Optional[str] = None) -> Tuple[bool, str]:
+    """
+    Junta o texto das páginas em ordem, grava `text_uri` e avança para TEXT_EXTRACTED.
+    Com `lease_token`, as gravações de status conferem o lease (ver `_update_document_fields`).
+    """
+    doc = get_ingest_document(document_id)
+    if not doc:
+        return False, "Documento não encontrado na ingestão."
+    if doc["status"] not in [STATUS_PROCESSING_TEXT, STATUS_ERROR_PROCESSING]:
+        return True, f"Documento já está em {doc['status']}."
+
+    progress = get_ocr_pages_progress(document_id)
+    if not progress["total"]:
+        return False, "Sem páginas de OCR registradas."
+    if progress["done"] < progress["total"]:
+        message = f"OCR incompleto: {progress['done']}/{progress['total']} páginas ({progress['failed']} com falha)."
+        mark_stage_error(document_id, STAGE_TEXT_EXTRACTION, message, lease_token=lease_token)
+        return False, message
+
+    with get_conn(INGEST_DB_NAME) as conn:
+        rows = conn.execute(
+            "SELECT text_uri FROM ocr_pages WHERE document_id = ? ORDER BY page",
+            (document_id,),
+        ).fetchall()
+    chunks = []
+    for (page_uri,) in rows:
+        with open(page_uri, "r", encoding="utf-8") as handler:
+            txt = handler.read()
+        if txt:
+            chunks.append(txt)
+
+    _store_extracted_text(document_id, doc["sha256"], "\n".join(chunks))
+    _update_document_fields(document_id, lease_token=lease_token, status=STATUS_TEXT_EXTRACTED)
+    update_document_metrics(document_id, {"text_extracted_at": _now_iso()})
+    return True, f"OCR por página concluído ({progress['total']} páginas)."
 
 
 def process_stored_documents(limit: int = 20) -> Dict[str, int]:
-    docs = list_ingest_documents([STATUS_STORED, STATUS_PROCESSING_TEXT, STATUS_TEXT_EXTRACTED, STATUS_PROCESSING_EXTRACTION, STATUS_STRUCTURED_EXTRACTED, STATUS_ERROR_PROCESSING])[: max(1, int(limit))]
+    docs = list_ingest_documents(
+        [STATUS_STORED, STATUS_PROCESSING_TEXT, STATUS_TEXT_EXTRACTED, STATUS_PROCESSING_EXTRACTION, STATUS_STRUCTURED_EXTRACTED, STATUS_ERROR_PROCESSING],
+        order="sjf",
+    )[: max(1, int(limit))]
     processed = 0
     failed = 0
     for doc in docs:
@@ -1451,6 +3638,114 @@ def process_stored_documents(limit: int = 20) -> Dict[str, int]:
     return {"processed": processed, "failed": failed, "found": len(docs)}
 
 
+def needs_llm_refinement(document_id: str) -> bool:
+    return _load_document_metrics(document_id).get("llm_refinement") == "PENDING"
+
+
+def refine_extraction_with_llm(document_id: str) -> Tuple[bool, str]:
+    """
+    Segunda fase da extração: roda o LLM sobre o texto já extraído e publica o
+    resultado como nova versão em `extractions`, substituindo a provisória.
+    """
+    init_ingest_db()
+
+    def _load_doc() -> Optional[sqlite3.Row]:
+        with get_conn(INGEST_DB_NAME) as conn:
+            return conn.execute(
+                "SELECT id, sha256, status, text_uri, text_hash FROM documents WHERE id = ?",
+                (document_id,),
+            ).fetchone()
+
+    doc = _load_doc()
+    if not doc:
+        return False, "Documento não encontrado na ingestão."
+    if not needs_llm_refinement(document_id):
+        return True, "Sem refinamento LLM pendente."
+    if doc["status"] != STATUS_HITL_REVIEW:
+        # Revisão já submetida: não sobrescreve o trabalho do revisor.
+        update_document_metrics(document_id, {"llm_refinement": "SKIPPED"})
+        return True, f"Refinamento ignorado: documento em {doc['status']}."
+
+    text_uri = doc["text_uri"]
+    if not text_uri or not os.path.exists(text_uri):
+        update_document_metrics(document_id, {"llm_refinement": "FAILED", "llm_refinement_error": "text_uri ausente"})
+        return False, "text_uri ausente para refinamento LLM."
+    with open(text_uri, "r", encoding="utf-8") as handler:
+        text_content = handler.read()
+
+    llm_model = None
+    cached = _get_llm_cached_payload(doc["text_hash"]) if doc["text_hash"] else None
+    if cached:
+        llm_payload, _, llm_model = cached
+        update_document_metrics(document_id, {"llm_cache_hits": 1}, increment=True)
+    else:
+        llm_payload, llm_err = extrair_dados_financeiros_llm(text_content)
+        flush_llm_http_stats()
+        update_document_metrics(
+            document_id,
+            {"llm_calls": 1, "llm_tokens_est": int(len(text_content) / 4) if text_content else 0},
+            increment=True,
+        )
+        if not llm_payload:
+            message = llm_err or "LLM não retornou transações."
+            update_document_metrics(document_id, {"llm_refinement": "FAILED", "llm_refinement_error": message})
+            logger.warning("[PIPELINE] Refinamento LLM falhou doc=%s: %s", document_id, message)
+            return False, message
+
+    payload = apply_local_categories(llm_payload, document_id=document_id)
+    metrics = _compute_extraction_metrics(payload)
+    payload_hash = compute_payload_hash(payload)
+    extraction_uri = os.path.join("data", "artifacts", doc["sha256"], "extraction", "candidate_llm.json")
+    checks_uri = os.path.join("data", "artifacts", doc["sha256"], "extraction", "llm_checks_llm.json")
+    checks = _run_llm_checks(payload)
+    _write_json(extraction_uri, payload)
+    _write_json(checks_uri, checks)
+
+    doc = _load_doc()
+    if doc["status"] != STATUS_HITL_REVIEW:
+        update_document_metrics(document_id, {"llm_refinement": "SKIPPED"})
+        return True, f"Refinamento descartado: documento em {doc['status']}."
+
+    _update_document_fields(document_id, extraction_uri=extraction_uri, payload_hash=payload_hash)
+    save_content_cache(payload_hash, "payload", extraction_uri)
+    if doc["text_hash"] and not cached:
+        _save_llm_cache(doc["text_hash"], extraction_uri, "default")
+
+    version = _record_extraction(
+        document_id,
+        "llm",
+        extraction_uri,
+        metrics.confidence,
+        checks_uri,
+        metrics=metrics,
+        text_hash=doc["text_hash"],
+        llm_model=llm_model,
+    )
+    update_document_metrics(
+        document_id,
+        {"llm_refinement": "DONE", "llm_refined_at": _now_iso(), "extraction_method": "llm"},
+    )
+    logger.info("[PIPELINE] Refinamento LLM doc=%s versão=%s itens=%s", document_id, version, len(payload))
+    return True, f"Extração refinada pelo LLM (versão {version})."
+
+
+def get_extraction_history(document_id: str) -> List[Dict[str, Any]]:
+    with get_conn(INGEST_DB_NAME) as conn:
+        rows = conn.execute(
+            """
+            SELECT version, extractor, status, confidence, created_at
+            FROM extractions
+            WHERE document_id = ?
+            ORDER BY version DESC, id DESC
+            """,
+            (document_id,),
+        ).fetchall()
+    return [
+        {"version": r[0], "extractor": r[1], "status": r[2], "confidence": float(r[3] or 0.0), "created_at": r[4]}
+        for r in rows
+    ]
+
+
 def get_latest_extraction_payload(document_id: str) -> Optional[Tuple[str, List[Dict[str, Any]], Dict[str, Any], str, float, Dict[str, Any]]]:
     with get_conn(INGEST_DB_NAME) as conn:
         row = conn.execute(
@@ -1501,6 +3796,7 @@ def submit_hitl_review(document_id: str, reviewer: str, decision: str, edited_pa
         )
 
     if decision in ["APPROVED", "CHANGES"]:
+        learn_merchant_categories(edited_payload, source=f"review:{document_id}")
         _update_ingest_status(document_id, STATUS_FINALIZE_PENDING)
     else:
         _update_ingest_status(document_id, STATUS_HITL_REVIEW)
@@ -1544,21 +3840,6 @@ def finalize_document(document_id: str) -> Tuple[bool, str]:
         _update_ingest_status(document_id, STATUS_FINALIZED)
         return True, f"Finalização pulada: payload idêntico ao documento {existing_payload['id']}."
 
-    resumo_tokens = [
-        "total",
-        "valor pago",
-        "valor a pagar",
-        "forma pagamento",
-        "pagamento",
-        "desconto",
-    ]
-
-    def _is_summary_line(descricao: str) -> bool:
-        desc = (descricao or "").strip().lower()
-        if not desc:
-            return False
-        return any(token in desc for token in resumo_tokens)
-
     rows = []
     summary_candidates = []
     for item in payload:
@@ -1582,7 +3863,7 @@ def finalize_document(document_id: str) -> Tuple[bool, str]:
                 "descricao": desc,
                 "valor": valor,
                 "fonte": doc[1],
-                "categoria": str(item.get("categoria") or "Outros"),
+                "categoria": str(item.get("categoria") or DEFAULT_CATEGORY),
                 "tipo": tipo,
                 "document_id": document_id,
             }
@@ -1673,3 +3954,17 @@ def finalize_pending_documents(limit: int = 20) -> Dict[str, int]:
         else:
             failed += 1
     return {"finalized": finalized, "failed": failed, "found": len(docs)}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manutenção das tabelas derivadas do banco local.")
+    parser.add_argument("comando", choices=["rebuild-rollup", "rebuild-installments"])
+    args = parser.parse_args()
+
+    init_db()
+    if args.comando == "rebuild-rollup":
+        print(f"monthly_rollup: {rebuild_monthly_rollup()} grupo(s).")
+    else:
+        print(f"installment_schedule: {rebuild_installment_schedule()} parcela(s).")
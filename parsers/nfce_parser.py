@@ -0,0 +1,243 @@
+"""Parser determinístico para NFC-e / cupom fiscal (DANFE NFC-e em texto OCR/PDF)."""
+from __future__ import annotations
+
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+RECEIPT_MARKERS = [
+    "documento aux. da nota fiscal",
+    "nota fiscal de consumidor eletr",
+    "qtd total de itens",
+    "valor liquido",
+    "nfc-e",
+    "cupom fiscal",
+]
+
+TOTAL_TOLERANCE = 0.01
+
+_MONEY = r"(?:r\$\s*)?(\d{1,3}(?:\.\d{3})*,\d{2}|\d+[\.,]\d{2})"
+_QTY = r"(\d+(?:[\.,]\d{1,3})?)"
+_UNIT = r"(un|und|kg|g|lt|l|ml|pc|pct|cx|fd|m|m2|dz)"
+
+_DATE_PATTERN = re.compile(r"\b(\d{1,2})[/-](\d{1,2})[/-](\d{2,4})\b")
+# "1000022036 CONDRES AH C/30 CAPS 157,740MG   R$ 234,90"
+_ITEM_HEADER_PATTERN = re.compile(rf"^(?:\d{{1,3}}\s+)?(\d{{6,14}})\s+(.+?)(?:\s+{_MONEY})?$", re.IGNORECASE)
+# "001 7891234567890 ARROZ TIPO 1 5KG 2 UN X 25,90 51,80"
+_ITEM_INLINE_PATTERN = re.compile(
+    rf"^(?:\d{{1,3}}\s+)?(\d{{6,14}})\s+(.+?)\s+{_QTY}\s*{_UNIT}\.?\s*(?:x\s*)?{_MONEY}\s+{_MONEY}$",
+    re.IGNORECASE,
+)
+# "1 UN De R$ 234,90 por R$ 223,15" / "2 UN x 25,90"
+_QTY_LINE_PATTERN = re.compile(
+    rf"^{_QTY}\s*{_UNIT}\.?\s*(?:de|x)?\s*{_MONEY}(?:\s+(?:por|=)?\s*{_MONEY})?$",
+    re.IGNORECASE,
+)
+_NET_LINE_PATTERN = re.compile(rf"^valor liquido\s*:?\s*{_MONEY}$", re.IGNORECASE)
+_PAYABLE_PATTERN = re.compile(rf"^valor (?:a )?pagar\s*(?:r\$)?\s*:?\s*{_MONEY}$", re.IGNORECASE)
+_TOTAL_PATTERN = re.compile(rf"^(?:valor )?total(?: r\$)?\s*:?\s*{_MONEY}$", re.IGNORECASE)
+_DISCOUNT_PATTERN = re.compile(rf"^descontos?\s*(?:r\$)?\s*:?\s*-?\s*{_MONEY}$", re.IGNORECASE)
+
+_BLOCKED_TOKENS = ("total", "desconto", "valor pagar", "valor a pagar", "valor pago", "cartao", "nfc-e", "serie", "troco")
+
+
+@dataclass
+class NFCeItem:
+    codigo: str
+    descricao: str
+    quantidade: Optional[float]
+    unidade: Optional[str]
+    valor_unitario: Optional[float]
+    valor_total: float
+
+
+@dataclass
+class NFCeResult:
+    data: Optional[str]
+    itens: List[NFCeItem] = field(default_factory=list)
+    total_declarado: Optional[float] = None
+    descontos: float = 0.0
+
+    @property
+    def soma_itens(self) -> float:
+        return round(sum(item.valor_total for item in self.itens), 2)
+
+    @property
+    def desconto_pendente(self) -> float:
+        """Desconto do rodapé ainda fora dos itens: só conta quando é ele que fecha o total declarado."""
+        if not self.descontos or self.total_declarado is None:
+            return 0.0
+        if abs(self.soma_itens - self.total_declarado) <= TOTAL_TOLERANCE:
+            return 0.0
+        if abs(round(self.soma_itens - self.descontos, 2) - self.total_declarado) <= TOTAL_TOLERANCE:
+            return self.descontos
+        return 0.0
+
+    @property
+    def reconciled(self) -> bool:
+        """Soma dos itens, já com o desconto do rodapé rateado, bate com o total declarado."""
+        if not self.itens or self.total_declarado is None:
+            return False
+        return abs(round(self.soma_itens - self.desconto_pendente, 2) - self.total_declarado) <= TOTAL_TOLERANCE
+
+    def _valores_liquidos(self) -> List[float]:
+        valores = [round(item.valor_total, 2) for item in self.itens]
+        desconto = self.desconto_pendente
+        if not desconto or not self.soma_itens:
+            return valores
+        # Rateio proporcional ao valor de cada item; a sobra do arredondamento fica no maior item.
+        rateio = [round(valor * desconto / self.soma_itens, 2) for valor in valores]
+        maior = valores.index(max(valores))
+        rateio[maior] = round(rateio[maior] + desconto - sum(rateio), 2)
+        return [round(valor - parte, 2) for valor, parte in zip(valores, rateio)]
+
+    def to_transactions(self) -> List[Dict]:
+        return [
+            {
+                "data": self.data,
+                "valor": valor,
+                "descricao": item.descricao,
+                "tipo": "saida",
+                "document_type": "Saída",
+            }
+            for item, valor in zip(self.itens, self._valores_liquidos())
+        ]
+
+
+def _fold(text: str) -> str:
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii").lower()
+
+
+def _money(raw: Optional[str]) -> Optional[float]:
+    if not raw:
+        return None
+    value = raw.strip()
+    if "," in value:
+        value = value.replace(".", "").replace(",", ".")
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _qty(raw: Optional[str]) -> Optional[float]:
+    if not raw:
+        return None
+    try:
+        return float(raw.replace(",", "."))
+    except ValueError:
+        return None
+
+
+def _parse_date(texto: str) -> Optional[str]:
+    match = _DATE_PATTERN.search(texto)
+    if not match:
+        return None
+    day, month, year = match.groups()
+    year = f"20{year}" if len(year) == 2 else year
+    if not (1 <= int(day) <= 31 and 1 <= int(month) <= 12):
+        return None
+    return f"{year.zfill(4)}-{month.zfill(2)}-{day.zfill(2)}"
+
+
+def is_nfce(texto_bruto: str) -> bool:
+    texto = _fold(texto_bruto or "")
+    return any(marker in texto for marker in RECEIPT_MARKERS)
+
+
+def parse_nfce(texto_bruto: str) -> Optional[NFCeResult]:
+    """
+    Extrai itens (código, descrição, qtd, unidade, valor unitário/total) e o total declarado.
+    Retorna None quando o texto não parece uma NFC-e.
+    """
+    if not texto_bruto or not is_nfce(texto_bruto):
+        return None
+
+    lines = [re.sub(r"\s+", " ", line).strip() for line in texto_bruto.splitlines() if line.strip()]
+    result = NFCeResult(data=_parse_date(texto_bruto))
+    payable = None
+    total = None
+
+    idx = 0
+    while idx < len(lines):
+        line = lines[idx]
+        folded = _fold(line)
+
+        footer = _PAYABLE_PATTERN.match(folded)
+        if footer:
+            payable = _money(footer.group(1))
+            idx += 1
+            continue
+        footer = _TOTAL_PATTERN.match(folded)
+        if footer:
+            total = total if total is not None else _money(footer.group(1))
+            idx += 1
+            continue
+        footer = _DISCOUNT_PATTERN.match(folded)
+        if footer:
+            result.descontos = _money(footer.group(1)) or 0.0
+            idx += 1
+            continue
+
+        inline = _ITEM_INLINE_PATTERN.match(line)
+        if inline and not any(token in _fold(inline.group(2)) for token in _BLOCKED_TOKENS):
+            valor_total = _money(inline.group(6))
+            if valor_total:
+                result.itens.append(
+                    NFCeItem(
+                        codigo=inline.group(1),
+                        descricao=inline.group(2).strip(" -:"),
+                        quantidade=_qty(inline.group(3)),
+                        unidade=inline.group(4).upper(),
+                        valor_unitario=_money(inline.group(5)),
+                        valor_total=valor_total,
+                    )
+                )
+            idx += 1
+            continue
+
+        header = _ITEM_HEADER_PATTERN.match(line)
+        descricao = (header.group(2) if header else "").strip(" -:")
+        if not header or not descricao or any(token in _fold(descricao) for token in _BLOCKED_TOKENS):
+            idx += 1
+            continue
+
+        item = NFCeItem(
+            codigo=header.group(1),
+            descricao=descricao,
+            quantidade=None,
+            unidade=None,
+            valor_unitario=None,
+            valor_total=_money(header.group(3)) or 0.0,
+        )
+
+        # Linhas de detalhe até o próximo item: "1 UN De R$ x por R$ y" e "Valor Liquido R$ y".
+        lookahead = idx + 1
+        while lookahead < len(lines) and lookahead <= idx + 4:
+            probe = lines[lookahead]
+            if _ITEM_HEADER_PATTERN.match(probe):
+                break
+            probe_folded = _fold(probe)
+            qty_line = _QTY_LINE_PATTERN.match(probe_folded)
+            net_line = _NET_LINE_PATTERN.match(probe_folded)
+            if qty_line:
+                item.quantidade = _qty(qty_line.group(1))
+                item.unidade = qty_line.group(2).upper()
+                item.valor_unitario = _money(qty_line.group(3))
+                if qty_line.group(4):
+                    item.valor_total = _money(qty_line.group(4)) or item.valor_total
+                elif not item.valor_total and item.quantidade and item.valor_unitario:
+                    item.valor_total = round(item.quantidade * item.valor_unitario, 2)
+            elif net_line:
+                item.valor_total = _money(net_line.group(1)) or item.valor_total
+            else:
+                break
+            lookahead += 1
+
+        if item.valor_total > 0:
+            result.itens.append(item)
+        idx = lookahead
+
+    result.total_declarado = payable if payable is not None else total
+    return result
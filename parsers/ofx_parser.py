@@ -1,10 +1,32 @@
+"""Parser de extratos OFX 1.x (SGML) e 2.x (XML) em passada única, com as linhas entregues incrementalmente."""
 from __future__ import annotations
 
+import codecs
 import hashlib
+import io
 import re
 from dataclasses import dataclass
-from datetime import datetime
-from typing import List, Optional
+from datetime import date
+from functools import lru_cache
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Union
+
+OFX_CHUNK_SIZE = 1024 * 1024
+
+# "<TAG>valor" (SGML, folhas sem fechamento) e "</TAG>"; o valor vai até o próximo "<".
+_TOKEN_PATTERN = re.compile(r"<(/?)([A-Za-z0-9_.]+)>([^<]*)")
+_LINE_BREAK_PATTERN = re.compile(r"[\r\n]")
+_SPACES_PATTERN = re.compile(r"\s+")
+_DATE_PATTERN = re.compile(r"^(\d{8})")
+_INSTALLMENT_PATTERNS = [
+    re.compile(r"\b(\d{1,2})\s*/\s*(\d{1,2})\b"),
+    re.compile(r"\bparc(?:ela)?\s*(\d{1,2})\s*/\s*(\d{1,2})\b"),
+    re.compile(r"\bparc(?:ela)?\s*(\d{1,2})\s*de\s*(\d{1,2})\b"),
+]
+# Cabeçalho OFX 1.x ("ENCODING:UTF-8") ou declaração XML do 2.x (encoding="UTF-8").
+_UTF8_HEADER_PATTERN = re.compile(rb"ENCODING\s*[:=]\s*[\"']?UTF-?8", re.IGNORECASE)
+
+_STMTTRN = "STMTTRN"
+_FIELDS = {"DTPOSTED", "TRNAMT", "MEMO", "NAME", "PAYEE"}
 
 
 @dataclass
@@ -15,6 +37,8 @@ class StatementLine:
     merchant: Optional[str] = None
     parcela_atual: Optional[int] = None
     parcela_total: Optional[int] = None
+    # Descrição usada no hash_linha quando difere de `descricao` (ver `_legacy_hash_desc`).
+    descricao_hash: Optional[str] = None
 
 
 def _sha256(text: str) -> str:
@@ -22,105 +46,174 @@ def _sha256(text: str) -> str:
 
 
 def _norm_desc(text: str) -> str:
-    normalized = re.sub(r"\s+", " ", (text or "").strip())
+    normalized = _SPACES_PATTERN.sub(" ", (text or "").strip())
     return normalized[:400]
 
 
 def _parse_ofx_date(raw: str) -> Optional[str]:
     if not raw:
         return None
-    match = re.match(r"^(\d{8})", raw.strip())
+    match = _DATE_PATTERN.match(raw.strip())
     if not match:
         return None
+    return _ofx_day(match.group(1))
+
+
+@lru_cache(maxsize=4096)
+def _ofx_day(yyyymmdd: str) -> Optional[str]:
+    # Um extrato repete poucas datas; date() só valida (sem o custo do strptime por linha).
     try:
-        return datetime.strptime(match.group(1), "%Y%m%d").strftime("%Y-%m-%d")
+        return date(int(yyyymmdd[:4]), int(yyyymmdd[4:6]), int(yyyymmdd[6:8])).isoformat()
     except ValueError:
         return None
 
 
 def _extract_installments(desc: str) -> tuple[Optional[int], Optional[int]]:
     value = (desc or "").lower()
+    # Todos os padrões exigem "/" ou "de".
+    if "/" not in value and "de" not in value:
+        return None, None
 
-    for pattern in [
-        r"\b(\d{1,2})\s*/\s*(\d{1,2})\b",
-        r"\bparc(?:ela)?\s*(\d{1,2})\s*/\s*(\d{1,2})\b",
-        r"\bparc(?:ela)?\s*(\d{1,2})\s*de\s*(\d{1,2})\b",
-    ]:
-        match = re.search(pattern, value)
+    for pattern in _INSTALLMENT_PATTERNS:
+        match = pattern.search(value)
         if match:
             return int(match.group(1)), int(match.group(2))
 
     return None, None
 
 
-def parse_ofx_bytes(ofx_bytes: bytes) -> List[StatementLine]:
-    text = ofx_bytes.decode("latin-1", errors="ignore")
+def _strip_installments(desc: str) -> str:
+    # Padrões mais específicos primeiro, para levar junto o "parc"/"parcela".
+    value = (desc or "").lower()
+    for pattern in reversed(_INSTALLMENT_PATTERNS):
+        stripped, found = pattern.subn(" ", value, count=1)
+        if found:
+            return _norm_desc(stripped)
+    return _norm_desc(value)
 
+
+def _shift_competencia(competencia: str, months: int) -> Optional[str]:
     try:
-        import io
-
-        from ofxparse import OfxParser  # type: ignore
-
-        ofx = OfxParser.parse(io.BytesIO(ofx_bytes))
-        lines: List[StatementLine] = []
-
-        for tx in ofx.account.statement.transactions:
-            data = tx.date.strftime("%Y-%m-%d") if tx.date else None
-            descricao = _norm_desc((tx.memo or tx.payee or tx.name or "").strip()) or "Não identificado"
-            valor = float(tx.amount) if tx.amount is not None else 0.0
-            p_atual, p_total = _extract_installments(descricao)
-            merchant = _norm_desc(tx.payee or tx.name or "") or None
-
-            lines.append(
-                StatementLine(
-                    data=data,
-                    descricao=descricao,
-                    valor=valor,
-                    merchant=merchant,
-                    parcela_atual=p_atual,
-                    parcela_total=p_total,
-                )
-            )
-
-        return lines
-    except Exception:
-        pass
-
-    blocks = re.findall(r"<STMTTRN>(.*?)</STMTTRN>", text, flags=re.DOTALL | re.IGNORECASE)
-    lines: List[StatementLine] = []
-
-    def tag(block: str, name: str) -> Optional[str]:
-        match = re.search(rf"<{name}>\s*([^\r\n<]+)", block, flags=re.IGNORECASE)
-        return match.group(1).strip() if match else None
-
-    for block in blocks:
-        dtposted = tag(block, "DTPOSTED")
-        trnamt = tag(block, "TRNAMT")
-        memo = tag(block, "MEMO") or tag(block, "NAME") or tag(block, "PAYEE")
-
-        data = _parse_ofx_date(dtposted or "")
-        descricao = _norm_desc(memo or "") or "Não identificado"
-
-        try:
-            valor = float((trnamt or "0").replace(",", "."))
-        except ValueError:
-            valor = 0.0
-
-        p_atual, p_total = _extract_installments(descricao)
-        lines.append(
-            StatementLine(
-                data=data,
-                descricao=descricao,
-                valor=valor,
-                merchant=None,
-                parcela_atual=p_atual,
-                parcela_total=p_total,
-            )
-        )
-
-    return lines
+        year, month = int(competencia[:4]), int(competencia[5:7])
+    except (TypeError, ValueError):
+        return None
+    if not 1 <= month <= 12:
+        return None
+    index = year * 12 + (month - 1) + months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def build_purchase_key(conta: str, competencia: str, line: StatementLine) -> str:
+    """
+    Identidade da compra parcelada entre faturas: descrição sem o marcador "n/m", valor, total de
+    parcelas e mês da compra (competência da fatura menos as parcelas já cobradas). A data da linha
+    fica de fora porque há bancos que trocam a data da compra pela do lançamento; o mês separa
+    compras idênticas feitas em meses diferentes, cujas parcelas aparecem juntas na mesma fatura.
+    """
+    compra = _shift_competencia(competencia, -((line.parcela_atual or 1) - 1)) or ""
+    base = f"{conta}|{compra}|{_strip_installments(line.descricao)}|{line.valor:.2f}|{line.parcela_total or 0}"
+    return _sha256(base)
+
+
+def _leaf_value(raw: str) -> str:
+    # Folha SGML: o valor termina na quebra de linha (o que vem depois é só indentação).
+    value = raw.strip()
+    if "\n" in value or "\r" in value:
+        value = _LINE_BREAK_PATTERN.split(value, 1)[0].rstrip()
+    return value
+
+
+def _legacy_hash_desc(raw: str) -> str:
+    # Até a leitura em passada única todo OFX era decodificado como latin-1; o hash_linha das linhas
+    # já gravadas de arquivos UTF-8 saiu desse texto. O hash continua nele para a deduplicação de
+    # extratos sobrepostos reconhecer as linhas antigas; `descricao` fica com o texto correto.
+    return _norm_desc(raw.encode("utf-8", errors="replace").decode("latin-1")) or "Não identificado"
+
+
+def _build_line(fields: Dict[str, str], utf8: bool = False) -> StatementLine:
+    name = fields.get("NAME") or fields.get("PAYEE")
+    descricao = _norm_desc(fields.get("MEMO") or name or "") or "Não identificado"
+    descricao_hash = _legacy_hash_desc(fields.get("MEMO") or name or "") if utf8 else None
+
+    try:
+        valor = float((fields.get("TRNAMT") or "0").replace(",", "."))
+    except ValueError:
+        valor = 0.0
+
+    p_atual, p_total = _extract_installments(descricao)
+    return StatementLine(
+        data=_parse_ofx_date(fields.get("DTPOSTED") or ""),
+        descricao=descricao,
+        valor=valor,
+        merchant=_norm_desc(name or "") or None,
+        parcela_atual=p_atual,
+        parcela_total=p_total,
+        descricao_hash=descricao_hash if descricao_hash != descricao else None,
+    )
+
+
+def iter_ofx_lines(source: Union[bytes, BinaryIO], chunk_size: int = OFX_CHUNK_SIZE) -> Iterator[StatementLine]:
+    """
+    Tokeniza o OFX em blocos de `chunk_size` bytes e entrega cada `<STMTTRN>` assim que ele fecha,
+    sem carregar o documento inteiro nem montar a árvore. Sem ENCODING/encoding UTF-8 declarado,
+    decodifica como latin-1 (OFX 1.x de bancos brasileiros costuma ser CHARSET 1252).
+    """
+    stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+    first = stream.read(chunk_size)
+    encoding = "utf-8" if _UTF8_HEADER_PATTERN.search(first[:4096]) else "latin-1"
+    utf8 = encoding == "utf-8"
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+
+    current: Optional[Dict[str, str]] = None
+    pending = ""
+    chunk = first
+    while True:
+        final = not chunk
+        text = pending + decoder.decode(chunk, final=final)
+        # Um token pode estar cortado no fim do bloco: guarda a partir do último "<" para o próximo.
+        cut = len(text) if final else text.rfind("<")
+        if cut <= 0:
+            pending = text
+        else:
+            pending = text[cut:]
+            for match in _TOKEN_PATTERN.finditer(text, 0, cut):
+                closing, tag, raw = match.groups()
+                tag = tag.upper()
+                if tag == _STMTTRN:
+                    if closing:
+                        if current is not None:
+                            yield _build_line(current, utf8)
+                        current = None
+                    else:
+                        # STMTTRN aberto sem fechar o anterior: entrega o anterior.
+                        if current is not None:
+                            yield _build_line(current, utf8)
+                        current = {}
+                elif current is not None and not closing and tag in _FIELDS and tag not in current:
+                    value = _leaf_value(raw)
+                    if value:
+                        current[tag] = value
+        if final:
+            return
+        chunk = stream.read(chunk_size)
+
+
+def parse_ofx_bytes(ofx_bytes: bytes) -> List[StatementLine]:
+    return list(iter_ofx_lines(ofx_bytes))
 
 
 def build_hash_linha(competencia: str, line: StatementLine) -> str:
-    base = f"{competencia}|{line.data or ''}|{_norm_desc(line.descricao)}|{line.valor:.2f}"
+    base = f"{competencia}|{line.data or ''}|{_norm_desc(line.descricao_hash or line.descricao)}|{line.valor:.2f}"
     return _sha256(base)
+
+
+def build_hash_linhas(competencia: str, lines: Iterable[StatementLine]) -> List[str]:
+    """`build_hash_linha` em lote: o prefixo da competência é digerido uma vez e copiado por linha."""
+    prefix = hashlib.sha256(f"{competencia}|".encode("utf-8", errors="ignore"))
+    hashes = []
+    for line in lines:
+        digest = prefix.copy()
+        desc = _norm_desc(line.descricao_hash or line.descricao)
+        digest.update(f"{line.data or ''}|{desc}|{line.valor:.2f}".encode("utf-8", errors="ignore"))
+        hashes.append(digest.hexdigest())
+    return hashes
@@ -62,8 +62,12 @@ def converter_pdf_para_imagens(arquivo_pdf, dpi=220, max_pages=None, grayscale=T
     erro = None
 
     try:
-        arquivo_pdf.seek(0)
-        pdf_bytes = arquivo_pdf.read()
+        # getbuffer(): memoryview sem cópia (BytesIO ou raw mapeado com mmap).
+        if hasattr(arquivo_pdf, "getbuffer"):
+            pdf_bytes = arquivo_pdf.getbuffer()
+        else:
+            arquivo_pdf.seek(0)
+            pdf_bytes = arquivo_pdf.read()
 
         with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_documento:
             total_paginas = len(pdf_documento)
@@ -92,3 +96,29 @@ def converter_pdf_para_imagens(arquivo_pdf, dpi=220, max_pages=None, grayscale=T
             erro = f"Erro ao converter PDF em imagens: {str(exc)}"
 
     return imagens, erro
+
+
+def inspecionar_pdf(pdf_bytes, max_paginas_amostra=3, min_chars_por_pagina=30):
+    """
+    Inspeção rápida (sem OCR) para estimar custo: conta páginas e amostra o texto
+    nativo das primeiras páginas. `pdf_bytes` também pode ser o caminho do arquivo.
+
+    Retorna:
+        (total_paginas, is_scanned, erro)
+    """
+    try:
+        abrir = fitz.open(pdf_bytes, filetype="pdf") if isinstance(pdf_bytes, str) else fitz.open(stream=pdf_bytes, filetype="pdf")
+        with abrir as pdf_documento:
+            total_paginas = len(pdf_documento)
+            amostra = min(total_paginas, int(max_paginas_amostra))
+            com_texto = sum(
+                1
+                for num_pagina in range(amostra)
+                if len(pdf_documento.load_page(num_pagina).get_text("text").strip()) >= min_chars_por_pagina
+            )
+    except Exception as exc:
+        if "password" in str(exc).lower():
+            return 0, False, "Este PDF está protegido por senha."
+        return 0, False, f"Erro ao inspecionar PDF: {str(exc)}"
+
+    return total_paginas, amostra > 0 and com_texto == 0, None
@@ -1,11 +1,46 @@
+import codecs
 import csv
-from io import StringIO
+import hashlib
+import itertools
+import logging
+import os
+import re
+import warnings
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+from openpyxl import load_workbook
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
 
 
-def _detectar_sep(csv_bytes: bytes) -> str:
-    sample = csv_bytes[:4096].decode("utf-8", errors="ignore")
+logger = logging.getLogger(__name__)
+
+# Amostra do início do CSV: encoding, separador e fingerprint do cabeçalho saem dela.
+CSV_AMOSTRA_BYTES = int(os.getenv("CSV_AMOSTRA_BYTES", str(1024 * 1024)))
+
+
+def _detectar_encoding(amostra: bytes) -> str:
+    """utf-8-sig (BOM), utf-8, cp1252 ou latin-1, nessa ordem, pelo primeiro que decodifica a amostra."""
+    if amostra.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    try:
+        # final=False: a amostra pode cortar um caractere multibyte no meio.
+        codecs.getincrementaldecoder("utf-8")().decode(amostra, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    try:
+        amostra.decode("cp1252")
+        return "cp1252"
+    except UnicodeDecodeError:
+        # 0x81, 0x8D, 0x8F, 0x90 e 0x9D não existem em cp1252; latin-1 decodifica qualquer byte.
+        return "latin-1"
+
+
+def _detectar_sep(csv_bytes: bytes, encoding: str = "utf-8") -> str:
+    sample = csv_bytes[:4096].decode(encoding, errors="ignore")
     try:
         dialect = csv.Sniffer().sniff(sample, delimiters=[",", ";", "\t", "|"])
         return dialect.delimiter
@@ -13,121 +48,392 @@ def _detectar_sep(csv_bytes: bytes) -> str:
         return ";" if sample.count(";") > sample.count(",") else ","
 
 
+_NAO_NUMERICO = re.compile(r"R\$|\s")
+# Valor com um único separador seguido de exatamente 3 dígitos ("1.500", "1,500"): milhar ou decimal
+# depende da convenção do export. Nos demais casos o próprio texto decide.
+_SEPARADOR_AMBIGUO = re.compile(r"^[-+]?\d{1,3}[.,]\d{3}$")
+_DECIMAL_VIRGULA = re.compile(r"^[-+]?[\d.]*,\d{1,2}$")
+_DECIMAL_PONTO = re.compile(r"^[-+]?[\d,]*\.(\d{1,2}|\d{4,})$")
+
+PLANILHA_CHUNK_ROWS = int(os.getenv("PLANILHA_CHUNK_ROWS", "50000"))
+
+MAPEAMENTO_COLUNAS = {
+    "data": ["data", "date", "dt", "vencimento", "dia", "período", "periodo", "dt. lançamento", "dt lancamento"],
+    "descricao": [
+        "descrição",
+        "descricao",
+        "item",
+        "serviço",
+        "servico",
+        "histórico",
+        "historico",
+        "nome",
+        "estabelecimento",
+        "lançamento",
+        "lancamento",
+        "memo",
+        "historico do lancamento",
+    ],
+    "valor": ["valor", "preço", "preco", "total", "amount", "pago", "valor pago", "vlr", "valor (r$)", "valor r$"],
+    "debito": ["débito", "debito", "saída", "saida", "debit", "valor débito", "valor debito"],
+    "credito": ["crédito", "credito", "entrada", "credit", "valor crédito", "valor credito"],
+}
+
+
+# Tentados em ordem no primeiro bloco; sem acerto, cai na inferência com dayfirst=True.
+FORMATOS_DATA = ["%d/%m/%Y", "%d/%m/%y", "%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%Y %H:%M:%S", "%Y-%m-%d %H:%M:%S"]
+
+COLUNAS_VALOR = ("valor", "debito", "credito")
+
+
+@dataclass
+class LayoutPlanilha:
+    """Layout resolvido de um export: colunas (chave interna -> nome no cabeçalho), separador e formatos."""
+
+    colunas: Dict[str, Optional[str]]
+    sep: Optional[str] = None  # None para xlsx
+    formato_data: Optional[str] = None  # None: datas nativas (xlsx) ou formato não reconhecido
+    decimal: str = "br"  # "br" (1.234,56 / R$) ou "ponto" (coluna já numérica)
+
 
+BuscarLayout = Callable[[str], Optional[LayoutPlanilha]]
+RegistrarLayout = Callable[[str, LayoutPlanilha], None]
 
-def _to_numeric_br(series: pd.Series) -> pd.Series:
-    return pd.to_numeric(
-        series.astype(str)
-        .str.replace("R$", "", regex=False)
-        .str.replace(" ", "", regex=False)
-        .str.replace(".", "", regex=False)
-        .str.replace(",", ".", regex=False),
-        errors="coerce",
+
+def _to_numeric_br(series: pd.Series, decimal: str = "br") -> pd.Series:
+    """
+    Converte valores em texto valor a valor: com "." e "," o último é o decimal; com um só separador
+    repetido ("1.234.567") ele é de milhar; "12,50" e "12.50" são decimais. Só o caso ambíguo
+    ("1.500") usa a convenção `decimal` do layout. Células já numéricas (xlsx) passam direto.
+    """
+    # Coluna já numérica não passa pela limpeza de texto: "100.0" viraria 1000.
+    if is_numeric_dtype(series):
+        return pd.to_numeric(series, errors="coerce")
+    numerica = series.map(lambda v: isinstance(v, (int, float, np.number)) and not isinstance(v, bool))
+    texto = series.astype(str).str.replace(_NAO_NUMERICO, "", regex=True)
+
+    ultimo_ponto = texto.str.rfind(".")
+    ultima_virgula = texto.str.rfind(",")
+    ambiguo = texto.str.match(_SEPARADOR_AMBIGUO)
+    virgula_unica = (texto.str.count(",") == 1) & (~ambiguo | (decimal == "br"))
+    ponto_unico = (texto.str.count(r"\.") == 1) & (~ambiguo | (decimal == "ponto"))
+    virgula_decimal = (ultima_virgula > ultimo_ponto) & ((ultimo_ponto >= 0) | virgula_unica)
+    ponto_decimal = (ultimo_ponto > ultima_virgula) & ((ultima_virgula >= 0) | ponto_unico)
+
+    limpo = texto.str.replace(r"[.,]", "", regex=True)
+    limpo[virgula_decimal] = texto[virgula_decimal].str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    limpo[ponto_decimal] = texto[ponto_decimal].str.replace(",", "", regex=False)
+    valores = pd.to_numeric(limpo, errors="coerce")
+    if numerica.any():
+        valores[numerica] = pd.to_numeric(series[numerica], errors="coerce")
+    return valores
+
+
+def _resolver_colunas(colunas: List[Any], nome_arquivo: str) -> Tuple[Optional[Dict[str, Optional[str]]], Optional[str]]:
+    """Mapeia o cabeçalho para o schema interno por sinônimos; devolve os nomes originais das colunas."""
+    originais: Dict[str, Any] = {}
+    for coluna in colunas:
+        originais.setdefault(str(coluna).strip().lower(), coluna)
+
+    def achar_col(sinonimos):
+        return next((originais[s] for s in sinonimos if s in originais), None)
+
+    cols = {chave: achar_col(sinonimos) for chave, sinonimos in MAPEAMENTO_COLUNAS.items()}
+    if not cols["data"]:
+        return None, f"Não encontramos a coluna de **data** no arquivo '{nome_arquivo}'."
+    if not cols["descricao"]:
+        return None, f"Não encontramos a coluna de **descrição** no arquivo '{nome_arquivo}'."
+    if not cols["valor"] and not cols["debito"] and not cols["credito"]:
+        return None, f"Não encontramos a coluna de **valor** (nem débito/crédito) no arquivo '{nome_arquivo}'."
+    return cols, None
+
+
+def _inferir_formato_data(series: pd.Series) -> Optional[str]:
+    if is_datetime64_any_dtype(series):
+        return None
+    amostra = series.dropna().astype(str).str.strip()
+    amostra = amostra[amostra != ""].head(200)
+    if amostra.empty:
+        return None
+    for formato in FORMATOS_DATA:
+        if pd.to_datetime(amostra, format=formato, errors="coerce").notna().all():
+            return formato
+    return None
+
+
+def _inferir_decimal(valores: List[pd.Series]) -> str:
+    # "ponto" só com evidência no texto ("12.50" e nenhum "12,50"); inteiros ou células numéricas não
+    # dizem nada sobre os próximos exports com o mesmo cabeçalho, que ficam com o padrão "br".
+    textos = pd.concat([v[~v.map(lambda x: isinstance(x, (int, float, np.number)))] for v in valores])
+    textos = textos.dropna().astype(str).str.replace(_NAO_NUMERICO, "", regex=True)
+    if textos.str.match(_DECIMAL_VIRGULA).any():
+        return "br"
+    return "ponto" if textos.str.match(_DECIMAL_PONTO).any() else "br"
+
+
+def _inferir_layout(df: pd.DataFrame, cols: Dict[str, Optional[str]], sep: Optional[str]) -> LayoutPlanilha:
+    return LayoutPlanilha(
+        colunas=cols,
+        sep=sep,
+        formato_data=_inferir_formato_data(df[cols["data"]]),
+        decimal=_inferir_decimal([df[cols[chave]] for chave in COLUNAS_VALOR if cols[chave]]),
     )
 
 
-def processar_planilha(uploaded_file):
-    """Lê, mapeia e normaliza Excel/CSV para o schema interno da app."""
+def _converter_valor(series: pd.Series, decimal: str) -> pd.Series:
+    # A convenção do layout só desempata "1.500"; "1.800,00" e "12,50" saem certos mesmo com um
+    # layout "ponto" registrado por um export anterior.
+    return _to_numeric_br(series, decimal)
+
+
+def _converter_data(series: pd.Series, formato: Optional[str]) -> pd.Series:
+    if not formato or is_datetime64_any_dtype(series):
+        return pd.to_datetime(series, errors="coerce", dayfirst=True)
+    datas = pd.to_datetime(series, format=formato, errors="coerce")
+    # Linhas fora do formato do layout (export que mudou) ainda passam pela inferência.
+    # ISO antes do dayfirst, que leria "2026-02-03" como 2 de março.
+    falhas = datas.isna() & series.notna()
+    if falhas.any():
+        datas[falhas] = pd.to_datetime(series[falhas], format="ISO8601", errors="coerce")
+        falhas = datas.isna() & series.notna()
+    if falhas.any():
+        datas[falhas] = pd.to_datetime(series[falhas], errors="coerce", dayfirst=True)
+    return datas
+
+
+def _normalizar_bloco(df: pd.DataFrame, layout: LayoutPlanilha, nome_arquivo: str) -> pd.DataFrame:
+    cols = layout.colunas
+    out = pd.DataFrame(index=df.index)
+    out["data"] = df[cols["data"]]
+    out["descricao"] = df[cols["descricao"]]
+
+    if cols["valor"]:
+        out["valor"] = df[cols["valor"]]
+        out["tipo"] = None
+    else:
+        zeros = pd.Series(0.0, index=df.index)
+        deb = _converter_valor(df[cols["debito"]], layout.decimal).fillna(0).abs() if cols["debito"] else zeros
+        cre = _converter_valor(df[cols["credito"]], layout.decimal).fillna(0).abs() if cols["credito"] else zeros
+
+        out["valor"] = cre + deb
+        out["tipo"] = np.where((cre > 0) & (cre > deb), "entrada", "saida")
+
+    out["descricao"] = out["descricao"].astype(str).str.strip()
+    out = out.dropna(subset=["data", "descricao"], how="all")
+
+    out["data"] = _converter_data(out["data"], layout.formato_data)
+    out["valor"] = _converter_valor(out["valor"], layout.decimal)
+
+    # Se veio valor com sinal, converte para modelo valor positivo + tipo
+    signed_mask = out["valor"].notna()
+    inferred = out.loc[signed_mask, "valor"]
+    out.loc[signed_mask & (inferred < 0), "tipo"] = "saida"
+    out.loc[signed_mask & (inferred > 0), "tipo"] = out.loc[signed_mask & (inferred > 0), "tipo"].fillna("entrada")
+    out["valor"] = out["valor"].abs()
+
+    out["fonte"] = nome_arquivo
+    out["categoria"] = "Outros"
+    out["tipo"] = out["tipo"].fillna("saida")
+
+    out = out.dropna(subset=["descricao"])
+    out["valor"] = out["valor"].fillna(0.0)
+
+    return out[["data", "valor", "descricao", "fonte", "categoria", "tipo"]]
+
+
+def _fingerprint_csv(amostra: bytes) -> Optional[str]:
+    """SHA-256 da linha de cabeçalho crua: inclui os nomes das colunas e o separador."""
+    cabecalho = amostra.split(b"\n", 1)[0].rstrip(b"\r").lstrip(codecs.BOM_UTF8)
+    if not cabecalho.strip():
+        return None
+    return hashlib.sha256(b"csv\0" + cabecalho).hexdigest()
+
+
+def _fingerprint_colunas(colunas: List[Any]) -> str:
+    return hashlib.sha256(("xlsx\0" + "\x1f".join(str(c) for c in colunas)).encode("utf-8")).hexdigest()
+
+
+def _ler_csv(uploaded_file, engine: str, chunk_rows: int, sep: str, encoding: str, extras: Dict[str, Any]):
+    uploaded_file.seek(0)
+    # "replace": byte fora do encoding detectado vira U+FFFD em vez de sumir do texto.
+    return pd.read_csv(
+        uploaded_file,
+        sep=sep,
+        engine=engine,
+        chunksize=chunk_rows,
+        encoding=encoding,
+        encoding_errors="replace",
+        **extras,
+    )
+
+
+def _blocos_csv(
+    uploaded_file, chunk_rows: int, sep: str, encoding: str, layout: Optional[LayoutPlanilha]
+) -> Iterator[pd.DataFrame]:
+    """
+    Lê os bytes direto com o engine C (o pyarrow não lê em blocos). Só em erro de parsing relê com o
+    engine python, que aceita `on_bad_lines` chamável: numa linha com campos a mais (separador solto na
+    descrição) os excedentes voltam para a coluna de descrição e os campos seguintes, como o valor,
+    ficam no lugar. Os registros já entregues são descartados na releitura.
+    """
+    # Tudo como texto em todos os blocos: se o engine inferisse o dtype por bloco, "1.500" viraria 1.5
+    # num bloco só de inteiros com ponto e 1500 num bloco com "2.000,50". A conversão é `_converter_valor`.
+    # Sem usecols: com ele os dois engines cortam calado a linha com campos a mais.
+    extras: Dict[str, Any] = {"dtype": str}
+    # Sem índice: com campos a mais já na primeira linha de dados os engines tomariam a coluna 0 como
+    # índice implícito, sem ParserError, e o arquivo inteiro sairia deslocado. No engine C vai
+    # index_col=False, e o aviso de corte que ele emite nessa linha é promovido a erro para cair no
+    # engine python; lá False cortaria o excedente calado e pularia o `on_bad_lines`, então vai a lista
+    # vazia, que também desliga o índice implícito.
+    entregues = 0
     try:
-        nome = uploaded_file.name.lower()
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", pd.errors.ParserWarning)
+            with _ler_csv(uploaded_file, "c", chunk_rows, sep, encoding, {**extras, "index_col": False}) as reader:
+                for bloco in reader:
+                    entregues += len(bloco)
+                    yield bloco
+        return
+    except (pd.errors.ParserError, pd.errors.ParserWarning) as exc:
+        logger.warning("[PLANILHA] Engine C falhou em '%s' após %d linhas (%s); usando engine python.", uploaded_file.name, entregues, exc)
 
-        if nome.endswith(".csv"):
-            raw = uploaded_file.getvalue()
-            sep = _detectar_sep(raw)
-            df = pd.read_csv(StringIO(raw.decode("utf-8", errors="ignore")), sep=sep, engine="python")
-        else:
-            df = pd.read_excel(uploaded_file)
-
-        if df is None or df.empty:
-            return None, f"O arquivo '{uploaded_file.name}' está vazio."
-
-        df.columns = [str(c).strip().lower() for c in df.columns]
-
-        mapeamento = {
-            "data": ["data", "date", "dt", "vencimento", "dia", "período", "periodo", "dt. lançamento", "dt lancamento"],
-            "descricao": [
-                "descrição",
-                "descricao",
-                "item",
-                "serviço",
-                "servico",
-                "histórico",
-                "historico",
-                "nome",
-                "estabelecimento",
-                "lançamento",
-                "lancamento",
-                "memo",
-                "historico do lancamento",
-            ],
-            "valor": ["valor", "preço", "preco", "total", "amount", "pago", "valor pago", "vlr", "valor (r$)", "valor r$"],
-        }
-
-        sinonimos_debito = ["débito", "debito", "saída", "saida", "debit", "valor débito", "valor debito"]
-        sinonimos_credito = ["crédito", "credito", "entrada", "credit", "valor crédito", "valor credito"]
-
-        def achar_col(sinonimos):
-            return next((s for s in sinonimos if s in df.columns), None)
-
-        col_data = achar_col(mapeamento["data"])
-        col_desc = achar_col(mapeamento["descricao"])
-        col_val = achar_col(mapeamento["valor"])
-        col_deb = achar_col(sinonimos_debito)
-        col_cre = achar_col(sinonimos_credito)
-
-        if not col_data:
-            return None, f"Não encontramos a coluna de **data** no arquivo '{uploaded_file.name}'."
-        if not col_desc:
-            return None, f"Não encontramos a coluna de **descrição** no arquivo '{uploaded_file.name}'."
-
-        out = pd.DataFrame()
-        out["data"] = df[col_data]
-        out["descricao"] = df[col_desc]
-
-        if col_val:
-            out["valor"] = df[col_val]
-            out["tipo"] = None
-        else:
-            if not col_deb and not col_cre:
-                return None, (
-                    f"Não encontramos a coluna de **valor** (nem débito/crédito) no arquivo '{uploaded_file.name}'."
-                )
+    uploaded_file.seek(0)
+    cabecalho = list(pd.read_csv(uploaded_file, sep=sep, nrows=0, encoding=encoding, encoding_errors="replace", index_col=False).columns)
+    cols = layout.colunas if layout is not None else _resolver_colunas(cabecalho, uploaded_file.name)[0]
+    descricao = cols.get("descricao") if cols else None
+    indice = cabecalho.index(descricao) if descricao in cabecalho else None
+    reparadas, descartadas = [], []
 
-            deb = _to_numeric_br(df[col_deb]) if col_deb else pd.Series(0, index=df.index, dtype=float)
-            cre = _to_numeric_br(df[col_cre]) if col_cre else pd.Series(0, index=df.index, dtype=float)
+    def _linha_ruim(campos: List[str]) -> Optional[List[str]]:
+        excedentes = len(campos) - len(cabecalho)
+        if indice is None or excedentes <= 0:
+            descartadas.append(campos)
+            return None
+        reparadas.append(campos)
+        fim = indice + excedentes + 1
+        return campos[:indice] + [sep.join(campos[indice:fim])] + campos[fim:]
 
-            out["valor"] = (cre.fillna(0).abs() + deb.fillna(0).abs())
-            has_deb = deb.fillna(0).abs() > 0
-            has_cre = cre.fillna(0).abs() > 0
-            out["tipo"] = "saida"
-            out.loc[has_cre & ~has_deb, "tipo"] = "entrada"
-            out.loc[has_cre & has_deb & (cre.fillna(0).abs() > deb.fillna(0).abs()), "tipo"] = "entrada"
+    extras = {**extras, "index_col": [], "on_bad_lines": _linha_ruim}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", pd.errors.ParserWarning)
+        with _ler_csv(uploaded_file, "python", chunk_rows, sep, encoding, extras) as reader:
+            for bloco in reader:
+                if entregues >= len(bloco):
+                    entregues -= len(bloco)
+                    continue
+                yield bloco.iloc[entregues:]
+                entregues = 0
+    if reparadas:
+        logger.warning(
+            "[PLANILHA] %d linha(s) de '%s' com campos a mais tiveram o excedente juntado à descrição.",
+            len(reparadas),
+            uploaded_file.name,
+        )
+    if descartadas:
+        logger.warning(
+            "[PLANILHA] %d linha(s) de '%s' descartadas por não caberem no cabeçalho: %s",
+            len(descartadas),
+            uploaded_file.name,
+            [sep.join(c) for c in descartadas[:5]],
+        )
 
-        out["descricao"] = out["descricao"].astype(str).str.strip()
-        out = out.dropna(subset=["data", "descricao"], how="all")
 
-        out["data"] = pd.to_datetime(out["data"], errors="coerce", dayfirst=True)
+def _blocos_xlsx(uploaded_file, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    # read_only: o openpyxl percorre as linhas do XML da planilha sem montar o workbook inteiro.
+    uploaded_file.seek(0)
+    wb = load_workbook(uploaded_file, read_only=True, data_only=True)
+    try:
+        linhas = wb.worksheets[0].iter_rows(values_only=True)
+        cabecalho = next(linhas, None)
+        if cabecalho is None:
+            return
+        colunas = [f"Unnamed: {i}" if c is None else c for i, c in enumerate(cabecalho)]
+        bloco: List[tuple] = []
+        for linha in linhas:
+            if all(v is None for v in linha):
+                continue
+            bloco.append(linha[: len(colunas)] + (None,) * (len(colunas) - len(linha)))
+            if len(bloco) >= chunk_rows:
+                yield _bloco_xlsx(bloco, colunas)
+                bloco = []
+        if bloco:
+            yield _bloco_xlsx(bloco, colunas)
+    finally:
+        wb.close()
 
-        if out["valor"].dtype == object:
-            out["valor"] = _to_numeric_br(out["valor"])
-        out["valor"] = pd.to_numeric(out["valor"], errors="coerce")
 
-        # Se veio valor com sinal, converte para modelo valor positivo + tipo
-        signed_mask = out["valor"].notna()
-        inferred = out.loc[signed_mask, "valor"]
-        out.loc[signed_mask & (inferred < 0), "tipo"] = "saida"
-        out.loc[signed_mask & (inferred > 0), "tipo"] = out.loc[signed_mask & (inferred > 0), "tipo"].fillna("entrada")
-        out["valor"] = out["valor"].abs()
+def _bloco_xlsx(linhas: List[tuple], colunas: List[Any]) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(linhas, columns=colunas, coerce_float=True).infer_objects()
+    # Células vazias chegam como None; o read_excel as entrega como NaN.
+    texto = df.select_dtypes(include="object").columns
+    if len(texto):
+        df[texto] = df[texto].where(df[texto].notna(), np.nan)
+    return df
 
-        out["fonte"] = uploaded_file.name
-        out["categoria"] = "Outros"
-        out["tipo"] = out["tipo"].fillna("saida")
 
-        out = out.dropna(subset=["descricao"])
-        out["valor"] = out["valor"].fillna(0.0)
+def iterar_planilha(
+    uploaded_file,
+    chunk_rows: int = PLANILHA_CHUNK_ROWS,
+    buscar_layout: Optional[BuscarLayout] = None,
+    registrar_layout: Optional[RegistrarLayout] = None,
+) -> Tuple[Optional[Iterator[pd.DataFrame]], Optional[str]]:
+    """
+    Lê Excel/CSV em blocos de `chunk_rows` linhas (CSV com o engine C, xlsx em modo read-only) e
+    devolve um iterador de blocos já normalizados. O cabeçalho é mapeado uma vez, no primeiro bloco.
+    Com `buscar_layout`/`registrar_layout`, o layout resolvido fica registrado pelo fingerprint do
+    cabeçalho; exports com o mesmo cabeçalho pulam o Sniffer, a busca de sinônimos e a inferência de datas.
+    """
+    nome_arquivo = uploaded_file.name
+    try:
+        layout = None
+        sep = None
+        if nome_arquivo.lower().endswith(".csv"):
+            uploaded_file.seek(0)
+            amostra = uploaded_file.read(CSV_AMOSTRA_BYTES)
+            encoding = _detectar_encoding(amostra)
+            fingerprint = _fingerprint_csv(amostra)
+            if buscar_layout and fingerprint:
+                layout = buscar_layout(fingerprint)
+            sep = layout.sep if layout is not None else _detectar_sep(amostra, encoding)
+            blocos = _blocos_csv(uploaded_file, chunk_rows, sep, encoding, layout)
+            primeiro = next(blocos, None)
+        else:
+            blocos = _blocos_xlsx(uploaded_file, chunk_rows)
+            primeiro = next(blocos, None)
+            fingerprint = _fingerprint_colunas(list(primeiro.columns)) if primeiro is not None else None
+            if buscar_layout and fingerprint:
+                layout = buscar_layout(fingerprint)
 
-        cols = ["data", "valor", "descricao", "fonte", "categoria", "tipo"]
-        return out[cols], None
+        if primeiro is None or primeiro.empty:
+            return None, f"O arquivo '{nome_arquivo}' está vazio."
 
+        if layout is None:
+            cols, err = _resolver_colunas(list(primeiro.columns), nome_arquivo)
+            if err:
+                return None, err
+            layout = _inferir_layout(primeiro, cols, sep)
+            if registrar_layout and fingerprint:
+                registrar_layout(fingerprint, layout)
+    except Exception as exc:
+        return None, f"Erro crítico ao ler '{nome_arquivo}': {str(exc)}"
+
+    def _normalizados() -> Iterator[pd.DataFrame]:
+        for bloco in itertools.chain([primeiro], blocos):
+            yield _normalizar_bloco(bloco, layout, nome_arquivo)
+
+    return _normalizados(), None
+
+
+def processar_planilha(
+    uploaded_file,
+    buscar_layout: Optional[BuscarLayout] = None,
+    registrar_layout: Optional[RegistrarLayout] = None,
+):
+    """Lê, mapeia e normaliza Excel/CSV para o schema interno da app."""
+    blocos, err = iterar_planilha(uploaded_file, buscar_layout=buscar_layout, registrar_layout=registrar_layout)
+    if err:
+        return None, err
+    try:
+        return pd.concat(list(blocos), ignore_index=True), None
     except Exception as exc:
         return None, f"Erro crítico ao ler '{uploaded_file.name}': {str(exc)}"
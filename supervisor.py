@@ -0,0 +1,172 @@
+"""Supervisor de um pool de workers RQ com autoscaling por profundidade de fila e idade do job mais antigo.
+
+Uso:
+    python supervisor.py --queues mn2512-text,mn2512-text-slow --min 1 --max 4
+    python supervisor.py --queues mn2512-extraction --min 2 --max 12 --jobs-per-worker 3
+"""
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import signal
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from redis import Redis
+from rq import Queue, Worker
+
+from tasks import ALL_QUEUES
+from worker import redis_url, run_worker
+
+SUPERVISOR_INTERVAL_S = float(os.getenv("SUPERVISOR_INTERVAL_S", "5"))
+SCALE_DOWN_COOLDOWN_S = float(os.getenv("SCALE_DOWN_COOLDOWN_S", "60"))
+DRAIN_TIMEOUT_S = float(os.getenv("DRAIN_TIMEOUT_S", "900"))
+
+logger = logging.getLogger("supervisor")
+
+
+def desired_workers(
+    depth: int,
+    oldest_age_s: float,
+    current: int,
+    min_workers: int,
+    max_workers: int,
+    jobs_per_worker: int = 5,
+    max_wait_s: float = 60,
+) -> int:
+    """
+    Workers necessários para `depth` jobs (um a cada `jobs_per_worker`); se o job mais antigo
+    espera mais que `max_wait_s`, acrescenta um worker ao atual. Sempre dentro de [min, max].
+    """
+    target = math.ceil(depth / max(1, jobs_per_worker)) if depth > 0 else 0
+    if depth > 0 and oldest_age_s > max_wait_s:
+        target = max(target, current + 1)
+    return max(min_workers, min(max_workers, target))
+
+
+def queue_backlog(queues: List[Queue]) -> Tuple[int, float]:
+    """(jobs enfileirados, idade em segundos do job mais antigo) somando as filas do pool."""
+    depth = 0
+    oldest_age_s = 0.0
+    now = datetime.now(timezone.utc)
+    for q in queues:
+        depth += q.count
+        job_ids = q.get_job_ids(0, 1)
+        job = q.fetch_job(job_ids[0]) if job_ids else None
+        if job and job.enqueued_at:
+            enqueued_at = job.enqueued_at if job.enqueued_at.tzinfo else job.enqueued_at.replace(tzinfo=timezone.utc)
+            oldest_age_s = max(oldest_age_s, (now - enqueued_at).total_seconds())
+    return depth, oldest_age_s
+
+
+def _worker_main(queues: List[str], url: str, name: str) -> None:
+    # O filho herda os handlers do supervisor no fork; o RQ instala os próprios em `work()`.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    run_worker(queues, url, name)
+
+
+class WorkerPool:
+    def __init__(self, queues: List[str], min_workers: int, max_workers: int, jobs_per_worker: int, max_wait_s: float, url: str):
+        self.queue_names = queues
+        self.min_workers = max(0, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.jobs_per_worker = jobs_per_worker
+        self.max_wait_s = max_wait_s
+        self.url = url
+        self.conn = Redis.from_url(url)
+        self.queues = [Queue(name, connection=self.conn) for name in queues]
+        self.procs: Dict[str, multiprocessing.Process] = {}
+        self.draining: Dict[str, Tuple[multiprocessing.Process, float]] = {}
+        self.last_scale_up = 0.0
+        self.stopping = False
+
+    def _spawn(self) -> None:
+        name = f"mn2512-{os.uname().nodename}-{uuid.uuid4().hex[:8]}"
+        proc = multiprocessing.Process(target=_worker_main, args=(self.queue_names, self.url, name), name=name, daemon=False)
+        proc.start()
+        self.procs[name] = proc
+        logger.info("[SUPERVISOR] Worker iniciado %s (pid=%s) filas=%s", name, proc.pid, ",".join(self.queue_names))
+
+    def _is_busy(self, name: str) -> bool:
+        worker = Worker.find_by_key(Worker.redis_worker_namespace_prefix + name, connection=self.conn)
+        return bool(worker and worker.get_state() == "busy")
+
+    def _drain(self, name: str) -> None:
+        """Um único SIGTERM = warm shutdown do RQ: o job em andamento termina antes de o processo sair."""
+        proc = self.procs.pop(name)
+        if proc.is_alive():
+            os.kill(proc.pid, signal.SIGTERM)
+        self.draining[name] = (proc, time.time())
+        logger.info("[SUPERVISOR] Drenando worker %s (pid=%s)", name, proc.pid)
+
+    def _collect(self) -> None:
+        for name, proc in list(self.procs.items()):
+            if not proc.is_alive():
+                logger.warning("[SUPERVISOR] Worker %s saiu (exitcode=%s)", name, proc.exitcode)
+                self.procs.pop(name)
+        for name, (proc, since) in list(self.draining.items()):
+            if not proc.is_alive():
+                proc.join(timeout=0)
+                self.draining.pop(name)
+            elif time.time() - since > DRAIN_TIMEOUT_S:
+                # Job preso além do timeout: o lease expira e o reaper devolve o documento à fila.
+                logger.error("[SUPERVISOR] Worker %s não drenou em %.0fs; encerrando.", name, DRAIN_TIMEOUT_S)
+                proc.kill()
+
+    def step(self) -> int:
+        self._collect()
+        depth, oldest_age_s = queue_backlog(self.queues)
+        current = len(self.procs)
+        target = desired_workers(
+            depth, oldest_age_s, current, self.min_workers, self.max_workers, self.jobs_per_worker, self.max_wait_s
+        )
+
+        if target > current:
+            for _ in range(target - current):
+                self._spawn()
+            self.last_scale_up = time.time()
+        elif target < current and time.time() - self.last_scale_up >= SCALE_DOWN_COOLDOWN_S:
+            # Ociosos primeiro; ocupados só se necessário, e ainda assim terminam o job atual.
+            names = sorted(self.procs, key=self._is_busy)
+            for name in names[: current - target]:
+                self._drain(name)
+        return target
+
+    def stop(self, *_args) -> None:
+        self.stopping = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self.stopping:
+            self.step()
+            time.sleep(SUPERVISOR_INTERVAL_S)
+
+        for name in list(self.procs):
+            self._drain(name)
+        while self.draining:
+            self._collect()
+            time.sleep(1)
+        logger.info("[SUPERVISOR] Pool encerrado.")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queues", default=os.getenv("RQ_QUEUES", ",".join(ALL_QUEUES)), help="filas separadas por vírgula")
+    parser.add_argument("--min", type=int, default=int(os.getenv("SUPERVISOR_MIN_WORKERS", "1")), dest="min_workers")
+    parser.add_argument("--max", type=int, default=int(os.getenv("SUPERVISOR_MAX_WORKERS", str(os.cpu_count() or 2))), dest="max_workers")
+    parser.add_argument("--jobs-per-worker", type=int, default=int(os.getenv("SUPERVISOR_JOBS_PER_WORKER", "5")))
+    parser.add_argument("--max-wait", type=float, default=float(os.getenv("SUPERVISOR_MAX_WAIT_S", "60")), help="idade máxima do job mais antigo (s)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    queues = [q.strip() for q in args.queues.split(",") if q.strip()]
+    WorkerPool(queues, args.min_workers, args.max_workers, args.jobs_per_worker, args.max_wait, redis_url).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,623 @@
+import logging
 import os
+import random
+import threading
 import traceback
+import uuid
+from contextlib import contextmanager
 from datetime import timedelta
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
 
-from rq import Queue, get_current_job
+from redis import ConnectionPool, Redis
+from redis.exceptions import WatchError
+from rq import Queue, Retry, get_current_job
+from rq.exceptions import DuplicateJobError, NoSuchJobError
+from rq.job import Dependency, Job, JobStatus
 
+from concurrency import CONTROLLER_INTERVAL_S
 from localDB import (
+    LANE_SLOW,
+    LeaseLostError,
+    OCR_FANOUT_LEASE_S,
+    SLOT_HEARTBEAT_S,
+    STAGE_STRUCTURED_EXTRACTION,
+    STAGE_TEXT_EXTRACTION,
     STATUS_ERROR_PROCESSING,
+    STATUS_PROCESSING_TEXT,
+    STATUS_TEXT_EXTRACTED,
+    acquire_stage_lease,
     count_processing_docs,
+    document_priority,
+    finish_slot_wait,
+    get_active_docs_limit,
+    get_ingest_document,
+    heartbeat_processing_slot,
+    increment_counter,
+    join_ocr_pages,
+    mark_slot_wait,
+    needs_llm_refinement,
+    ocr_pdf_page,
+    prepare_ocr_fanout,
+    reap_expired_slots,
+    refine_extraction_with_llm,
+    release_processing_slot,
+    run_concurrency_controller,
     run_pipeline_for_document,
+    transfer_processing_slot,
     try_acquire_processing_slot,
+    update_document_metrics,
     update_document_status,
 )
 
-MAX_ACTIVE_DOCS = int(os.getenv("MAX_ACTIVE_DOCS", "2"))
+# Fallback quando nenhuma vaga libera: backoff exponencial com jitter entre REQUEUE_DELAY_S e REQUEUE_MAX_DELAY_S.
 REQUEUE_DELAY_S = int(os.getenv("REQUEUE_DELAY_S", "10"))
+REQUEUE_MAX_DELAY_S = int(os.getenv("REQUEUE_MAX_DELAY_S", "120"))
+# Lista FIFO (Redis) com os ids dos jobs agendados à espera de vaga; cada liberação antecipa o primeiro.
+SLOT_WAITERS_KEY = "mn2512:slot-waiters"
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "20"))
+# Publica o resultado local para revisão antes do LLM; o LLM roda em job separado.
+TWO_PHASE_EXTRACTION = os.getenv("TWO_PHASE_EXTRACTION", "1") == "1"
 
+# Filas por etapa: OCR (CPU) e extração/LLM (I/O) escalam com workers diferentes.
+# A etapa de texto tem duas raias: documentos baratos não esperam atrás de PDFs escaneados longos.
+LEGACY_QUEUE = "mn2512"
+TEXT_QUEUE = os.getenv("RQ_TEXT_QUEUE", "mn2512-text")
+TEXT_SLOW_QUEUE = os.getenv("RQ_TEXT_SLOW_QUEUE", "mn2512-text-slow")
+EXTRACTION_QUEUE = os.getenv("RQ_EXTRACTION_QUEUE", "mn2512-extraction")
+ALL_QUEUES = [TEXT_QUEUE, TEXT_SLOW_QUEUE, EXTRACTION_QUEUE, LEGACY_QUEUE]
+# Filas que rodam OCR: workers dedicados a elas carregam o EasyOCR na subida.
+OCR_QUEUES = [TEXT_QUEUE, TEXT_SLOW_QUEUE, LEGACY_QUEUE]
+TEXT_JOB_TIMEOUT = int(os.getenv("TEXT_JOB_TIMEOUT", "900"))
+EXTRACTION_JOB_TIMEOUT = int(os.getenv("EXTRACTION_JOB_TIMEOUT", "900"))
+OCR_PAGE_JOB_TIMEOUT = int(os.getenv("OCR_PAGE_JOB_TIMEOUT", "180"))
+OCR_PAGE_RETRIES = int(os.getenv("OCR_PAGE_RETRIES", "2"))
+REAPER_INTERVAL_S = int(os.getenv("REAPER_INTERVAL_S", "60"))
+REAPER_JOB_PREFIX = "mn2512-reaper-"
+CONTROLLER_JOB_PREFIX = "mn2512-controller-"
 
-def process_document_job(document_id: str) -> Dict[str, Any]:
+# Ids determinísticos "mn2512-{etapa}-{document_id}": enfileirar de novo um documento que já tem
+# job pendente devolve o job existente (coalescido). A espera por vaga alterna entre "-wait0" e
+# "-wait1", porque o job em execução não pode reaproveitar o próprio id.
+JOB_STAGE_TEXT = "text"
+JOB_STAGE_EXTRACTION = "extraction"
+JOB_STAGE_REFINE = "refine"
+JOB_STAGE_PROCESS = "process"
+WAIT_SUFFIXES = ("-wait0", "-wait1")
+ACTIVE_JOB_STATUSES = {JobStatus.QUEUED, JobStatus.STARTED, JobStatus.DEFERRED, JobStatus.SCHEDULED}
+
+logger = logging.getLogger(__name__)
+
+_redis_lock = threading.Lock()
+_redis_clients: Dict[str, Redis] = {}
+
+
+def get_redis_connection(url: Optional[str] = None) -> Redis:
+    """Cliente Redis do processo (um ConnectionPool por URL), reaproveitado entre cliques e jobs."""
+    url = url or REDIS_URL
+    with _redis_lock:
+        client = _redis_clients.get(url)
+        if client is None:
+            client = Redis(connection_pool=ConnectionPool.from_url(url, max_connections=REDIS_MAX_CONNECTIONS))
+            _redis_clients[url] = client
+    return client
+
+
+def requeue_delay_s(attempt: int) -> float:
+    """Backoff exponencial com "equal jitter": espalha os reagendamentos de uma rajada."""
+    ceiling = min(REQUEUE_MAX_DELAY_S, REQUEUE_DELAY_S * (2 ** max(0, attempt)))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def stage_job_id(stage: str, document_id: str) -> str:
+    return f"mn2512-{stage}-{document_id}"
+
+
+def _fetch_job(job_id: str, connection) -> Optional[Job]:
+    try:
+        return Job.fetch(job_id, connection=connection)
+    except NoSuchJobError:
+        return None
+
+
+def _active_stage_job(stage: str, document_id: str, connection, statuses=ACTIVE_JOB_STATUSES) -> Optional[Job]:
+    base = stage_job_id(stage, document_id)
+    for job_id in (base, *(base + suffix for suffix in WAIT_SUFFIXES)):
+        job = _fetch_job(job_id, connection)
+        if job and job.get_status() in statuses:
+            return job
+    return None
+
+
+def _enqueue_coalesced(q: Queue, func, stage: str, document_id: str, resume: bool = False, **kwargs) -> Tuple[Job, bool]:
+    """
+    Enfileira `func(document_id)` com id determinístico; retorna (job, coalescido).
+    `resume=True` (reaper): o lease expirou, então um job ainda "started" é de um worker morto e não coalesce.
+    """
+    statuses = ACTIVE_JOB_STATUSES - {JobStatus.STARTED} if resume else ACTIVE_JOB_STATUSES
+    active = _active_stage_job(stage, document_id, q.connection, statuses)
+    if active:
+        increment_counter("enqueue_coalesced")
+        return active, True
+
+    job_id = stage_job_id(stage, document_id)
+    stale = _fetch_job(job_id, q.connection)
+    if stale:
+        # Execução anterior já terminada (finished/failed/canceled): libera o id para a nova.
+        stale.delete()
+    try:
+        # unique=True: checagem + gravação atômicas (script Lua), cobre enfileiramentos concorrentes.
+        return q.enqueue(func, document_id, job_id=job_id, unique=True, **kwargs), False
+    except DuplicateJobError:
+        increment_counter("enqueue_coalesced")
+        return Job.fetch(job_id, connection=q.connection), True
+
+
+def _wait_for_slot(document_id: str, func, stage: str, attempt: int, job_timeout: int) -> Dict[str, Any]:
+    mark_slot_wait(document_id)
+    job = get_current_job()
+    if job:
+        q = Queue(job.origin, connection=job.connection)
+        base = stage_job_id(stage, document_id)
+        next_id = base + (WAIT_SUFFIXES[1] if job.id.endswith(WAIT_SUFFIXES[0]) else WAIT_SUFFIXES[0])
+        stale = _fetch_job(next_id, job.connection)
+        if stale:
+            stale.delete()
+        fallback = q.enqueue_in(
+            timedelta(seconds=requeue_delay_s(attempt)),
+            func,
+            document_id,
+            attempt=attempt + 1,
+            job_id=next_id,
+            job_timeout=job_timeout,
+        )
+        job.connection.rpush(SLOT_WAITERS_KEY, fallback.id)
+    return {
+        "ok": False,
+        "requeued": True,
+        "attempt": attempt,
+        "active_docs": count_processing_docs(),
+        "message": f"Limite global atingido ({get_active_docs_limit()} documentos ativos).",
+    }
+
+
+def wake_slot_waiter(connection) -> Optional[str]:
+    """Antecipa o job mais antigo à espera de vaga; ignora os que o fallback já disparou."""
+    while True:
+        job_id = connection.lpop(SLOT_WAITERS_KEY)
+        if job_id is None:
+            return None
+        job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+        try:
+            job = Job.fetch(job_id, connection=connection)
+        except NoSuchJobError:
+            continue
+        q = Queue(job.origin, connection=connection)
+        # zrem atômico: só quem tira o job do registro de agendados o enfileira (sem execução dupla).
+        if q.scheduled_job_registry.remove(job):
+            q.enqueue_job(job, at_front=True)
+            increment_counter("slot_wakeups")
+            return job_id
+
+
+@contextmanager
+def _hold_slot(document_id: str, connection=None, token: Optional[str] = None):
+    """
+    Mantém o lease da vaga com heartbeats em background; ao final libera a vaga e acorda o próximo da fila.
+    Produz um Event setado quando o heartbeat percebe o lease perdido: o job deve parar sem gravar (outro job
+    já retomou o documento). Entre dois heartbeats o Event pode estar atrasado; por isso as gravações de status
+    da pipeline também conferem o token na própria transação.
+    """
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def _beat():
+        while not stop.wait(SLOT_HEARTBEAT_S):
+            try:
+                if not heartbeat_processing_slot(document_id, token=token):
+                    logger.warning("[PIPELINE] Lease perdido doc=%s; o reaper já recuperou a vaga.", document_id)
+                    lost.set()
+                    return
+            except Exception:
+                logger.exception("[PIPELINE] Falha no heartbeat da vaga doc=%s.", document_id)
+
+    beater = threading.Thread(target=_beat, name=f"slot-heartbeat-{document_id[:8]}", daemon=True)
+    beater.start()
     try:
-        if not try_acquire_processing_slot(document_id, max_active_docs=MAX_ACTIVE_DOCS):
-            job = get_current_job()
-            if job:
-                q = Queue(job.origin, connection=job.connection)
-                q.enqueue_in(timedelta(seconds=REQUEUE_DELAY_S), process_document_job, document_id, job_timeout=900)
-            return {
-                "ok": False,
-                "requeued": True,
-                "active_docs": count_processing_docs(),
-                "message": f"Limite global atingido (MAX_ACTIVE_DOCS={MAX_ACTIVE_DOCS}).",
-            }
+        yield lost
+    finally:
+        stop.set()
+        beater.join(timeout=5)
+        # Com token, a liberação não apaga o lease de quem retomou o documento depois do reaper.
+        release_processing_slot(document_id, token=token)
+        if connection is not None:
+            try:
+                wake_slot_waiter(connection)
+            except Exception:
+                logger.exception("[PIPELINE] Falha ao acordar job em espera de vaga.")
+
+
+def _confirm_lease(document_id: str, token: str, ok: bool, lost: threading.Event) -> None:
+    # A falha pode ser uma gravação recusada por token vencido (ver `_update_document_fields`): antes de
+    # o job gravar o erro no documento, confere o lease em vez de esperar o próximo heartbeat.
+    if not ok and not lost.is_set() and not heartbeat_processing_slot(document_id, token=token):
+        lost.set()
+
+
+def _lease_lost(document_id: str) -> Dict[str, Any]:
+    # Nenhuma gravação de status: o documento pertence ao job que o reaper reenfileirou.
+    increment_counter("lease_lost")
+    return {"ok": False, "lease_lost": True, "error": f"Lease perdido doc={document_id}; job interrompido."}
+
+
+def text_queue_for(doc: Optional[Dict[str, Any]]) -> str:
+    return TEXT_SLOW_QUEUE if doc and doc.get("lane") == LANE_SLOW else TEXT_QUEUE
+
+
+def enqueue_document(
+    document_id: str, connection, doc: Optional[Dict[str, Any]] = None, resume: bool = False
+) -> Tuple[Job, bool]:
+    """
+    Ponto de entrada da pipeline: enfileira a etapa de texto na raia do documento; as demais encadeiam sozinhas.
+    Retorna (job, coalescido): documento já na fila (ou aguardando vaga) reaproveita o job existente.
+    """
+    doc = doc or get_ingest_document(document_id)
+    q = Queue(text_queue_for(doc), connection=connection)
+    return _enqueue_coalesced(q, text_stage_job, JOB_STAGE_TEXT, document_id, resume=resume, job_timeout=TEXT_JOB_TIMEOUT)
+
 
-        ok, message = run_pipeline_for_document(document_id)
+# Status de vários jobs numa ida ao Redis (HGET por chave); false vira nil para ids inexistentes.
+_JOB_STATUSES_SCRIPT = """
+local out = {}
+for i, key in ipairs(KEYS) do
+    out[i] = redis.call('HGET', key, 'status') or false
+end
+return out
+"""
+ENQUEUE_WATCH_RETRIES = 5
+
+
+def enqueue_documents(docs: List[Dict[str, Any]], connection) -> Tuple[int, int, int]:
+    """
+    Enfileira um lote em ordem SJF (com aging); retorna (enfileirados, coalescidos, falhas).
+    Checagem e gravação são atômicas por lote: WATCH nos ids determinísticos, leitura dos status
+    num script e `enqueue_many` dentro do MULTI. Se outro processo criar um desses jobs no meio,
+    a transação aborta e o lote é reavaliado (o documento já enfileirado vira coalescido).
+    """
+    unique_docs = {doc["id"]: doc for doc in docs}
+    ordered = sorted(unique_docs.values(), key=document_priority)
+    if not ordered:
+        return 0, 0, 0
+
+    candidates = [[stage_job_id(JOB_STAGE_TEXT, doc["id"]) + suffix for suffix in ("", *WAIT_SUFFIXES)] for doc in ordered]
+    keys = [Job.key_for(job_id) for job_ids in candidates for job_id in job_ids]
+    active = {status.value for status in ACTIVE_JOB_STATUSES}
+    width = len(WAIT_SUFFIXES) + 1
+    duplicates = len(docs) - len(unique_docs)
+
+    try:
+        with connection.pipeline() as pipe:
+            for _ in range(ENQUEUE_WATCH_RETRIES):
+                try:
+                    pipe.watch(*keys)
+                    raw_statuses = pipe.eval(_JOB_STATUSES_SCRIPT, len(keys), *keys)
+                    per_queue: Dict[str, List[Any]] = {}
+                    stale: List[Job] = []
+                    coalesced = duplicates
+                    for idx, doc in enumerate(ordered):
+                        statuses = [v.decode() if isinstance(v, bytes) else v for v in raw_statuses[idx * width: (idx + 1) * width]]
+                        if any(status in active for status in statuses):
+                            coalesced += 1
+                            continue
+                        if statuses[0] is not None:
+                            # Execução anterior terminada: Job.delete limpa também registros e dependências.
+                            old = _fetch_job(candidates[idx][0], connection)
+                            if old:
+                                stale.append(old)
+                        per_queue.setdefault(text_queue_for(doc), []).append(
+                            Queue.prepare_data(text_stage_job, (doc["id"],), job_id=candidates[idx][0], timeout=TEXT_JOB_TIMEOUT)
+                        )
+
+                    pipe.multi()
+                    for old in stale:
+                        old.delete(pipeline=pipe)
+                    for queue_name, datas in per_queue.items():
+                        Queue(queue_name, connection=connection).enqueue_many(datas, pipeline=pipe)
+                    pipe.execute()
+                    break
+                except WatchError:
+                    increment_counter("enqueue_watch_retries")
+                    continue
+            else:
+                raise RuntimeError(f"Lote em disputa após {ENQUEUE_WATCH_RETRIES} tentativas.")
+    except Exception:
+        to_enqueue = len(ordered)
+        logger.exception("[PIPELINE] Falha ao enfileirar lote de %s documento(s).", to_enqueue)
+        return 0, duplicates, to_enqueue
+
+    if coalesced:
+        increment_counter("enqueue_coalesced", coalesced)
+    return sum(len(datas) for datas in per_queue.values()), coalesced, 0
+
+
+def _enqueue_extraction(document_id: str, connection, resume: bool = False) -> Tuple[Job, bool]:
+    q = Queue(EXTRACTION_QUEUE, connection=connection)
+    return _enqueue_coalesced(
+        q, extraction_stage_job, JOB_STAGE_EXTRACTION, document_id, resume=resume, job_timeout=EXTRACTION_JOB_TIMEOUT
+    )
+
+
+def _enqueue_refinement(document_id: str, connection) -> bool:
+    if not needs_llm_refinement(document_id):
+        return False
+    q = Queue(EXTRACTION_QUEUE, connection=connection)
+    _enqueue_coalesced(q, refine_extraction_job, JOB_STAGE_REFINE, document_id, job_timeout=EXTRACTION_JOB_TIMEOUT)
+    return True
+
+
+def _enqueue_ocr_fanout(document_id: str, pages: List[int], connection, token: Optional[str] = None) -> None:
+    # Páginas vão para a raia rápida (cada uma é barata) e se espalham por todos os workers de texto.
+    q = Queue(TEXT_QUEUE, connection=connection)
+    page_jobs = [
+        q.enqueue(
+            ocr_page_job,
+            document_id,
+            page,
+            token=token,
+            job_timeout=OCR_PAGE_JOB_TIMEOUT,
+            retry=Retry(max=OCR_PAGE_RETRIES, interval=[10, 30, 60]),
+        )
+        for page in pages
+    ]
+    # allow_failure: o join roda mesmo com páginas esgotando as tentativas e registra o erro da etapa.
+    q.enqueue(
+        ocr_join_job,
+        document_id,
+        token=token,
+        depends_on=Dependency(jobs=page_jobs, allow_failure=True),
+        job_timeout=TEXT_JOB_TIMEOUT,
+    )
+
+
+def text_stage_job(document_id: str, attempt: int = 0) -> Dict[str, Any]:
+    lost = None
+    try:
+        # Só a etapa de OCR disputa as vagas; documentos aguardando LLM não bloqueiam.
+        token = uuid.uuid4().hex
+        if not try_acquire_processing_slot(document_id, counted_statuses=[STATUS_PROCESSING_TEXT], token=token):
+            return _wait_for_slot(document_id, text_stage_job, JOB_STAGE_TEXT, attempt, TEXT_JOB_TIMEOUT)
+
+        finish_slot_wait(document_id)
+        job = get_current_job()
+        with _hold_slot(document_id, job.connection if job else None, token=token) as lost:
+            # Fan-out: a vaga passa para os jobs de página (novo token) e só o join a libera;
+            # a liberação deste job, com o token antigo, não a apaga.
+            pages = prepare_ocr_fanout(document_id) if job else []
+            if lost.is_set():
+                return _lease_lost(document_id)
+            if pages:
+                fanout_token = uuid.uuid4().hex
+                if not transfer_processing_slot(document_id, token, fanout_token, lease_s=OCR_FANOUT_LEASE_S):
+                    return _lease_lost(document_id)
+                _enqueue_ocr_fanout(document_id, pages, job.connection, token=fanout_token)
+                return {"ok": True, "message": f"OCR distribuído em {len(pages)} página(s).", "fanout_pages": len(pages)}
+
+            ok, message = run_pipeline_for_document(
+                document_id, stages=[STAGE_TEXT_EXTRACTION], should_abort=lost.is_set, lease_token=token
+            )
+            _confirm_lease(document_id, token, ok, lost)
+        if lost.is_set():
+            return _lease_lost(document_id)
         if not ok:
             update_document_status(document_id, STATUS_ERROR_PROCESSING, error_message=message)
             return {"ok": False, "error": message}
 
+        if job:
+            _enqueue_extraction(document_id, job.connection)
+
         return {"ok": True, "message": message}
     except Exception as exc:
+        if isinstance(exc, LeaseLostError) or (lost is not None and lost.is_set()):
+            return _lease_lost(document_id)
         update_document_status(document_id, STATUS_ERROR_PROCESSING, error_message=str(exc))
         return {
             "ok": False,
             "error": str(exc),
             "trace": traceback.format_exc(),
         }
+
+
+def ocr_page_job(document_id: str, page: int, token: Optional[str] = None) -> Dict[str, Any]:
+    # Renova o lease do fan-out; se o reaper já o recuperou, o documento foi redistribuído e esta página não grava.
+    if token and not heartbeat_processing_slot(document_id, lease_s=OCR_FANOUT_LEASE_S, token=token):
+        return {**_lease_lost(document_id), "page": page}
+    # Sem try/except: a exceção marca o job como falho e o Retry do RQ reexecuta só esta página.
+    ok, message = ocr_pdf_page(document_id, page)
+    return {"ok": ok, "page": page, "message": message}
+
+
+def ocr_join_job(document_id: str, token: Optional[str] = None) -> Dict[str, Any]:
+    lost = None
+    try:
+        job = get_current_job()
+        if token:
+            if not heartbeat_processing_slot(document_id, lease_s=OCR_FANOUT_LEASE_S, token=token):
+                return _lease_lost(document_id)
+            # Fim do fan-out: a vaga que o text_stage_job passou para as páginas é liberada antes da extração.
+            with _hold_slot(document_id, job.connection if job else None, token=token) as lost:
+                ok, message = join_ocr_pages(document_id, lease_token=token)
+            if lost.is_set():
+                return _lease_lost(document_id)
+        else:
+            ok, message = join_ocr_pages(document_id)
+        if not ok:
+            return {"ok": False, "error": message}
+
+        if job:
+            _enqueue_extraction(document_id, job.connection)
+        return {"ok": True, "message": message}
+    except Exception as exc:
+        if isinstance(exc, LeaseLostError) or (lost is not None and lost.is_set()):
+            return _lease_lost(document_id)
+        update_document_status(document_id, STATUS_ERROR_PROCESSING, error_message=str(exc))
+        return {
+            "ok": False,
+            "error": str(exc),
+            "trace": traceback.format_exc(),
+        }
+
+
+def extraction_stage_job(document_id: str) -> Dict[str, Any]:
+    lost = None
+    try:
+        # Lease sem disputa de vaga: só para o reaper recuperar o documento se este worker morrer.
+        token = uuid.uuid4().hex
+        if not acquire_stage_lease(document_id, token=token):
+            return {"ok": True, "message": "Extração já em andamento em outro worker.", "skipped": True}
+        with _hold_slot(document_id, token=token) as lost:
+            ok, message = run_pipeline_for_document(
+                document_id,
+                defer_llm=TWO_PHASE_EXTRACTION,
+                stages=[STAGE_STRUCTURED_EXTRACTION],
+                should_abort=lost.is_set,
+                lease_token=token,
+            )
+            _confirm_lease(document_id, token, ok, lost)
+        if lost.is_set():
+            return _lease_lost(document_id)
+        if not ok:
+            update_document_status(document_id, STATUS_ERROR_PROCESSING, error_message=message)
+            return {"ok": False, "error": message}
+
+        job = get_current_job()
+        refinement_enqueued = _enqueue_refinement(document_id, job.connection) if job else False
+        return {"ok": True, "message": message, "llm_refinement_enqueued": refinement_enqueued}
+    except Exception as exc:
+        if isinstance(exc, LeaseLostError) or (lost is not None and lost.is_set()):
+            return _lease_lost(document_id)
+        update_document_status(document_id, STATUS_ERROR_PROCESSING, error_message=str(exc))
+        return {
+            "ok": False,
+            "error": str(exc),
+            "trace": traceback.format_exc(),
+        }
+
+
+def process_document_job(document_id: str, attempt: int = 0) -> Dict[str, Any]:
+    """Pipeline completa em um único job (fila legada `mn2512`)."""
+    lost = None
+    try:
+        token = uuid.uuid4().hex
+        if not try_acquire_processing_slot(document_id, token=token):
+            return _wait_for_slot(document_id, process_document_job, JOB_STAGE_PROCESS, attempt, 900)
+
+        finish_slot_wait(document_id)
+        job = get_current_job()
+        with _hold_slot(document_id, job.connection if job else None, token=token) as lost:
+            ok, message = run_pipeline_for_document(
+                document_id, defer_llm=TWO_PHASE_EXTRACTION, should_abort=lost.is_set, lease_token=token
+            )
+            _confirm_lease(document_id, token, ok, lost)
+        if lost.is_set():
+            return _lease_lost(document_id)
+        if not ok:
+            update_document_status(document_id, STATUS_ERROR_PROCESSING, error_message=message)
+            return {"ok": False, "error": message}
+
+        refinement_enqueued = _enqueue_refinement(document_id, job.connection) if job else False
+        return {"ok": True, "message": message, "llm_refinement_enqueued": refinement_enqueued}
+    except Exception as exc:
+        if isinstance(exc, LeaseLostError) or (lost is not None and lost.is_set()):
+            return _lease_lost(document_id)
+        update_document_status(document_id, STATUS_ERROR_PROCESSING, error_message=str(exc))
+        return {
+            "ok": False,
+            "error": str(exc),
+            "trace": traceback.format_exc(),
+        }
+
+
+def refine_extraction_job(document_id: str) -> Dict[str, Any]:
+    try:
+        ok, message = refine_extraction_with_llm(document_id)
+        return {"ok": ok, "message": message}
+    except Exception as exc:
+        # A extração provisória continua válida para revisão; só registra a falha.
+        update_document_metrics(document_id, {"llm_refinement": "FAILED", "llm_refinement_error": str(exc)})
+        return {
+            "ok": False,
+            "error": str(exc),
+            "trace": traceback.format_exc(),
+        }
+
+
+def _resume_document(document_id: str, connection) -> None:
+    doc = get_ingest_document(document_id)
+    if doc and doc["status"] == STATUS_TEXT_EXTRACTED:
+        _enqueue_extraction(document_id, connection, resume=True)
+    else:
+        enqueue_document(document_id, connection, doc=doc, resume=True)
+
+
+def _schedule_periodic(connection, func, prefix: str, delay_s: float) -> bool:
+    """Agenda `func` se ainda não houver um job com `prefix` agendado (subida do worker e o próprio job)."""
+    q = Queue(EXTRACTION_QUEUE, connection=connection)
+    if any(job_id.startswith(prefix) for job_id in q.scheduled_job_registry.get_job_ids()):
+        return False
+    q.enqueue_in(timedelta(seconds=delay_s), func, job_id=f"{prefix}{uuid.uuid4().hex}", job_timeout=120)
+    return True
+
+
+def schedule_reaper(connection, delay_s: Optional[int] = None) -> bool:
+    return _schedule_periodic(
+        connection, reap_stuck_documents_job, REAPER_JOB_PREFIX, REAPER_INTERVAL_S if delay_s is None else delay_s
+    )
+
+
+def schedule_concurrency_controller(connection, delay_s: Optional[int] = None) -> bool:
+    return _schedule_periodic(
+        connection,
+        concurrency_controller_job,
+        CONTROLLER_JOB_PREFIX,
+        CONTROLLER_INTERVAL_S if delay_s is None else delay_s,
+    )
+
+
+def reap_stuck_documents_job() -> Dict[str, Any]:
+    job = get_current_job()
+    try:
+        reclaimed = reap_expired_slots()
+        if job:
+            for document_id in reclaimed:
+                _resume_document(document_id, job.connection)
+        return {"ok": True, "reclaimed": reclaimed}
+    except Exception as exc:
+        return {
+            "ok": False,
+            "error": str(exc),
+            "trace": traceback.format_exc(),
+        }
+    finally:
+        if job:
+            schedule_reaper(job.connection)
+
+
+def concurrency_controller_job() -> Dict[str, Any]:
+    job = get_current_job()
+    try:
+        decision = run_concurrency_controller()
+        # Aumento do limite: acorda quem já espera vaga em vez de aguardar o backoff.
+        if job and decision["new_limit"] > decision["previous_limit"]:
+            for _ in range(decision["new_limit"] - decision["previous_limit"]):
+                if not wake_slot_waiter(job.connection):
+                    break
+        return {"ok": True, **decision}
+    except Exception as exc:
+        return {
+            "ok": False,
+            "error": str(exc),
+            "trace": traceback.format_exc(),
+        }
+    finally:
+        if job:
+            schedule_concurrency_controller(job.connection)
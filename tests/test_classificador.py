@@ -0,0 +1,118 @@
+import os
+import tempfile
+import unittest
+
+import localDB
+from classificador import ClassificadorCategorias
+
+EXEMPLOS = {
+    "Alimentação": ["RESTAURANTE SABOR", "PADARIA PAO QUENTE", "IFOOD PEDIDO", "SUPERMERCADO DIA"],
+    "Transporte": ["UBER TRIP", "POSTO SHELL", "ESTACIONAMENTO CENTRO", "METRO RECARGA"],
+    "Serviços": ["NETFLIX COM", "CLARO FATURA", "ENERGIA ENEL", "SPOTIFY PREMIUM"],
+}
+
+
+def _dataset():
+    textos, categorias = [], []
+    for categoria, descricoes in EXEMPLOS.items():
+        for i in range(10):
+            for desc in descricoes:
+                textos.append(f"{desc} {i:03d}")
+                categorias.append(categoria)
+    return textos, categorias
+
+
+class TestClassificadorCategorias(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_fit_predict_and_persist_roundtrip(self):
+        textos, categorias = _dataset()
+        model = ClassificadorCategorias().fit(textos, categorias)
+
+        labels, conf = model.predict(["Padaria Pao Quente 77", "uber trip sp", "netflix.com"])
+        self.assertEqual(labels, ["Alimentação", "Transporte", "Serviços"])
+        self.assertTrue((conf > 0.5).all())
+
+        path = model.save(os.path.join(self.tmpdir.name, "modelo.npz"))
+        loaded = ClassificadorCategorias.load(path)
+        loaded_labels, loaded_conf = loaded.predict(["Padaria Pao Quente 77", "uber trip sp", "netflix.com"])
+        self.assertEqual(loaded_labels, labels)
+        self.assertTrue(abs(loaded_conf - conf).max() < 1e-6)
+
+    def test_predict_handles_empty_batch_and_empty_text(self):
+        textos, categorias = _dataset()
+        model = ClassificadorCategorias().fit(textos, categorias)
+
+        self.assertEqual(model.predict([])[0], [])
+        labels, conf = model.predict([""])
+        self.assertEqual(len(labels), 1)
+        self.assertLess(float(conf[0]), 0.8)
+
+
+class TestCategorizacaoLocal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.old_db = localDB.DB_NAME
+        self.old_ingest = localDB.INGEST_DB_NAME
+        self.old_model = localDB.CATEGORY_MODEL_PATH
+        localDB.DB_NAME = os.path.join(self.tmpdir.name, "dados_test.db")
+        localDB.INGEST_DB_NAME = os.path.join(self.tmpdir.name, "ingest_test.db")
+        localDB.CATEGORY_MODEL_PATH = os.path.join(self.tmpdir.name, "modelo.npz")
+        localDB.init_db()
+        localDB.init_ingest_db()
+
+    def tearDown(self):
+        localDB.DB_NAME = self.old_db
+        localDB.INGEST_DB_NAME = self.old_ingest
+        localDB.CATEGORY_MODEL_PATH = self.old_model
+        self.tmpdir.cleanup()
+
+    def test_train_from_transacoes_and_only_low_confidence_goes_to_llm(self):
+        textos, categorias = _dataset()
+        with localDB.get_conn(localDB.DB_NAME) as conn:
+            conn.executemany(
+                "INSERT INTO transacoes (data, descricao, valor, fonte, categoria, tipo) VALUES (?, ?, ?, ?, ?, ?)",
+                [("2026-01-01", t, 10.0, "teste", c, "saida") for t, c in zip(textos, categorias)],
+            )
+
+        info = localDB.train_category_classifier()
+        self.assertTrue(info["trained"])
+        self.assertTrue(os.path.exists(localDB.CATEGORY_MODEL_PATH))
+
+        sent = {}
+
+        def fake_llm(transacoes, categorias_conhecidas=None):
+            sent["known"] = dict(categorias_conhecidas or {})
+            return transacoes, None
+
+        old_llm = localDB.categorizar_transacoes_llm
+        localDB.categorizar_transacoes_llm = fake_llm
+        try:
+            localDB.categorize_transactions([{"descricao": "UBER TRIP 555"}, {"descricao": ""}])
+        finally:
+            localDB.categorizar_transacoes_llm = old_llm
+
+        self.assertEqual(sent["known"], {0: "Transporte"})
+
+    def test_training_ignores_default_category(self):
+        textos, categorias = _dataset()
+        outros = [f"COMPRA DIVERSA {i:03d}" for i in range(50)]
+        with localDB.get_conn(localDB.DB_NAME) as conn:
+            conn.executemany(
+                "INSERT INTO transacoes (data, descricao, valor, fonte, categoria, tipo) VALUES (?, ?, ?, ?, ?, ?)",
+                [("2026-01-01", t, 10.0, "teste", c, "saida") for t, c in zip(textos, categorias)]
+                + [("2026-01-01", t, 10.0, "teste", localDB.DEFAULT_CATEGORY, "saida") for t in outros],
+            )
+
+        info = localDB.train_category_classifier()
+        self.assertTrue(info["trained"])
+        self.assertEqual(info["examples"], len(textos))
+        self.assertNotIn(localDB.DEFAULT_CATEGORY, info["classes"])
+
+
+if __name__ == "__main__":
+    unittest.main()
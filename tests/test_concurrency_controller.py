@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+
+import localDB
+from concurrency import AimdConfig, ConcurrencySignals, decide_limit
+
+CONFIG = AimdConfig(min_limit=1, max_limit=8)
+
+
+class TestDecideLimit(unittest.TestCase):
+    def test_increases_additively_with_headroom(self):
+        new_limit, action, _ = decide_limit(2, ConcurrencySignals(cpu_util=0.3, mem_used=0.4), CONFIG)
+        self.assertEqual((new_limit, action), (3, "increase"))
+
+    def test_decreases_multiplicatively_under_pressure(self):
+        new_limit, action, reason = decide_limit(6, ConcurrencySignals(cpu_util=0.3, mem_used=0.95), CONFIG)
+        self.assertEqual((new_limit, action), (3, "decrease"))
+        self.assertIn("mem", reason)
+
+        new_limit, action, reason = decide_limit(1, ConcurrencySignals(cpu_util=0.3, mem_used=0.4, llm_429_rate=0.5), CONFIG)
+        self.assertEqual((new_limit, action), (1, "decrease"))
+        self.assertIn("llm_429", reason)
+
+    def test_holds_inside_band_and_at_ceiling(self):
+        self.assertEqual(decide_limit(4, ConcurrencySignals(cpu_util=0.8, mem_used=0.4), CONFIG)[1], "hold")
+        self.assertEqual(decide_limit(8, ConcurrencySignals(cpu_util=0.1, mem_used=0.1), CONFIG)[:2], (8, "hold"))
+        self.assertEqual(decide_limit(4, ConcurrencySignals(), CONFIG)[:2], (4, "hold"))
+
+
+class TestConcurrencyDecisions(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.old_ingest = localDB.INGEST_DB_NAME
+        localDB.INGEST_DB_NAME = os.path.join(self.tmpdir.name, "ingest_test.db")
+        localDB.init_ingest_db()
+
+    def tearDown(self):
+        localDB.INGEST_DB_NAME = self.old_ingest
+        self.tmpdir.cleanup()
+
+    def test_decisions_are_recorded_and_drive_the_slot_limit(self):
+        self.assertEqual(localDB.get_active_docs_limit(), localDB.MAX_ACTIVE_DOCS)
+
+        decision = localDB.run_concurrency_controller(ConcurrencySignals(cpu_util=0.2, mem_used=0.2), CONFIG)
+        self.assertEqual(decision["new_limit"], localDB.MAX_ACTIVE_DOCS + 1)
+        self.assertEqual(localDB.get_active_docs_limit(), localDB.MAX_ACTIVE_DOCS + 1)
+        self.assertEqual(localDB.get_slot_status()["limit"], localDB.MAX_ACTIVE_DOCS + 1)
+
+        localDB.run_concurrency_controller(ConcurrencySignals(cpu_util=0.99, mem_used=0.2), CONFIG)
+        history = localDB.list_concurrency_decisions()
+        self.assertEqual([d["action"] for d in history], ["decrease", "increase"])
+        self.assertIn("cpu", history[0]["reason"])
+        self.assertEqual(localDB.get_active_docs_limit(), history[0]["new_limit"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,4 @@
+import json
 import os
 import tempfile
 import unittest
@@ -37,6 +38,122 @@ class TestConcurrencyLimits(unittest.TestCase):
         self.assertEqual(docs["doc-1"]["status"], localDB.STATUS_PROCESSING_TEXT)
         self.assertEqual(docs["doc-2"]["status"], localDB.STATUS_STORED)
 
+    def test_text_slots_ignore_documents_in_extraction(self):
+        localDB._update_document_fields("doc-1", status=localDB.STATUS_PROCESSING_EXTRACTION)
+
+        ok = localDB.try_acquire_processing_slot(
+            "doc-2", max_active_docs=1, counted_statuses=[localDB.STATUS_PROCESSING_TEXT]
+        )
+        self.assertTrue(ok)
+
+    def test_expired_lease_frees_slot_and_reaper_resumes_document(self):
+        self.assertTrue(localDB.try_acquire_processing_slot("doc-1", max_active_docs=1))
+        with localDB.get_conn(localDB.INGEST_DB_NAME) as conn:
+            conn.execute("UPDATE processing_slots SET expires_at = expires_at - 1000 WHERE document_id = 'doc-1'")
+
+        self.assertEqual(localDB.get_slot_status()["expired"], 1)
+        self.assertTrue(localDB.try_acquire_processing_slot("doc-2", max_active_docs=1))
+
+        self.assertEqual(localDB.reap_expired_slots(), ["doc-1"])
+        docs = {d["id"]: d for d in localDB.list_ingest_documents()}
+        self.assertEqual(docs["doc-1"]["status"], localDB.STATUS_STORED)
+        self.assertFalse(localDB.heartbeat_processing_slot("doc-1"))
+
+        status = localDB.get_slot_status()
+        self.assertEqual(status["active"], 1)
+        self.assertEqual(status["expired"], 0)
+        self.assertEqual(status["reclaimed_total"], 1)
+
+    def test_heartbeat_keeps_lease_and_release_frees_slot(self):
+        self.assertTrue(localDB.try_acquire_processing_slot("doc-1", max_active_docs=1))
+        self.assertTrue(localDB.heartbeat_processing_slot("doc-1"))
+        self.assertEqual(localDB.reap_expired_slots(), [])
+        self.assertFalse(localDB.try_acquire_processing_slot("doc-2", max_active_docs=1))
+
+        localDB.release_processing_slot("doc-1")
+        self.assertTrue(localDB.try_acquire_processing_slot("doc-2", max_active_docs=1))
+
+    def test_stale_token_cannot_renew_or_release_reacquired_lease(self):
+        self.assertTrue(localDB.try_acquire_processing_slot("doc-1", max_active_docs=1, token="antigo"))
+        with localDB.get_conn(localDB.INGEST_DB_NAME) as conn:
+            conn.execute("UPDATE processing_slots SET expires_at = expires_at - 1000 WHERE document_id = 'doc-1'")
+        self.assertEqual(localDB.reap_expired_slots(), ["doc-1"])
+        self.assertTrue(localDB.try_acquire_processing_slot("doc-1", max_active_docs=1, token="novo"))
+
+        self.assertFalse(localDB.heartbeat_processing_slot("doc-1", token="antigo"))
+        localDB.release_processing_slot("doc-1", token="antigo")
+        self.assertEqual(localDB.get_slot_status()["active"], 1)
+        self.assertTrue(localDB.heartbeat_processing_slot("doc-1", token="novo"))
+
+    def test_pipeline_stops_before_writing_when_lease_is_lost(self):
+        ok, message = localDB.run_pipeline_for_document("doc-1", should_abort=lambda: True)
+
+        self.assertFalse(ok)
+        self.assertIn("Lease perdido", message)
+        doc = localDB.get_ingest_document("doc-1")
+        self.assertEqual(doc["status"], localDB.STATUS_STORED)
+        self.assertIsNone(doc["error_message"])
+        self.assertFalse(json.loads(doc["metrics_json"] or "{}"))
+
+    def test_status_write_with_stale_token_is_a_noop(self):
+        self.assertTrue(localDB.try_acquire_processing_slot("doc-1", max_active_docs=1, token="antigo"))
+        with localDB.get_conn(localDB.INGEST_DB_NAME) as conn:
+            conn.execute("UPDATE processing_slots SET expires_at = expires_at - 1000 WHERE document_id = 'doc-1'")
+        self.assertEqual(localDB.reap_expired_slots(), ["doc-1"])
+        self.assertTrue(localDB.try_acquire_processing_slot("doc-1", max_active_docs=1, token="novo"))
+        before = localDB.get_ingest_document("doc-1")["status"]
+
+        # O evento de lease perdido ainda não foi setado (heartbeat atrasado): a transação recusa a gravação.
+        ok, message = localDB.run_pipeline_for_document("doc-1", should_abort=lambda: False, lease_token="antigo")
+
+        self.assertFalse(ok)
+        self.assertIn("Lease perdido", message)
+        doc = localDB.get_ingest_document("doc-1")
+        self.assertEqual(doc["status"], before)
+        self.assertIsNone(doc["error_message"])
+
+        localDB._update_document_fields("doc-1", lease_token="novo", status=localDB.STATUS_TEXT_EXTRACTED)
+        self.assertEqual(localDB.get_ingest_document("doc-1")["status"], localDB.STATUS_TEXT_EXTRACTED)
+
+    def test_extraction_lease_ignores_limit_and_is_reclaimed(self):
+        self.assertTrue(localDB.try_acquire_processing_slot("doc-2", max_active_docs=1))
+        localDB._update_document_fields("doc-1", status=localDB.STATUS_PROCESSING_EXTRACTION)
+
+        self.assertTrue(localDB.acquire_stage_lease("doc-1"))
+        self.assertFalse(localDB.acquire_stage_lease("doc-1"))
+
+        with localDB.get_conn(localDB.INGEST_DB_NAME) as conn:
+            conn.execute("UPDATE processing_slots SET expires_at = expires_at - 1000 WHERE document_id = 'doc-1'")
+        self.assertEqual(localDB.reap_expired_slots(), ["doc-1"])
+        docs = {d["id"]: d for d in localDB.list_ingest_documents()}
+        self.assertEqual(docs["doc-1"]["status"], localDB.STATUS_TEXT_EXTRACTED)
+
+    def test_reaper_resumes_extraction_without_lease(self):
+        localDB._update_document_fields("doc-1", status=localDB.STATUS_PROCESSING_EXTRACTION)
+        self.assertEqual(localDB.reap_expired_slots(), [])
+
+        with localDB.get_conn(localDB.INGEST_DB_NAME) as conn:
+            conn.execute("UPDATE documents SET updated_at = '2020-01-01T00:00:00+00:00' WHERE id = 'doc-1'")
+        self.assertEqual(localDB.reap_expired_slots(), ["doc-1"])
+        docs = {d["id"]: d for d in localDB.list_ingest_documents()}
+        self.assertEqual(docs["doc-1"]["status"], localDB.STATUS_TEXT_EXTRACTED)
+
+    def test_slot_wait_is_measured_from_first_attempt(self):
+        localDB.mark_slot_wait("doc-1")
+        localDB.mark_slot_wait("doc-1")
+        with localDB.get_conn(localDB.INGEST_DB_NAME) as conn:
+            metrics = json.loads(conn.execute("SELECT metrics_json FROM documents WHERE id = 'doc-1'").fetchone()[0])
+        self.assertEqual(metrics["slot_wait_attempts"], 2)
+        localDB.update_document_metrics("doc-1", {"slot_wait_started_at": metrics["slot_wait_started_at"] - 5})
+
+        waited = localDB.finish_slot_wait("doc-1")
+        self.assertGreaterEqual(waited, 5)
+        self.assertEqual(localDB.finish_slot_wait("doc-1"), 0.0)
+
+        status = localDB.get_slot_status()
+        self.assertEqual(status["waits"], 1)
+        self.assertGreaterEqual(status["avg_wait_s"], 5)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -71,6 +71,10 @@ class TestDocumentSummaryFinalize(unittest.TestCase):
         descricoes = set(df_itens["descricao"].tolist())
         self.assertEqual(descricoes, {"Produto A", "Produto B"})
 
+        rollup = localDB.get_monthly_rollup()
+        self.assertEqual(rollup[["month", "fonte", "qtd"]].values.tolist(), [["2026-02", "nota.jpeg", 2]])
+        self.assertAlmostEqual(float(rollup["total"].iloc[0]), 374.96, places=2)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,3 +1,4 @@
+import json
 import os
 import tempfile
 import unittest
@@ -63,6 +64,82 @@ class TestExtractionGating(unittest.TestCase):
         self.assertIsNotNone(result.reason)
         self.assertGreaterEqual(result.metrics.valid_items, 5)
 
+    def test_single_item_receipt_does_not_call_llm(self):
+        calls = {"llm": 0}
+
+        def regex_single(_text):
+            return [{"data": "2026-02-19", "descricao": "Total", "valor": 374.96, "categoria": "Outros", "tipo": "saida"}]
+
+        def llm_never(_text):
+            calls["llm"] += 1
+            return [], "should not be called"
+
+        localDB.extrair_dados_financeiros = regex_single
+        localDB.extrair_dados_financeiros_llm = llm_never
+
+        result = localDB.extract_transactions(text="Comprovante de transferência PIX\nPagador: Ana\nRecebedor: Bia")
+        self.assertEqual(result.doc_type, "comprovante")
+        self.assertEqual(result.method, "regex")
+        self.assertIsNone(result.reason)
+        self.assertEqual(calls["llm"], 0)
+
+    def test_statement_keeps_min_items_threshold(self):
+        def regex_two(_text):
+            return [
+                {"data": "2026-01-01", "descricao": "A", "valor": 1.0, "categoria": "Outros", "tipo": "saida"},
+                {"data": "2026-01-02", "descricao": "B", "valor": 2.0, "categoria": "Outros", "tipo": "saida"},
+            ]
+
+        localDB.extrair_dados_financeiros = regex_two
+        localDB.extrair_dados_financeiros_llm = lambda _text: ([], "sem LLM")
+
+        result = localDB.extract_transactions(text="EXTRATO CONTA CORRENTE\nSaldo anterior 10,00")
+        self.assertEqual(result.doc_type, "statement")
+        self.assertEqual(result.reason, "low_valid_items")
+
+    def test_reconciled_nfce_skips_llm(self):
+        calls = {"llm": 0}
+
+        def llm_never(_text):
+            calls["llm"] += 1
+            return [], "should not be called"
+
+        localDB.extrair_dados_financeiros_llm = llm_never
+        texto = "\n".join(
+            [
+                "DOCUMENTO AUX. DA NOTA FISCAL DE CONSUMIDOR ELETRONICA",
+                "19/02/2026 07:50:34",
+                "1000022036 CONDRES AH C/30 CAPS R$ 234,90",
+                "1 UN De R$ 234,90 por R$ 223,15",
+                "1000007820 PERMEAR C/30 CPR R$ 253,02",
+                "1 UN De R$ 253,02 por R$ 151,81",
+                "Total R$ 374,96",
+            ]
+        )
+
+        result = localDB.extract_transactions(text=texto)
+        self.assertEqual(result.method, "regex")
+        self.assertEqual(result.doc_type, "nfce")
+        self.assertEqual([item["valor"] for item in result.payload], [223.15, 151.81])
+        self.assertEqual(calls["llm"], 0)
+
+    def test_gating_stats_by_doc_type(self):
+        with localDB.get_conn(localDB.INGEST_DB_NAME) as conn:
+            for doc_id, metrics in [
+                ("d1", {"doc_type": "receipt", "llm_requested": False, "extraction_method": "regex"}),
+                ("d2", {"doc_type": "receipt", "llm_requested": True, "extraction_method": "llm"}),
+                ("d3", {"doc_type": "statement", "llm_requested": True, "extraction_method": "regex"}),
+            ]:
+                conn.execute(
+                    "INSERT INTO documents (id, sha256, original_name, mime, size_bytes, storage_uri_raw, status, metrics_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (doc_id, doc_id, "a.pdf", "application/pdf", 1, "raw://a", localDB.STATUS_HITL_REVIEW, json.dumps(metrics)),
+                )
+
+        stats = {row["doc_type"]: row for row in localDB.get_llm_gating_stats()}
+        self.assertEqual(stats["receipt"]["docs"], 2)
+        self.assertAlmostEqual(stats["receipt"]["llm_call_rate"], 0.5)
+        self.assertEqual(stats["receipt"]["llm_used"], 1)
+        self.assertEqual(stats["statement"]["llm_requested"], 1)
 
     def test_llm_cache_roundtrip_by_text_hash(self):
         payload = [{"data": "2026-01-01", "descricao": "Item", "valor": 9.9, "categoria": "Outros", "tipo": "saida"}]
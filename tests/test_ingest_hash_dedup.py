@@ -1,7 +1,10 @@
+import io
 import json
 import os
 import tempfile
+import threading
 import unittest
+from unittest import mock
 
 import localDB
 
@@ -33,6 +36,119 @@ class TestIngestHashDedup(unittest.TestCase):
         self.assertEqual(first["id"], second["id"])
         self.assertEqual(first["raw_hash"], localDB.compute_raw_hash(content))
 
+    def test_store_raw_documents_bulk_dedups_within_batch_and_against_db(self):
+        existing = localDB.store_raw_document("antigo.csv", "text/csv", b"a,b\n1,2\n", storage_root=self.tmpdir.name)
+        files = [
+            ("novo.csv", "text/csv", b"data,valor\n2026-01-01,10\n"),
+            ("antigo-de-novo.csv", "text/csv", b"a,b\n1,2\n"),
+            ("novo-copia.csv", "text/csv", b"data,valor\n2026-01-01,10\n"),
+            ("outro.csv", "text/csv", b"data,valor\n2026-01-02,20\n"),
+        ]
+
+        docs = localDB.store_raw_documents(files, storage_root=self.tmpdir.name, max_workers=4)
+
+        self.assertEqual([d["is_duplicate"] for d in docs], [False, True, True, False])
+        self.assertEqual(docs[1]["id"], existing["id"])
+        self.assertEqual(docs[2]["id"], docs[0]["id"])
+        self.assertEqual([d["original_name"] for d in (docs[0], docs[3])], ["novo.csv", "outro.csv"])
+        self.assertTrue(all(os.path.exists(d["storage_uri_raw"]) for d in docs))
+        self.assertEqual(len(localDB.list_ingest_documents()), 3)
+
+    def test_store_raw_documents_concurrent_import_of_same_file_becomes_duplicate(self):
+        content = b"data,valor\n2026-01-01,10\n"
+        real_new_doc = localDB._new_ingest_doc
+        rival = {}
+
+        def racing_new_doc(*args, **kwargs):
+            # Outra importação do mesmo arquivo grava entre a consulta prévia e o INSERT do lote.
+            if not rival:
+                rival["id"] = None
+                rival.update(localDB.store_raw_stream("rival.csv", "text/csv", content, storage_root=self.tmpdir.name))
+            return real_new_doc(*args, **kwargs)
+
+        files = [("lote.csv", "text/csv", content), ("outro.csv", "text/csv", b"data,valor\n2026-01-02,20\n")]
+        with mock.patch.object(localDB, "_new_ingest_doc", side_effect=racing_new_doc):
+            docs = localDB.store_raw_documents(files, storage_root=self.tmpdir.name, max_workers=2)
+
+        self.assertEqual([d["is_duplicate"] for d in docs], [True, False])
+        self.assertEqual(docs[0]["id"], rival["id"])
+        self.assertEqual(len(localDB.list_ingest_documents()), 2)
+
+    def test_store_raw_documents_discards_spooled_files_when_one_read_fails(self):
+        class Broken(io.RawIOBase):
+            def readable(self):
+                return True
+
+            def read(self, size=-1):
+                raise OSError("falha de leitura")
+
+        files = [("ok.csv", "text/csv", b"a,b\n1,2\n"), ("quebrado.csv", "text/csv", Broken())]
+        with self.assertRaises(OSError):
+            localDB.store_raw_documents(files, storage_root=self.tmpdir.name, max_workers=2)
+
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir.name, "raw", ".tmp")), [])
+        self.assertEqual(localDB.list_ingest_documents(), [])
+
+    def test_store_raw_stream_overwrites_corrupt_leftover_raw(self):
+        content = b"conteudo-certo"
+        sha = localDB.compute_raw_hash(content)
+        leftover = os.path.join(self.tmpdir.name, "raw", sha, "original.pdf")
+        os.makedirs(os.path.dirname(leftover))
+        with open(leftover, "wb") as handler:
+            handler.write(b"sobra-corrompida")
+
+        doc = localDB.store_raw_stream("nota.pdf", "application/pdf", content, storage_root=self.tmpdir.name)
+
+        self.assertEqual(doc["storage_uri_raw"], leftover)
+        with open(leftover, "rb") as handler:
+            self.assertEqual(handler.read(), content)
+        self.assertTrue(localDB.verify_raw_file(leftover, sha))
+
+    def test_store_raw_documents_estimates_cost_outside_the_thread_pool(self):
+        # PyMuPDF não é thread-safe: a estimativa (fitz.open) roda na thread que chamou.
+        threads = []
+        real_estimate = localDB.estimate_processing_cost
+
+        def spy(*args, **kwargs):
+            threads.append(threading.get_ident())
+            return real_estimate(*args, **kwargs)
+
+        files = [(f"doc-{idx}.csv", "text/csv", f"data,valor\n2026-01-0{idx},1\n".encode()) for idx in range(1, 6)]
+        with mock.patch.object(localDB, "estimate_processing_cost", side_effect=spy):
+            localDB.store_raw_documents(files, storage_root=self.tmpdir.name, max_workers=4)
+
+        self.assertEqual(threads, [threading.get_ident()] * len(files))
+
+    def test_store_raw_stream_hashes_while_writing_in_chunks(self):
+        content = os.urandom(300_000)
+        doc = localDB.store_raw_stream("grande.pdf", "application/pdf", io.BytesIO(content), storage_root=self.tmpdir.name, chunk_size=4096)
+
+        self.assertFalse(doc["is_duplicate"])
+        self.assertEqual(doc["sha256"], localDB.compute_raw_hash(content))
+        self.assertEqual(doc["raw_hash"], doc["sha256"])
+        self.assertEqual(doc["size_bytes"], len(content))
+        with open(doc["storage_uri_raw"], "rb") as handler:
+            self.assertEqual(handler.read(), content)
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir.name, "raw", ".tmp")), [])
+
+        again = localDB.store_raw_stream("grande-2.pdf", "application/pdf", io.BytesIO(content), storage_root=self.tmpdir.name)
+        self.assertTrue(again["is_duplicate"])
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir.name, "raw", ".tmp")), [])
+
+    def test_verify_raw_file_uses_cached_hash_until_file_changes(self):
+        doc = localDB.store_raw_document("nota.csv", "text/csv", b"data,valor\n2026-01-01,10\n", storage_root=self.tmpdir.name)
+        path = doc["storage_uri_raw"]
+
+        with mock.patch.object(localDB, "_hash_file", wraps=localDB._hash_file) as hash_file:
+            self.assertTrue(localDB.verify_raw_file(path, doc["sha256"]))
+            self.assertTrue(localDB.verify_raw_file(path, doc["sha256"]))
+            self.assertEqual(hash_file.call_count, 0)
+
+            with open(path, "ab") as handler:
+                handler.write(b"2026-01-02,20\n")
+            self.assertFalse(localDB.verify_raw_file(path, doc["sha256"]))
+            self.assertEqual(hash_file.call_count, 1)
+
     def test_finalize_skips_when_payload_hash_already_finalized(self):
         payload = [
             {"data": "2026-01-01", "descricao": "Item A", "valor": 10.0, "tipo": "saida", "categoria": "Outros"}
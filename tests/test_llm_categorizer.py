@@ -58,6 +58,33 @@ class TestCategorizacaoLLM(unittest.TestCase):
         self.assertEqual(saida, transacoes)
         self.assertIsNotNone(erro)
 
+    def test_categorias_conhecidas_nao_vao_ao_llm(self):
+        transacoes = [
+            {"data": "2026-01-12", "valor": 85.90, "descricao": "Almoco Restaurante"},
+            {"data": "2026-01-13", "valor": 29.00, "descricao": "Uber Centro"},
+        ]
+        resposta_mock = {"choices": [{"message": {"content": '[{"index": 0, "categoria": "Transporte"}]'}}]}
+
+        with patch("llm_extractor._post_chat_completion", return_value=resposta_mock) as post, patch.dict(
+            "os.environ", {"OPENAI_API_KEY": "test-key"}, clear=False
+        ):
+            saida, erro = categorizar_transacoes_llm(transacoes, categorias_conhecidas={0: "Alimentação"})
+
+        self.assertIsNone(erro)
+        enviado = post.call_args[0][2]["messages"][1]["content"]
+        self.assertNotIn("Almoco Restaurante", enviado)
+        self.assertEqual(saida[0]["categoria"], "Alimentação")
+        self.assertEqual(saida[1]["categoria"], "Transporte")
+
+    def test_todas_conhecidas_dispensam_chave_api(self):
+        transacoes = [{"data": "2026-01-12", "valor": 10.0, "descricao": "Conta"}]
+
+        with patch.dict("os.environ", {}, clear=True):
+            saida, erro = categorizar_transacoes_llm(transacoes, categorias_conhecidas={0: "Serviços"})
+
+        self.assertIsNone(erro)
+        self.assertEqual(saida[0]["categoria"], "Serviços")
+
 
 if __name__ == "__main__":
     unittest.main()
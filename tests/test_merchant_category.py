@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import localDB
+
+
+class TestMerchantCategoryMemo(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.old_db = localDB.DB_NAME
+        self.old_ingest = localDB.INGEST_DB_NAME
+        localDB.DB_NAME = os.path.join(self.tmpdir.name, "dados_test.db")
+        localDB.INGEST_DB_NAME = os.path.join(self.tmpdir.name, "ingest_test.db")
+        localDB.init_db()
+        localDB.init_ingest_db()
+
+        with localDB.get_conn(localDB.INGEST_DB_NAME) as conn:
+            conn.execute(
+                "INSERT INTO documents (id, sha256, original_name, mime, size_bytes, storage_uri_raw, status) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ("doc-1", "sha-1", "a.pdf", "application/pdf", 10, "raw://a", localDB.STATUS_STORED),
+            )
+
+    def tearDown(self):
+        localDB.DB_NAME = self.old_db
+        localDB.INGEST_DB_NAME = self.old_ingest
+        self.tmpdir.cleanup()
+
+    def test_merchant_key_ignores_digits_installments_and_accents(self):
+        self.assertEqual(localDB.merchant_key("Padaria São João 03/10"), "PADARIA SAO JOAO")
+        self.assertEqual(localDB.merchant_key("UBER *TRIP 1234"), localDB.merchant_key("Uber trip 98"))
+        self.assertEqual(localDB.merchant_key("x", merchant="Posto Shell"), "POSTO SHELL")
+
+    def test_learns_from_review_and_skips_default_and_summary(self):
+        learned = localDB.learn_merchant_categories(
+            [
+                {"descricao": "UBER TRIP 123", "categoria": "Transporte"},
+                {"descricao": "Compra qualquer", "categoria": "Outros"},
+                {"descricao": "Total", "categoria": "Alimentação"},
+            ]
+        )
+        self.assertEqual(learned, 1)
+
+        resolved = localDB.lookup_merchant_categories(
+            [{"descricao": "Uber Trip 987"}, {"descricao": "Loja desconhecida"}],
+            document_id="doc-1",
+        )
+        self.assertEqual(resolved, {0: "Transporte"})
+
+        stats = localDB.get_merchant_category_stats()
+        self.assertEqual(stats["entries"], 1)
+        self.assertEqual(stats["lookups"], 2)
+        self.assertEqual(stats["hits"], 1)
+        self.assertAlmostEqual(stats["hit_rate"], 0.5)
+
+    def test_single_vote_does_not_overwrite_the_leading_category(self):
+        def learn(categoria, times=1):
+            for _ in range(times):
+                localDB.learn_merchant_categories([{"descricao": "MERCADO CENTRAL", "categoria": categoria}])
+
+        def lookup():
+            return localDB.lookup_merchant_categories([{"descricao": "Mercado Central 44"}])
+
+        learn("Alimentação", 3)
+        learn("Casa")
+        self.assertEqual(lookup(), {0: "Alimentação"})
+
+        # Empate não troca; a nova categoria só assume quando passa a liderar.
+        learn("Casa", 2)
+        self.assertEqual(lookup(), {0: "Alimentação"})
+        learn("Casa")
+        self.assertEqual(lookup(), {0: "Casa"})
+
+        with localDB.get_conn(localDB.INGEST_DB_NAME) as conn:
+            votes = dict(conn.execute("SELECT categoria, votes FROM merchant_category_votes").fetchall())
+            memo = conn.execute("SELECT categoria, votes FROM merchant_category").fetchone()
+        self.assertEqual(votes, {"Alimentação": 3, "Casa": 4})
+        self.assertEqual(tuple(memo), ("Casa", 4))
+
+    def test_categorize_only_sends_misses_to_llm(self):
+        localDB.learn_merchant_categories([{"descricao": "Restaurante Bom Prato", "categoria": "Alimentação"}])
+        sent = {}
+
+        def fake_llm(transacoes, categorias_conhecidas=None):
+            sent["known"] = dict(categorias_conhecidas or {})
+            return transacoes, None
+
+        with patch.object(localDB, "categorizar_transacoes_llm", fake_llm):
+            localDB.categorize_transactions(
+                [{"descricao": "RESTAURANTE BOM PRATO 12"}, {"descricao": "Farmacia"}]
+            )
+
+        self.assertEqual(sent["known"], {0: "Alimentação"})
+
+    def test_rebuild_from_finalized_transactions_uses_majority(self):
+        with localDB.get_conn(localDB.DB_NAME) as conn:
+            conn.executemany(
+                "INSERT INTO transacoes (data, descricao, valor, fonte, categoria, tipo) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    ("2026-01-01", "POSTO IPIRANGA 1", 100.0, "a", "Transporte", "saida"),
+                    ("2026-01-02", "POSTO IPIRANGA 2", 90.0, "a", "Transporte", "saida"),
+                    ("2026-01-03", "POSTO IPIRANGA 3", 15.0, "a", "Alimentação", "saida"),
+                ],
+            )
+
+        self.assertEqual(localDB.rebuild_merchant_categories_from_transactions(), 1)
+        self.assertEqual(localDB.lookup_merchant_categories([{"descricao": "Posto Ipiranga"}]), {0: "Transporte"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+import localDB
+
+
+def _tx(data, descricao, valor, categoria="Mercado", tipo="saida", fonte="extrato.csv"):
+    return {"data": data, "descricao": descricao, "valor": valor, "fonte": fonte, "categoria": categoria, "tipo": tipo}
+
+
+class TestMonthlyRollup(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.old_db = localDB.DB_NAME
+        localDB.DB_NAME = os.path.join(self.tmpdir.name, "dados_test.db")
+        localDB.init_db()
+
+    def tearDown(self):
+        localDB.DB_NAME = self.old_db
+        self.tmpdir.cleanup()
+
+    def _rollup_rows(self):
+        with localDB.get_conn(localDB.DB_NAME) as conn:
+            return [tuple(r) for r in conn.execute("SELECT month, tipo, categoria, fonte, ROUND(total, 2), qtd FROM monthly_rollup ORDER BY 1, 2, 3, 4")]
+
+    def test_incremental_updates_skip_ignored_duplicates(self):
+        localDB.insert_transactions(pd.DataFrame([
+            _tx("2026-01-05", "Padaria", 10.0),
+            _tx("2026-01-20", "Feira", 30.0),
+            _tx("2026-02-01", "Salário", 1000.0, categoria="Salário", tipo="entrada"),
+        ]))
+        # A primeira linha repete uma já gravada e não pode somar de novo.
+        localDB.insert_transactions(pd.DataFrame([_tx("2026-01-05", "Padaria", 10.0), _tx("2026-01-28", "Açougue", 5.5)]))
+
+        self.assertEqual(
+            self._rollup_rows(),
+            [
+                ("2026-01", "saida", "Mercado", "extrato.csv", 45.5, 3),
+                ("2026-02", "entrada", "Salário", "extrato.csv", 1000.0, 1),
+            ],
+        )
+
+        incremental = self._rollup_rows()
+        self.assertEqual(localDB.rebuild_monthly_rollup(), 2)
+        self.assertEqual(self._rollup_rows(), incremental)
+
+    def test_query_filters_and_regroups(self):
+        localDB.insert_transactions(pd.DataFrame([
+            _tx("2026-01-05", "Padaria", 10.0),
+            _tx("2026-01-06", "Uber", 20.0, categoria="Transporte"),
+            _tx("2026-02-06", "Uber", 25.0, categoria="Transporte", fonte="fatura.ofx"),
+            _tx("2026-03-06", "Uber", 40.0, categoria="Transporte"),
+        ]))
+
+        by_month = localDB.get_monthly_rollup("2026-01", "2026-02", tipo="saida", group_by=["month"])
+        self.assertEqual(by_month.values.tolist(), [["2026-01", 30.0, 2], ["2026-02", 25.0, 1]])
+
+        transporte = localDB.get_monthly_rollup(categoria="Transporte", group_by=[])
+        self.assertEqual(transporte[["total", "qtd"]].values.tolist(), [[85.0, 3]])
+        self.assertTrue(localDB.get_monthly_rollup(categoria="Lazer", group_by=[]).empty)
+
+    def test_init_db_populates_rollup_for_existing_history(self):
+        localDB.insert_transactions(pd.DataFrame([_tx("2026-01-05", "Padaria", 10.0)]))
+        with localDB.get_conn(localDB.DB_NAME) as conn:
+            conn.execute("DROP TABLE monthly_rollup;")
+
+        localDB.init_db()
+
+        self.assertEqual(self._rollup_rows(), [("2026-01", "saida", "Mercado", "extrato.csv", 10.0, 1)])
@@ -0,0 +1,73 @@
+from parsers.nfce_parser import parse_nfce
+
+NOTA_DUAS_LINHAS = """
+DOCUMENTO AUX. DA NOTA FISCAL DE CONSUMIDOR ELETRÔNICA
+19/02/2026 07:50:34
+1000022036 CONDRES AH C/30 CAPS 157,740MG        R$ 234,90
+1 UN De R$ 234,90 por R$ 223,15
+Valor Liquido                                   R$ 223,15
+1000007820 PERMEAR C/30 CPR REV GAST 300MG      R$ 253,02
+1 UN De R$ 253,02 por R$ 151,81
+Valor Liquido                                   R$ 151,81
+Total                                           R$ 374,96
+Forma Pagamento CARTÃO DE CRÉDITO               R$ 374,96
+"""
+
+NOTA_LINHA_UNICA = """
+NFC-e nº 000123 Série 001 05/03/2026 18:02:11
+001 7891234567890 ARROZ TIPO 1 5KG 2 UN X 25,90 51,80
+002 7899876543210 FEIJAO CARIOCA 1KG 1 UN X 8,49 8,49
+003 2000000001234 BANANA PRATA 1,250 KG X 6,99 8,74
+Qtd. total de itens 3
+Valor total R$ 69,03
+Descontos R$ 1,00
+Valor a pagar R$ 68,03
+"""
+
+
+def test_parse_two_line_layout_reconciles_with_declared_total():
+    nota = parse_nfce(NOTA_DUAS_LINHAS)
+
+    assert nota is not None
+    assert nota.data == "2026-02-19"
+    assert [item.valor_total for item in nota.itens] == [223.15, 151.81]
+    assert nota.itens[0].codigo == "1000022036"
+    assert nota.itens[0].valor_unitario == 234.90
+    assert nota.total_declarado == 374.96
+    assert nota.reconciled
+
+
+def test_parse_single_line_layout_with_discount():
+    nota = parse_nfce(NOTA_LINHA_UNICA)
+
+    assert nota is not None
+    assert [item.descricao for item in nota.itens] == ["ARROZ TIPO 1 5KG", "FEIJAO CARIOCA 1KG", "BANANA PRATA"]
+    assert nota.itens[2].quantidade == 1.25
+    assert nota.itens[2].unidade == "KG"
+    assert nota.total_declarado == 68.03
+    assert nota.reconciled
+    assert nota.to_transactions()[0]["tipo"] == "saida"
+
+
+def test_footer_discount_is_prorated_so_transactions_sum_to_amount_paid():
+    nota = parse_nfce(NOTA_LINHA_UNICA)
+
+    valores = [t["valor"] for t in nota.to_transactions()]
+    assert valores == [51.05, 8.37, 8.61]
+    assert round(sum(valores), 2) == nota.total_declarado == 68.03
+
+
+def test_discount_already_in_item_values_is_not_applied_twice():
+    nota = parse_nfce(NOTA_DUAS_LINHAS.replace("Total ", "Descontos R$ 112,96\nTotal "))
+
+    assert nota.descontos == 112.96
+    assert nota.reconciled
+    assert [t["valor"] for t in nota.to_transactions()] == [223.15, 151.81]
+
+
+def test_mismatched_total_is_not_reconciled_and_non_receipt_is_ignored():
+    nota = parse_nfce(NOTA_DUAS_LINHAS.replace("374,96", "400,00"))
+    assert nota is not None
+    assert not nota.reconciled
+
+    assert parse_nfce("EXTRATO CONTA CORRENTE\n01/01/2026 PIX 10,00") is None
@@ -0,0 +1,136 @@
+import io
+import os
+import tempfile
+import unittest
+
+import fitz
+from PIL import Image
+
+import localDB
+import tasks
+
+
+def _scanned_pdf_bytes(pages):
+    pdf = fitz.open()
+    for _ in range(pages):
+        page = pdf.new_page(width=200, height=200)
+        buf = io.BytesIO()
+        Image.new("RGB", (100, 100), color=(255, 255, 255)).save(buf, format="PNG")
+        page.insert_image(fitz.Rect(10, 10, 110, 110), stream=buf.getvalue())
+    return pdf.tobytes()
+
+
+class TestOcrFanout(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.old_db = localDB.DB_NAME
+        self.old_ingest = localDB.INGEST_DB_NAME
+        localDB.DB_NAME = os.path.join(self.tmpdir.name, "dados_test.db")
+        localDB.INGEST_DB_NAME = os.path.join(self.tmpdir.name, "ingest_test.db")
+        localDB.init_db()
+        localDB.init_ingest_db()
+
+        self.old_ocr = localDB.extrair_texto_imagem
+        self.pages_seen = []
+
+        def fake_ocr(_upload):
+            page = len(self.pages_seen) + 1
+            self.pages_seen.append(page)
+            return f"texto {page}", 0.01, None
+
+        localDB.extrair_texto_imagem = fake_ocr
+        self.doc = localDB.store_raw_document("scan.pdf", "application/pdf", _scanned_pdf_bytes(3), storage_root=self.tmpdir.name)
+
+    def tearDown(self):
+        localDB.extrair_texto_imagem = self.old_ocr
+        localDB.DB_NAME = self.old_db
+        localDB.INGEST_DB_NAME = self.old_ingest
+        self.tmpdir.cleanup()
+
+    def _metrics(self):
+        return localDB._load_document_metrics(self.doc["id"])
+
+    def test_pages_retry_independently_and_join_in_page_order(self):
+        doc_id = self.doc["id"]
+        self.assertEqual(localDB.prepare_ocr_fanout(doc_id, min_pages=10), [])
+        self.assertEqual(localDB.prepare_ocr_fanout(doc_id, min_pages=2), [1, 2, 3])
+        self.assertEqual(self._metrics()["ocr_pages_total"], 3)
+
+        def flaky_ocr(_upload):
+            raise RuntimeError("ocr indisponível")
+
+        localDB.ocr_pdf_page(doc_id, 3)
+        good_ocr = localDB.extrair_texto_imagem
+        localDB.extrair_texto_imagem = flaky_ocr
+        with self.assertRaises(RuntimeError):
+            localDB.ocr_pdf_page(doc_id, 1)
+        localDB.extrair_texto_imagem = good_ocr
+        self.assertEqual(localDB.get_ocr_pages_progress(doc_id)["failed"], 1)
+
+        localDB.ocr_pdf_page(doc_id, 1)
+        localDB.ocr_pdf_page(doc_id, 2)
+        self.assertEqual(self._metrics()["ocr_pages_done"], 3)
+
+        ok, _ = localDB.join_ocr_pages(doc_id)
+        self.assertTrue(ok)
+        current = localDB.get_ingest_document(doc_id)
+        self.assertEqual(current["status"], localDB.STATUS_TEXT_EXTRACTED)
+        with open(current["text_uri"], "r", encoding="utf-8") as handler:
+            # O fake numera as chamadas (página 3 foi a primeira); o texto sai na ordem das páginas.
+            self.assertEqual(handler.read().splitlines(), ["texto 2", "texto 3", "texto 1"])
+
+    def test_join_with_missing_pages_marks_text_stage_error_and_resumes(self):
+        doc_id = self.doc["id"]
+        localDB.prepare_ocr_fanout(doc_id, min_pages=2)
+        localDB.ocr_pdf_page(doc_id, 1)
+
+        ok, message = localDB.join_ocr_pages(doc_id)
+        self.assertFalse(ok)
+        self.assertIn("1/3", message)
+        current = localDB.get_ingest_document(doc_id)
+        self.assertEqual(current["status"], localDB.STATUS_ERROR_PROCESSING)
+        self.assertEqual(current["failed_stage"], localDB.STAGE_TEXT_EXTRACTION)
+
+        self.assertEqual(localDB.prepare_ocr_fanout(doc_id, min_pages=2), [2, 3])
+
+    def test_fanout_inspects_raw_without_cost_estimate(self):
+        doc_id = self.doc["id"]
+        with localDB.get_conn(localDB.INGEST_DB_NAME) as conn:
+            conn.execute("UPDATE documents SET metrics_json = NULL WHERE id = ?", (doc_id,))
+
+        self.assertEqual(localDB.prepare_ocr_fanout(doc_id, min_pages=2), [1, 2, 3])
+
+    def test_fanout_keeps_slot_until_join(self):
+        doc_id = self.doc["id"]
+        self.assertTrue(localDB.try_acquire_processing_slot(doc_id, max_active_docs=1, token="texto"))
+        localDB.prepare_ocr_fanout(doc_id, min_pages=2)
+        self.assertTrue(localDB.transfer_processing_slot(doc_id, "texto", "fanout", lease_s=localDB.OCR_FANOUT_LEASE_S))
+        # A liberação do text_stage_job (token antigo) não devolve a vaga.
+        localDB.release_processing_slot(doc_id, token="texto")
+        self.assertEqual(localDB.get_slot_status()["active"], 1)
+
+        stale = tasks.ocr_page_job(doc_id, 1, token="texto")
+        self.assertTrue(stale["lease_lost"])
+        self.assertEqual(self.pages_seen, [])
+
+        for page in (1, 2, 3):
+            self.assertTrue(tasks.ocr_page_job(doc_id, page, token="fanout")["ok"])
+        result = tasks.ocr_join_job(doc_id, token="fanout")
+        self.assertTrue(result["ok"])
+        self.assertEqual(localDB.get_ingest_document(doc_id)["status"], localDB.STATUS_TEXT_EXTRACTED)
+        self.assertEqual(localDB.get_slot_status()["active"], 0)
+
+    def test_reaper_resumes_fanout_without_lease(self):
+        doc_id = self.doc["id"]
+        localDB.prepare_ocr_fanout(doc_id, min_pages=2)
+        self.assertEqual(localDB.reap_expired_slots(), [])
+
+        with localDB.get_conn(localDB.INGEST_DB_NAME) as conn:
+            conn.execute("UPDATE documents SET updated_at = '2000-01-01T00:00:00+00:00' WHERE id = ?", (doc_id,))
+        self.assertEqual(localDB.reap_expired_slots(), [doc_id])
+        self.assertEqual(localDB.get_ingest_document(doc_id)["status"], localDB.STATUS_STORED)
+        self.assertEqual(localDB.prepare_ocr_fanout(doc_id, min_pages=2), [1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,6 @@
-from parsers.ofx_parser import build_hash_linha, parse_ofx_bytes
+import io
+
+from parsers.ofx_parser import build_hash_linha, build_hash_linhas, iter_ofx_lines, parse_ofx_bytes
 
 
 def test_parse_ofx_fallback_blocks():
@@ -41,3 +43,41 @@ def test_hash_linha_consistente():
     h1 = build_hash_linha("2026-01", line)
     h2 = build_hash_linha("2026-01", line)
     assert h1 == h2
+
+
+def test_streaming_independe_do_tamanho_do_bloco():
+    blocos = "".join(
+        f"<STMTTRN>\n<DTPOSTED>202601{d:02d}120000[-3:BRT]\n<TRNAMT>-{d}.50\n<NAME>LOJA {d}\n<MEMO>PARC {d} DE 12\n</STMTTRN>\n"
+        for d in range(1, 21)
+    )
+    content = ("OFXHEADER:100\nCHARSET:1252\n\n<OFX><BANKTRANLIST>\n" + blocos + "</BANKTRANLIST></OFX>").encode("cp1252")
+
+    esperado = parse_ofx_bytes(content)
+    assert len(esperado) == 20
+    assert (esperado[4].parcela_atual, esperado[4].parcela_total, esperado[4].merchant) == (5, 12, "LOJA 5")
+
+    for chunk_size in (5, 17, 64):
+        assert list(iter_ofx_lines(io.BytesIO(content), chunk_size=chunk_size)) == esperado
+
+
+def test_ofx_xml_utf8():
+    content = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<OFX><STMTTRN><DTPOSTED>20260131</DTPOSTED>'
+        "<TRNAMT>1200,00</TRNAMT><PAYEE>SALÁRIO</PAYEE></STMTTRN></OFX>"
+    ).encode("utf-8")
+
+    (line,) = parse_ofx_bytes(content)
+
+    assert (line.data, line.valor, line.descricao) == ("2026-01-31", 1200.0, "SALÁRIO")
+
+
+def test_hash_utf8_igual_ao_da_decodificacao_legada():
+    # Linhas já gravadas de OFX UTF-8 tiveram o hash calculado sobre o texto lido como latin-1.
+    corpo = "<STMTTRN><DTPOSTED>20260110<TRNAMT>-35.90<MEMO>PADARIA SÃO JOÃO</MEMO></STMTTRN>".encode("utf-8")
+    (legada,) = parse_ofx_bytes(corpo)
+    (line,) = parse_ofx_bytes(b"OFXHEADER:100\nENCODING:UTF-8\n\n" + corpo)
+
+    assert line.descricao == "PADARIA SÃO JOÃO"
+    assert legada.descricao != line.descricao
+    assert build_hash_linha("2026-01", line) == build_hash_linha("2026-01", legada)
+    assert build_hash_linhas("2026-01", [line]) == [build_hash_linha("2026-01", legada)]
@@ -1,8 +1,10 @@
 import io
+import json
 import os
 import tempfile
 import unittest
 
+import pandas as pd
 from PIL import Image
 
 import localDB
@@ -72,6 +74,119 @@ class TestPipelineCheckpoint(unittest.TestCase):
         self.assertEqual(self.calls["ocr"], ocr_calls)
         self.assertEqual(self.calls["extract"], extract_calls)
 
+    def test_raw_upload_maps_file_without_copy(self):
+        path = os.path.join(self.tmpdir.name, "raw.bin")
+        with open(path, "wb") as handler:
+            handler.write(b"0123456789")
+
+        upload = localDB.RawUpload(path, "raw.bin", "application/octet-stream")
+        self.assertEqual(upload.read(4), b"0123")
+        upload.seek(-2, io.SEEK_END)
+        self.assertEqual(upload.read(), b"89")
+        view = upload.getbuffer()
+        self.assertEqual(bytes(view[2:5]), b"234")
+        view.release()
+        upload.close()
+
+        empty = os.path.join(self.tmpdir.name, "vazio.bin")
+        open(empty, "wb").close()
+        with localDB.RawUpload(empty, "vazio.bin", "application/octet-stream") as upload:
+            self.assertEqual(upload.read(), b"")
+
+    def test_pipeline_records_rss_by_stage(self):
+        doc = localDB.store_raw_document("nota5.png", "image/png", self._make_png_bytes(), storage_root=self.tmpdir.name)
+        ok, _ = localDB.run_pipeline_for_document(doc["id"], stages=[localDB.STAGE_TEXT_EXTRACTION])
+        self.assertTrue(ok)
+        ok, _ = localDB.run_pipeline_for_document(doc["id"], stages=[localDB.STAGE_STRUCTURED_EXTRACTION])
+        self.assertTrue(ok)
+
+        stats = {row["stage"]: row for row in localDB.get_memory_stats_by_doc_type()}
+        self.assertEqual(set(stats), {"text", "extraction"})
+        self.assertEqual(stats["text"]["doc_type"], ".png")
+        self.assertGreater(stats["text"]["max_rss_peak_mb"], 0)
+
+    def test_rss_peak_is_reset_per_stage(self):
+        if not localDB._reset_peak_rss():
+            self.skipTest("sem /proc/self/clear_refs")
+        ballast = b"x" * (256 * 1024 * 1024)
+        del ballast
+
+        doc = localDB.store_raw_document("nota6.png", "image/png", self._make_png_bytes(), storage_root=self.tmpdir.name)
+        ok, _ = localDB.run_pipeline_for_document(doc["id"], stages=[localDB.STAGE_TEXT_EXTRACTION])
+        self.assertTrue(ok)
+
+        metrics = json.loads(localDB.get_ingest_document(doc["id"])["metrics_json"])
+        # O pico de 256 MB anterior à etapa não entra na métrica do documento.
+        self.assertLess(metrics["text_rss_peak_mb"] - metrics["text_rss_start_mb"], 200)
+
+    def test_spreadsheet_is_parsed_once_across_stages(self):
+        parsed = []
+        original = localDB.processar_planilha
+
+        def counting_parse(upload, *args):
+            parsed.append(upload.name)
+            return original(upload, *args)
+
+        localDB.processar_planilha = counting_parse
+        self.addCleanup(setattr, localDB, "processar_planilha", original)
+
+        extracted = []
+
+        def capture_extract(text=None, df=None):
+            extracted.append(df)
+            payload = [{"data": "2026-01-01", "descricao": "Mercado", "valor": 10.0, "categoria": "Outros", "tipo": "saida"}]
+            return localDB.ExtractionResult(method="regex", payload=payload, metrics=localDB._compute_extraction_metrics(payload), reason=None)
+
+        localDB.extract_transactions = capture_extract
+        csv_bytes = "data;descricao;valor\n01/01/2026;Mercado;-10,00\n02/01/2026;Salario;1000,00\n".encode("utf-8")
+        doc = localDB.store_raw_document("extrato.csv", "text/csv", csv_bytes, storage_root=self.tmpdir.name)
+
+        ok, _ = localDB.run_pipeline_for_document(doc["id"], stages=[localDB.STAGE_TEXT_EXTRACTION])
+        self.assertTrue(ok)
+        ok, _ = localDB.run_pipeline_for_document(doc["id"], stages=[localDB.STAGE_STRUCTURED_EXTRACTION])
+        self.assertTrue(ok)
+        self.assertEqual(parsed, ["extrato.csv"])
+
+        raw = io.BytesIO(csv_bytes)
+        raw.name = "extrato.csv"
+        expected, _ = original(raw)
+        pd.testing.assert_frame_equal(extracted[0], expected.reset_index(drop=True))
+
+        localDB.reset_document_to_stage(doc["id"], localDB.STATUS_TEXT_EXTRACTED)
+        localDB._update_document_fields(doc["id"], extraction_uri=None)
+        ok, _ = localDB.run_pipeline_for_document(doc["id"])
+        self.assertTrue(ok)
+        self.assertEqual(parsed, ["extrato.csv"])
+
+    def test_unreadable_table_artifact_falls_back_to_parsing(self):
+        parsed = []
+        original = localDB.processar_planilha
+
+        def counting_parse(upload, *args):
+            parsed.append(upload.name)
+            return original(upload, *args)
+
+        localDB.processar_planilha = counting_parse
+        self.addCleanup(setattr, localDB, "processar_planilha", original)
+        csv_bytes = "data;descricao;valor\n03/01/2026;Padaria;-7,50\n".encode("utf-8")
+        doc = localDB.store_raw_document("padaria.csv", "text/csv", csv_bytes, storage_root=self.tmpdir.name)
+
+        ok, _ = localDB.run_pipeline_for_document(doc["id"], stages=[localDB.STAGE_TEXT_EXTRACTION])
+        self.assertTrue(ok)
+        folder = os.path.join("data", "artifacts", doc["sha256"])
+        (path,) = [
+            os.path.join(folder, rel) for rel in localDB.TABLE_ARTIFACT_PATHS if os.path.exists(os.path.join(folder, rel))
+        ]
+        self.assertIn(f"v{localDB.TABLE_ARTIFACT_VERSION}", path)
+        self.assertFalse([name for name in os.listdir(os.path.dirname(path)) if name.endswith(".part")])
+        with open(path, "wb") as handler:
+            handler.write(b"truncado")
+
+        ok, _ = localDB.run_pipeline_for_document(doc["id"], stages=[localDB.STAGE_STRUCTURED_EXTRACTION])
+        self.assertTrue(ok)
+        self.assertEqual(parsed, ["padaria.csv", "padaria.csv"])
+        self.assertEqual(len(localDB._load_table_artifact(doc["sha256"])), 1)
+
     def test_resume_from_text_extracted_skips_ocr(self):
         doc = localDB.store_raw_document("nota2.png", "image/png", self._make_png_bytes(), storage_root=self.tmpdir.name)
         ok1, _ = localDB.run_pipeline_for_document(doc["id"])
@@ -84,6 +199,26 @@ class TestPipelineCheckpoint(unittest.TestCase):
         self.assertTrue(ok2)
         self.assertEqual(self.calls["ocr"], before)
 
+    def test_stage_split_runs_text_then_extraction(self):
+        doc = localDB.store_raw_document("nota4.png", "image/png", self._make_png_bytes(), storage_root=self.tmpdir.name)
+
+        ok, _ = localDB.run_pipeline_for_document(doc["id"], stages=[localDB.STAGE_STRUCTURED_EXTRACTION])
+        self.assertFalse(ok)
+        self.assertEqual(self.calls["ocr"], 0)
+
+        ok, _ = localDB.run_pipeline_for_document(doc["id"], stages=[localDB.STAGE_TEXT_EXTRACTION])
+        self.assertTrue(ok)
+        current = {d["id"]: d for d in localDB.list_ingest_documents()}[doc["id"]]
+        self.assertEqual(current["status"], localDB.STATUS_TEXT_EXTRACTED)
+        self.assertEqual(self.calls["extract"], 0)
+
+        ok, _ = localDB.run_pipeline_for_document(doc["id"], stages=[localDB.STAGE_STRUCTURED_EXTRACTION])
+        self.assertTrue(ok)
+        current = {d["id"]: d for d in localDB.list_ingest_documents()}[doc["id"]]
+        self.assertEqual(current["status"], localDB.STATUS_HITL_REVIEW)
+        self.assertEqual(self.calls["ocr"], 1)
+        self.assertEqual(self.calls["extract"], 1)
+
     def test_error_records_failed_stage(self):
         def bad_extract(text=None, df=None):
             raise RuntimeError("falha proposital")
@@ -1,6 +1,14 @@
 import io
+import os
+import tempfile
+import unittest
+from unittest import mock
 
-from planilhas import processar_planilha
+import pandas as pd
+
+import localDB
+import planilhas
+from planilhas import iterar_planilha, processar_planilha
 
 
 class UploadStub(io.BytesIO):
@@ -36,3 +44,213 @@ def test_processar_planilha_debito_credito_builds_tipo():
     assert err is None
     assert list(df["tipo"]) == ["saida", "entrada"]
     assert list(df["valor"]) == [100.0, 30.0]
+
+
+def test_processar_planilha_debito_numerico_nao_multiplica():
+    content = "data,historico,debito,credito\n01/02/2026,Compra,100,\n02/02/2026,Estorno,,30.5\n"
+    file = UploadStub(content.encode("utf-8"), "fatura.csv")
+
+    df, err = processar_planilha(file)
+
+    assert err is None
+    assert list(df["valor"]) == [100.0, 30.5]
+
+
+def test_iterar_planilha_blocos_equivalem_ao_arquivo_inteiro():
+    linhas = "".join(f"{d:02d}/01/2026;Item {d};-{d},50\n" for d in range(1, 11))
+    content = ("Data;Descrição;Valor\n" + linhas).encode("utf-8")
+
+    blocos, err = iterar_planilha(UploadStub(content, "extrato.csv"), chunk_rows=3)
+    assert err is None
+    blocos = list(blocos)
+    assert [len(b) for b in blocos] == [3, 3, 3, 1]
+
+    inteiro, _ = processar_planilha(UploadStub(content, "extrato.csv"))
+    pd.testing.assert_frame_equal(pd.concat(blocos, ignore_index=True), inteiro)
+    assert list(inteiro["tipo"].unique()) == ["saida"]
+
+
+def test_valores_nao_dependem_do_tamanho_do_bloco():
+    content = "data;historico;debito;credito\n01/02/2026;Aluguel;1.500;\n02/02/2026;Mercado;1.200;\n03/02/2026;Loja;2.000,50;\n".encode("utf-8")
+
+    por_tamanho = {}
+    for chunk_rows in (1, 2, 50000):
+        blocos, err = iterar_planilha(UploadStub(content, "fatura.csv"), chunk_rows=chunk_rows)
+        assert err is None
+        por_tamanho[chunk_rows] = list(pd.concat(list(blocos), ignore_index=True)["valor"])
+
+    assert por_tamanho[1] == por_tamanho[2] == por_tamanho[50000] == [1500.0, 1200.0, 2000.5]
+
+
+def test_iterar_planilha_xlsx_read_only():
+    buffer = io.BytesIO()
+    pd.DataFrame(
+        {"Data": pd.to_datetime(["2026-02-01", "2026-02-02", "2026-02-03"]), "Histórico": ["A", "B", None], "Valor": [10.0, -2.5, 3]}
+    ).to_excel(buffer, index=False)
+
+    blocos, err = iterar_planilha(UploadStub(buffer.getvalue(), "extrato.xlsx"), chunk_rows=2)
+    assert err is None
+    df = pd.concat(list(blocos), ignore_index=True)
+
+    esperado = pd.read_excel(io.BytesIO(buffer.getvalue()))
+    assert list(df["data"]) == list(esperado["Data"])
+    assert list(df["valor"]) == [10.0, 2.5, 3.0]
+    assert list(df["tipo"]) == ["entrada", "saida", "entrada"]
+    assert df["descricao"].iloc[2] == "nan"
+
+
+def test_layout_conhecido_pula_sniffer_e_usa_formato_registrado():
+    registro = {}
+    content = "Data;Histórico;Valor;Saldo\n01/02/2026;Padaria;-12,34;100\n03/02/2026;Pix;50,00;150\n".encode("utf-8")
+
+    df1, err = processar_planilha(UploadStub(content, "jan.csv"), registro.get, registro.__setitem__)
+    assert err is None
+    (layout,) = registro.values()
+    assert (layout.sep, layout.formato_data, layout.decimal) == (";", "%d/%m/%Y", "br")
+    assert layout.colunas["descricao"] == "Histórico"
+
+    with mock.patch.object(planilhas, "_detectar_sep", side_effect=AssertionError("sniffer")):
+        df2, err = processar_planilha(UploadStub(content, "jan.csv"), registro.get, registro.__setitem__)
+    assert err is None
+    pd.testing.assert_frame_equal(df1, df2)
+    assert list(df2["valor"]) == [12.34, 50.0]
+
+    # Mesmo cabeçalho, linha fora do formato registrado: cai no ISO/inferência em vez de virar NaT.
+    content = "Data;Histórico;Valor;Saldo\n2026-02-03;Pix;50,00;150\n".encode("utf-8")
+    df3, _ = processar_planilha(UploadStub(content, "fev.csv"), registro.get, registro.__setitem__)
+    assert df3["data"].iloc[0] == pd.Timestamp("2026-02-03")
+
+
+def test_detecta_encoding_e_preserva_acentos_latin1():
+    assert planilhas._detectar_encoding(b"\xef\xbb\xbfdata;valor") == "utf-8-sig"
+    assert planilhas._detectar_encoding("descrição".encode("utf-8")[:-1]) == "utf-8"  # multibyte cortado
+    assert planilhas._detectar_encoding("descrição".encode("cp1252")) == "cp1252"
+    assert planilhas._detectar_encoding(b"caf\xe9 \x81") == "latin-1"
+
+    content = "data;descrição;valor\n01/02/2026;Padaria São João;12,34\n".encode("cp1252")
+    df, err = processar_planilha(UploadStub(content, "banco.csv"))
+
+    assert err is None
+    assert df.iloc[0]["descricao"] == "Padaria São João"
+
+
+def test_erro_do_engine_c_cai_no_engine_python_sem_duplicar_linhas():
+    linhas = "".join(f"{d:02d}/01/2026;Item {d};{d},00\n" for d in range(1, 8))
+    content = ("data;descricao;valor\n" + linhas + "08/01/2026;Loja;Centro;8,00\n09/01/2026;Item 9;9,00\n").encode("utf-8")
+
+    blocos, err = iterar_planilha(UploadStub(content, "extrato.csv"), chunk_rows=3)
+
+    assert err is None
+    df = pd.concat(list(blocos), ignore_index=True)
+    assert list(df["descricao"]) == [f"Item {d}" for d in range(1, 8)] + ["Loja;Centro", "Item 9"]
+    assert list(df["valor"]) == [float(d) for d in range(1, 10)]
+    assert set(df["tipo"]) == {"entrada"}
+
+
+def test_campo_a_mais_na_primeira_linha_de_dados_nao_vira_indice():
+    content = "data;descricao;valor\n01/02/2026;Loja; Filial 2;-10,00\n02/02/2026;Mercado;-20,00\n".encode("utf-8")
+
+    df, err = processar_planilha(UploadStub(content, "extrato.csv"))
+
+    assert err is None
+    assert list(df["data"].dt.strftime("%Y-%m-%d")) == ["2026-02-01", "2026-02-02"]
+    assert list(df["descricao"]) == ["Loja; Filial 2", "Mercado"]
+    assert list(df["valor"]) == [10.0, 20.0]
+    assert list(df["tipo"]) == ["saida", "saida"]
+
+
+def test_linha_com_campo_a_mais_em_layout_conhecido_nao_corta_o_valor():
+    registro = {}
+    cabecalho = "data;descricao;valor;saldo\n"
+    processar_planilha(UploadStub((cabecalho + "07/01/2026;Item;7,00;1\n").encode("utf-8"), "jan.csv"), registro.get, registro.__setitem__)
+
+    content = (cabecalho + "07/01/2026;Item;7,00;1\n08/01/2026;Loja;Centro;-8,00;2\n").encode("utf-8")
+    df, err = processar_planilha(UploadStub(content, "fev.csv"), registro.get, registro.__setitem__)
+
+    assert err is None
+    assert list(df["descricao"]) == ["Item", "Loja;Centro"]
+    assert list(df["valor"]) == [7.0, 8.0]
+    assert list(df["tipo"]) == ["entrada", "saida"]
+
+
+class TestImportSpreadsheet(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.old_db = localDB.DB_NAME
+        self.old_ingest = localDB.INGEST_DB_NAME
+        localDB.DB_NAME = os.path.join(self.tmpdir.name, "dados_test.db")
+        localDB.INGEST_DB_NAME = os.path.join(self.tmpdir.name, "ingest_test.db")
+        localDB.init_db()
+        localDB.init_ingest_db()
+
+    def tearDown(self):
+        localDB.DB_NAME = self.old_db
+        localDB.INGEST_DB_NAME = self.old_ingest
+        self.tmpdir.cleanup()
+
+    def test_chunks_stream_into_staging_and_dedup(self):
+        linhas = "".join(f"{d:02d}/01/2026;Item {d};{d},00\n" for d in range(1, 8))
+        content = ("data;descricao;valor\n" + linhas).encode("utf-8")
+
+        inserted, err = localDB.import_spreadsheet(UploadStub(content, "export.csv"), chunk_rows=2)
+        self.assertIsNone(err)
+        self.assertEqual(inserted, 7)
+
+        inserted, err = localDB.import_spreadsheet(UploadStub(content, "export.csv"), chunk_rows=3)
+        self.assertEqual(inserted, 0)
+
+        (layout,) = localDB.list_spreadsheet_layouts()
+        self.assertEqual(layout["hits"], 1)
+        self.assertEqual(layout["layout"]["formato_data"], "%d/%m/%Y")
+        self.assertEqual(localDB.get_counters("spreadsheet_layout_"), {"spreadsheet_layout_misses": 1.0, "spreadsheet_layout_hits": 1.0})
+
+        df = localDB.get_all_transactions()
+        self.assertEqual(len(df), 7)
+        self.assertIn("2026-01-07", set(df["data"]))
+
+        inserted, err = localDB.import_spreadsheet(UploadStub(b"foo;bar\n1;2\n", "ruim.csv"))
+        self.assertEqual(inserted, 0)
+        self.assertIn("data", err)
+
+
+class TestLayoutDecimal(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.old_db = localDB.DB_NAME
+        self.old_ingest = localDB.INGEST_DB_NAME
+        localDB.DB_NAME = os.path.join(self.tmpdir.name, "dados_test.db")
+        localDB.INGEST_DB_NAME = os.path.join(self.tmpdir.name, "ingest_test.db")
+        localDB.init_db()
+        localDB.init_ingest_db()
+
+    def tearDown(self):
+        localDB.DB_NAME = self.old_db
+        localDB.INGEST_DB_NAME = self.old_ingest
+        self.tmpdir.cleanup()
+
+    def test_inteiros_no_primeiro_export_nao_fixam_ponto_decimal(self):
+        jan = "Data;Histórico;Valor\n05/01/2026;Mercado;12\n10/01/2026;Aluguel;250\n".encode("utf-8")
+        fev = "Data;Histórico;Valor\n05/02/2026;Aluguel;1.800,00\n06/02/2026;Padaria;12,50\n".encode("utf-8")
+
+        df_jan, err = processar_planilha(UploadStub(jan, "jan.csv"), localDB.get_spreadsheet_layout, localDB.save_spreadsheet_layout)
+        self.assertIsNone(err)
+        self.assertEqual(list(df_jan["valor"]), [12.0, 250.0])
+        (layout,) = localDB.list_spreadsheet_layouts()
+        self.assertEqual(layout["layout"]["decimal"], "br")
+
+        df_fev, err = processar_planilha(UploadStub(fev, "fev.csv"), localDB.get_spreadsheet_layout, localDB.save_spreadsheet_layout)
+        self.assertIsNone(err)
+        self.assertEqual(list(df_fev["valor"]), [1800.0, 12.5])
+
+    def test_layout_ponto_registrado_nao_zera_valores_br(self):
+        fingerprint = planilhas._fingerprint_csv(b"Data;Hist\xc3\xb3rico;Valor\n")
+        localDB.save_spreadsheet_layout(
+            fingerprint,
+            planilhas.LayoutPlanilha({"data": "Data", "descricao": "Histórico", "valor": "Valor", "debito": None, "credito": None}, ";", "%d/%m/%Y", "ponto"),
+        )
+        content = "Data;Histórico;Valor\n05/02/2026;Aluguel;1.800,00\n06/02/2026;Padaria;12,50\n07/02/2026;Pix;3.25\n".encode("utf-8")
+
+        df, err = processar_planilha(UploadStub(content, "fev.csv"), localDB.get_spreadsheet_layout, localDB.save_spreadsheet_layout)
+
+        self.assertIsNone(err)
+        self.assertEqual(list(df["valor"]), [1800.0, 12.5, 3.25])
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+import localDB
+
+TESTS_DIR = os.path.dirname(__file__)
+
+
+class TestCostAwareScheduling(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.old_ingest = localDB.INGEST_DB_NAME
+        localDB.INGEST_DB_NAME = os.path.join(self.tmpdir.name, "ingest_test.db")
+        localDB.init_ingest_db()
+
+    def tearDown(self):
+        localDB.INGEST_DB_NAME = self.old_ingest
+        self.tmpdir.cleanup()
+
+    def test_cost_estimate_distinguishes_native_and_scanned_pdfs(self):
+        with open(os.path.join(TESTS_DIR, "extrato_teste.pdf"), "rb") as handler:
+            native = localDB.estimate_processing_cost("extrato.pdf", "application/pdf", handler.read())
+        with open(os.path.join(TESTS_DIR, "comprovativo_teste.pdf"), "rb") as handler:
+            scanned = localDB.estimate_processing_cost("comprovativo.pdf", "application/pdf", handler.read())
+        csv = localDB.estimate_processing_cost("a.csv", "text/csv", b"data,valor\n2026-01-01,10\n")
+
+        self.assertFalse(native["scanned"])
+        self.assertTrue(scanned["scanned"])
+        self.assertLess(csv["est_cost_s"], native["est_cost_s"])
+        self.assertLess(native["est_cost_s"], scanned["est_cost_s"])
+        self.assertEqual(csv["lane"], localDB.LANE_FAST)
+
+    def test_sjf_orders_by_cost_and_aging_prevents_starvation(self):
+        now = datetime.now(timezone.utc)
+        rows = [
+            ("big-old", 200.0, localDB.LANE_SLOW, now - timedelta(hours=1)),
+            ("big-new", 200.0, localDB.LANE_SLOW, now),
+            ("small", 1.0, localDB.LANE_FAST, now),
+            ("medium", 9.0, localDB.LANE_FAST, now - timedelta(seconds=30)),
+        ]
+        with localDB.get_conn(localDB.INGEST_DB_NAME) as conn:
+            for doc_id, cost, lane, created in rows:
+                conn.execute(
+                    "INSERT INTO documents (id, sha256, original_name, mime, size_bytes, storage_uri_raw, status, created_at, est_cost_s, lane) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (doc_id, doc_id, "a.pdf", "application/pdf", 1, "raw://a", localDB.STATUS_STORED, created.isoformat(timespec="seconds"), cost, lane),
+                )
+
+        ordered = [d["id"] for d in localDB.list_ingest_documents([localDB.STATUS_STORED], order="sjf")]
+        self.assertEqual(ordered, ["big-old", "small", "medium", "big-new"])
+
+        recent = [d["id"] for d in localDB.list_ingest_documents([localDB.STATUS_STORED])]
+        self.assertEqual(recent[-1], "big-old")
+
+
+if __name__ == "__main__":
+    unittest.main()
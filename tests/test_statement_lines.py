@@ -0,0 +1,143 @@
+import os
+import tempfile
+import unittest
+
+import localDB
+from parsers.ofx_parser import StatementLine, build_hash_linha, build_hash_linhas
+
+
+def test_build_hash_linhas_matches_per_line_hash():
+    lines = [
+        StatementLine("2026-01-05", "  PADARIA   SÃO JOÃO ", -12.5),
+        StatementLine(None, "PIX RECEBIDO", 100.0),
+    ]
+
+    assert build_hash_linhas("2026-01", lines) == [build_hash_linha("2026-01", ln) for ln in lines]
+
+
+class TestUpsertStatementLines(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.old_db = localDB.DB_NAME
+        localDB.DB_NAME = os.path.join(self.tmpdir.name, "dados_test.db")
+        localDB.init_db()
+
+    def tearDown(self):
+        localDB.DB_NAME = self.old_db
+        self.tmpdir.cleanup()
+
+    def _lines(self, days):
+        return [StatementLine(f"2026-01-{d:02d}", f"COMPRA {d}", -float(d)) for d in days]
+
+    def test_overlapping_statement_reports_matched_lines(self):
+        first = localDB.insert_statement(1, "Banco", "1234", "2026-01")
+        report = localDB.upsert_statement_lines(first, "2026-01", self._lines(range(1, 6)))
+        self.assertEqual(report["inserted"], 5)
+        self.assertEqual(report["duplicates"], 0)
+        self.assertEqual(report["matched_line_ids"], [])
+
+        second = localDB.insert_statement(2, "Banco", "1234", "2026-01")
+        report = localDB.upsert_statement_lines(second, "2026-01", self._lines(range(4, 9)))
+        self.assertEqual(report["inserted"], 3)
+        self.assertEqual(report["duplicates"], 2)
+        self.assertEqual(report["matched_statement_ids"], [first])
+
+        with localDB.get_conn(localDB.DB_NAME) as conn:
+            rows = conn.execute("SELECT id, statement_id, descricao FROM statement_lines ORDER BY id").fetchall()
+        by_desc = {r["descricao"]: r for r in rows}
+        self.assertEqual(report["matched_line_ids"], [by_desc["COMPRA 4"]["id"], by_desc["COMPRA 5"]["id"]])
+        self.assertEqual(len(rows), 8)
+        self.assertEqual({r["statement_id"] for r in rows if r["descricao"] == "COMPRA 8"}, {second})
+
+    def test_repeated_line_within_batch_counts_as_duplicate(self):
+        statement_id = localDB.insert_statement(1, "Banco", "1234", "2026-01")
+
+        inserted = localDB.insert_statement_lines(statement_id, "2026-01", self._lines([1, 1, 2]))
+
+        self.assertEqual(inserted, 2)
+        self.assertEqual(localDB.upsert_statement_lines(statement_id, "2026-01", [])["inserted"], 0)
+
+
+class TestInstallmentSchedule(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.old_db = localDB.DB_NAME
+        localDB.DB_NAME = os.path.join(self.tmpdir.name, "dados_test.db")
+        localDB.init_db()
+
+    def tearDown(self):
+        localDB.DB_NAME = self.old_db
+        self.tmpdir.cleanup()
+
+    def _import(self, document_id, competencia, lines):
+        statement_id = localDB.insert_statement(document_id, "Banco", "1234", competencia)
+        return localDB.insert_statement_lines(statement_id, competencia, lines)
+
+    def test_future_installments_are_projected_once_across_statements(self):
+        self._import(1, "2026-01", [
+            StatementLine("2025-12-20", "LOJA X PARC 02/04", -50.0, None, 2, 4),
+            StatementLine("2026-01-03", "MERCADO", -80.0),
+        ])
+        self.assertEqual(
+            localDB.get_installment_cash_flow("2026-01", 6),
+            [
+                {"competencia": "2026-02", "total": -50.0, "parcelas": 1},
+                {"competencia": "2026-03", "total": -50.0, "parcelas": 1},
+            ],
+        )
+
+        # A fatura seguinte traz a parcela 3: ela deixa de ser projeção e a 4 não duplica.
+        self._import(2, "2026-02", [StatementLine("2026-01-20", "LOJA X PARC 03/04", -50.0, None, 3, 4)])
+        self.assertEqual(
+            localDB.get_installment_cash_flow("2026-01", 6),
+            [{"competencia": "2026-03", "total": -50.0, "parcelas": 1}],
+        )
+
+        # Fatura antiga importada depois não volta a projetar parcelas já lidas.
+        self._import(3, "2025-12", [StatementLine("2025-11-20", "LOJA X PARC 01/04", -50.0, None, 1, 4)])
+        self.assertEqual(localDB.get_installment_cash_flow("2026-01", 6)[0]["parcelas"], 1)
+        self.assertEqual(localDB.get_installment_cash_flow("2026-02", 1), [])
+
+    def test_identical_purchases_in_different_months_keep_separate_schedules(self):
+        # Mesma loja, valor e número de parcelas, compradas em meses seguidos: a fatura de fevereiro
+        # traz a 2/3 da primeira e a 1/3 da segunda.
+        self._import(1, "2026-01", [StatementLine("2026-01-05", "LOJA Y 1/3", -30.0, None, 1, 3)])
+        self._import(2, "2026-02", [
+            StatementLine("2026-01-05", "LOJA Y 2/3", -30.0, None, 2, 3),
+            StatementLine("2026-02-05", "LOJA Y 1/3", -30.0, None, 1, 3),
+        ])
+
+        self.assertEqual(
+            localDB.get_installment_cash_flow("2026-03", 6),
+            [
+                {"competencia": "2026-03", "total": -60.0, "parcelas": 2},
+                {"competencia": "2026-04", "total": -30.0, "parcelas": 1},
+            ],
+        )
+        with localDB.get_conn(localDB.DB_NAME) as conn:
+            realizadas = conn.execute(
+                "SELECT COUNT(*) FROM installment_schedule WHERE statement_line_id IS NOT NULL"
+            ).fetchone()[0]
+        self.assertEqual(realizadas, 3)
+
+    def test_rebuild_matches_incremental_schedule(self):
+        self._import(1, "2026-11", [StatementLine("2026-11-02", "CURSO 1/3", -200.0, None, 1, 3)])
+        expected = localDB.get_installment_cash_flow("2026-11", 12)
+        self.assertEqual([r["competencia"] for r in expected], ["2026-12", "2027-01"])
+
+        with localDB.get_conn(localDB.DB_NAME) as conn:
+            conn.execute("DELETE FROM installment_schedule;")
+
+        self.assertEqual(localDB.rebuild_installment_schedule(), 3)
+        self.assertEqual(localDB.get_installment_cash_flow("2026-11", 12), expected)
+
+    def test_cash_flow_query_uses_month_index(self):
+        with localDB.get_conn(localDB.DB_NAME) as conn:
+            plan = " ".join(
+                r[-1]
+                for r in conn.execute(
+                    "EXPLAIN QUERY PLAN SELECT competencia, SUM(valor) FROM installment_schedule "
+                    "WHERE statement_line_id IS NULL AND competencia BETWEEN '2026-01' AND '2026-12' GROUP BY competencia"
+                )
+            )
+        self.assertIn("idx_installment_month", plan)
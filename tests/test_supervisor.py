@@ -0,0 +1,13 @@
+from supervisor import desired_workers
+
+
+def test_scales_with_queue_depth_within_bounds():
+    assert desired_workers(0, 0, current=3, min_workers=1, max_workers=8) == 1
+    assert desired_workers(12, 5, current=1, min_workers=1, max_workers=8, jobs_per_worker=5) == 3
+    assert desired_workers(500, 5, current=1, min_workers=1, max_workers=8) == 8
+
+
+def test_old_backlog_adds_a_worker_even_when_depth_is_small():
+    assert desired_workers(2, 10, current=2, min_workers=1, max_workers=8, max_wait_s=60) == 1
+    assert desired_workers(2, 120, current=2, min_workers=1, max_workers=8, max_wait_s=60) == 3
+    assert desired_workers(2, 120, current=8, min_workers=1, max_workers=8, max_wait_s=60) == 8
@@ -0,0 +1,114 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+import localDB
+
+
+class TestTransactionsPage(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.old_db = localDB.DB_NAME
+        localDB.DB_NAME = os.path.join(self.tmpdir.name, "dados_test.db")
+        localDB.init_db()
+
+        rows = []
+        for i in range(25):
+            rows.append(
+                {
+                    # Várias linhas na mesma data, para o desempate por id.
+                    "data": f"2026-0{1 + i % 3}-{1 + i // 5:02d}",
+                    "descricao": f"Item {i}",
+                    "valor": float(i + 1),
+                    "fonte": "fatura.ofx" if i % 2 else "extrato.csv",
+                    "categoria": "Mercado" if i % 4 else "Lazer",
+                    "tipo": "entrada" if i % 5 == 0 else "saida",
+                }
+            )
+        localDB.insert_transactions(pd.DataFrame(rows))
+
+    def tearDown(self):
+        localDB.DB_NAME = self.old_db
+        self.tmpdir.cleanup()
+
+    def _walk(self, limit, **filters):
+        pages, cursor = [], None
+        while True:
+            page, cursor = localDB.get_transactions_page(after=cursor, limit=limit, **filters)
+            pages.append(page)
+            if cursor is None:
+                return pages
+
+    def test_pages_cover_history_in_order_without_overlap(self):
+        pages = self._walk(4)
+
+        self.assertEqual([len(p) for p in pages], [4, 4, 4, 4, 4, 4, 1])
+        walked = pd.concat(pages, ignore_index=True)
+        expected = localDB.get_all_transactions().sort_values(["data", "id"], ascending=False, ignore_index=True)
+        self.assertEqual(walked["id"].tolist(), expected["id"].tolist())
+
+    def test_filters_combine_with_pagination(self):
+        filters = {"start_date": "2026-02-01", "end_date": "2026-03-31", "tipo": "saida", "categoria": "Mercado", "fonte": "fatura.ofx"}
+        walked = pd.concat(self._walk(2, **filters), ignore_index=True)
+
+        full = localDB.get_all_transactions()
+        expected = full[
+            (full["data"] >= "2026-02-01")
+            & (full["data"] <= "2026-03-31")
+            & (full["tipo"] == "saida")
+            & (full["categoria"] == "Mercado")
+            & (full["fonte"] == "fatura.ofx")
+        ].sort_values(["data", "id"], ascending=False)
+        self.assertGreater(len(expected), 2)
+        self.assertEqual(walked["id"].tolist(), expected["id"].tolist())
+
+    def test_filtered_pages_are_served_by_index_order(self):
+        with localDB.get_conn(localDB.DB_NAME) as conn:
+            for column in ("tipo", "categoria", "fonte", "document_id"):
+                plan = " | ".join(
+                    r[-1]
+                    for r in conn.execute(
+                        f"EXPLAIN QUERY PLAN SELECT * FROM transacoes WHERE {column} = ? AND (data, id) < (?, ?) "
+                        "ORDER BY data DESC, id DESC LIMIT 10",
+                        ("x", "2026-01-01", 10),
+                    )
+                )
+                self.assertIn("USING INDEX", plan, column)
+                self.assertNotIn("TEMP B-TREE", plan, column)
+
+
+class TestDocumentItemsPage(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.old_db = localDB.DB_NAME
+        localDB.DB_NAME = os.path.join(self.tmpdir.name, "dados_test.db")
+        localDB.init_db()
+
+        with localDB.get_conn(localDB.DB_NAME) as conn:
+            for doc in ("doc-a", "doc-b"):
+                resumo_id = conn.execute(
+                    "INSERT INTO documento_resumos (document_id, fonte, total_itens, qtd_itens) VALUES (?, 'nota.pdf', 0, 3)",
+                    (doc,),
+                ).lastrowid
+                conn.executemany(
+                    "INSERT INTO documento_itens (resumo_id, data, descricao, valor) VALUES (?, '2026-01-01', ?, 1.0)",
+                    [(resumo_id, f"{doc} {i}") for i in range(3)],
+                )
+
+    def tearDown(self):
+        localDB.DB_NAME = self.old_db
+        self.tmpdir.cleanup()
+
+    def test_items_page_by_document(self):
+        first, cursor = localDB.get_document_items_page("doc-a", limit=2)
+        second, last = localDB.get_document_items_page("doc-a", after=cursor, limit=2)
+
+        self.assertEqual(first["descricao"].tolist(), ["doc-a 2", "doc-a 1"])
+        self.assertEqual(second["descricao"].tolist(), ["doc-a 0"])
+        self.assertIsNone(last)
+
+        everything, _ = localDB.get_document_items_page(limit=10)
+        self.assertEqual(len(everything), 6)
+        self.assertEqual(everything["document_id"].iloc[0], "doc-b")
@@ -0,0 +1,113 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from PIL import Image
+
+import localDB
+import tasks
+
+
+class TestTwoPhaseExtraction(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.old_db = localDB.DB_NAME
+        self.old_ingest = localDB.INGEST_DB_NAME
+        localDB.DB_NAME = os.path.join(self.tmpdir.name, "dados_test.db")
+        localDB.INGEST_DB_NAME = os.path.join(self.tmpdir.name, "ingest_test.db")
+        localDB.init_db()
+        localDB.init_ingest_db()
+
+        self.old_ocr = localDB.extrair_texto_imagem
+        self.old_regex = localDB.extrair_dados_financeiros
+        self.old_llm = localDB.extrair_dados_financeiros_llm
+        self.old_categorize = localDB.categorizar_transacoes_llm
+        self.calls = {"llm": 0}
+
+        def fake_llm(_text):
+            self.calls["llm"] += 1
+            return [
+                {"data": "2026-01-01", "descricao": "Mercado", "valor": 10.0, "categoria": "Alimentação", "tipo": "saida"},
+                {"data": "2026-01-02", "descricao": "Uber", "valor": 22.5, "categoria": "Transporte", "tipo": "saida"},
+            ], None
+
+        localDB.extrair_texto_imagem = lambda _upload: ("EXTRATO CONTA CORRENTE\n01/01/2026 MERCADO 10,00", 0.01, None)
+        localDB.extrair_dados_financeiros = lambda _text: [{"data": "2026-01-01", "descricao": "Mercado", "valor": 10.0}]
+        localDB.extrair_dados_financeiros_llm = fake_llm
+        localDB.categorizar_transacoes_llm = lambda transacoes, categorias_conhecidas=None: (transacoes, None)
+
+    def tearDown(self):
+        localDB.extrair_texto_imagem = self.old_ocr
+        localDB.extrair_dados_financeiros = self.old_regex
+        localDB.extrair_dados_financeiros_llm = self.old_llm
+        localDB.categorizar_transacoes_llm = self.old_categorize
+        localDB.DB_NAME = self.old_db
+        localDB.INGEST_DB_NAME = self.old_ingest
+        self.tmpdir.cleanup()
+
+    def _store_doc(self, name):
+        img = Image.new("RGB", (200, 120), color=(255, 255, 255))
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        return localDB.store_raw_document(name, "image/png", buf.getvalue(), storage_root=self.tmpdir.name)
+
+    def test_provisional_then_llm_refinement_creates_new_version(self):
+        doc = self._store_doc("extrato.png")
+
+        ok, _ = localDB.run_pipeline_for_document(doc["id"], defer_llm=True)
+        self.assertTrue(ok)
+        self.assertEqual(self.calls["llm"], 0)
+        current = {d["id"]: d for d in localDB.list_ingest_documents()}[doc["id"]]
+        self.assertEqual(current["status"], localDB.STATUS_HITL_REVIEW)
+        self.assertTrue(localDB.needs_llm_refinement(doc["id"]))
+
+        history = localDB.get_extraction_history(doc["id"])
+        self.assertEqual([(h["version"], h["status"]) for h in history], [(1, localDB.EXTRACTION_PROVISIONAL)])
+
+        ok, _ = localDB.refine_extraction_with_llm(doc["id"])
+        self.assertTrue(ok)
+        self.assertEqual(self.calls["llm"], 1)
+        self.assertFalse(localDB.needs_llm_refinement(doc["id"]))
+
+        history = localDB.get_extraction_history(doc["id"])
+        self.assertEqual(
+            [(h["version"], h["extractor"], h["status"]) for h in history],
+            [(2, "llm", localDB.EXTRACTION_PENDING), (1, "regex", localDB.EXTRACTION_SUPERSEDED)],
+        )
+        _, payload, _, extractor, _, _ = localDB.get_latest_extraction_payload(doc["id"])
+        self.assertEqual(extractor, "llm")
+        self.assertEqual(len(payload), 2)
+
+    def test_refinement_job_is_enqueued_only_while_pending(self):
+        doc = self._store_doc("extrato3.png")
+        localDB.run_pipeline_for_document(doc["id"], defer_llm=True)
+        connection = mock.MagicMock()
+
+        with mock.patch.object(tasks, "_enqueue_coalesced") as enqueue:
+            self.assertTrue(tasks._enqueue_refinement(doc["id"], connection))
+            localDB.refine_extraction_with_llm(doc["id"])
+            self.assertFalse(tasks._enqueue_refinement(doc["id"], connection))
+
+        enqueue.assert_called_once()
+        queue, func, stage, document_id = enqueue.call_args.args
+        self.assertEqual(queue.name, tasks.EXTRACTION_QUEUE)
+        self.assertIs(func, tasks.refine_extraction_job)
+        self.assertEqual((stage, document_id), (tasks.JOB_STAGE_REFINE, doc["id"]))
+        self.assertEqual(enqueue.call_args.kwargs, {"job_timeout": tasks.EXTRACTION_JOB_TIMEOUT})
+
+    def test_refinement_is_skipped_after_review_submitted(self):
+        doc = self._store_doc("extrato2.png")
+        localDB.run_pipeline_for_document(doc["id"], defer_llm=True)
+        localDB.submit_hitl_review(doc["id"], "ana", "APPROVED", [{"data": "2026-01-01", "descricao": "Mercado", "valor": 10.0}])
+
+        ok, message = localDB.refine_extraction_with_llm(doc["id"])
+        self.assertTrue(ok)
+        self.assertIn("ignorado", message)
+        self.assertEqual(self.calls["llm"], 0)
+        self.assertEqual(len(localDB.get_extraction_history(doc["id"])), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,42 @@
 import os
+import sys
+from typing import List, Optional
 
 from redis import Redis
-from rq import Connection, Queue, Worker
+from rq import Queue, Worker
+
+from concurrency import ADAPTIVE_CONCURRENCY
+from localDB import init_ingest_db
+from tasks import ALL_QUEUES, OCR_QUEUES, schedule_concurrency_controller, schedule_reaper
 
-listen = ["mn2512"]
 redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
-conn = Redis.from_url(redis_url)
+
+def warm_ocr() -> None:
+    """Carrega o EasyOCR antes do primeiro job; os work-horses (fork) herdam o modelo já em memória."""
+    from ocr import obter_leitor_ocr
+
+    obter_leitor_ocr(("pt", "en"), gpu=False)
+
+
+def run_worker(queues: List[str], url: Optional[str] = None, name: Optional[str] = None) -> None:
+    conn = Redis.from_url(url or redis_url)
+    # Schema uma vez por worker; os jobs (aquisição de vaga, limite vigente) assumem as tabelas prontas.
+    init_ingest_db()
+    if any(q in OCR_QUEUES for q in queues):
+        warm_ocr()
+    # Recupera vagas de workers que morreram (OOM/timeout) e reenfileira os documentos.
+    schedule_reaper(conn, delay_s=0)
+    if ADAPTIVE_CONCURRENCY:
+        schedule_concurrency_controller(conn, delay_s=0)
+    # SIGTERM: o RQ termina o job em andamento antes de sair (warm shutdown).
+    worker = Worker([Queue(q, connection=conn) for q in queues], connection=conn, name=name)
+    worker.work(with_scheduler=True)
+
 
 if __name__ == "__main__":
-    with Connection(conn):
-        worker = Worker(map(Queue, listen))
-        worker.work(with_scheduler=True)
+    # Filas deste worker: argumentos da linha de comando ou RQ_QUEUES="mn2512-text,mn2512-extraction".
+    # Ex.: poucos workers `python worker.py mn2512-text` (OCR) e vários `python worker.py mn2512-extraction` (LLM).
+    # Para um pool com autoscaling, use `python supervisor.py`.
+    listen = sys.argv[1:] or [q.strip() for q in os.getenv("RQ_QUEUES", ",".join(ALL_QUEUES)).split(",") if q.strip()]
+    run_worker(listen)